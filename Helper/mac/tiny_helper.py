@@ -1,10 +1,14 @@
-import requests
 import socket
 import uuid
 import platform
 import time
-import sys
 import os
+import random
+import json
+import queue
+import threading
+import atexit
+from datetime import datetime
 from pathlib import Path
 
 # =====================================================
@@ -14,8 +18,30 @@ from pathlib import Path
 BACKEND_BASE = "https://mytinylittlehelper.com"
 REGISTER_ENDPOINT = f"{BACKEND_BASE}/add_device_advanced_token"
 HEARTBEAT_ENDPOINT = f"{BACKEND_BASE}/device_heartbeat"
+HEARTBEAT_BATCH_ENDPOINT = f"{BACKEND_BASE}/device_heartbeat_batch"
 HEARTBEAT_INTERVAL = 30  # seconds
 
+# "urllib" keeps the frozen app stdlib-only; "requests" uses the requests package
+HTTP_BACKEND = os.environ.get("TLH_HTTP_BACKEND", "urllib")
+# "msgpack" (opt-in, needs the package on both ends) or "json"; a server
+# that can't read msgpack answers 415 and the helper switches to JSON
+WIRE_FORMAT = os.environ.get("TLH_WIRE_FORMAT", "json")
+
+SPOOL_MAX_ROWS = 2880      # ring buffer size, ~24h at 30s
+REPLAY_BATCH_SIZE = 200    # heartbeats per replay request
+REPLAY_MIN_INTERVAL = 10   # seconds between replay requests
+REPLAY_JITTER = 60         # random delay before replaying after an outage
+REGISTER_RETRY_MIN = 30    # first retry delay when registration fails ...
+REGISTER_RETRY_MAX = 900   # ... doubling up to this cap
+
+LOG_LEVEL = os.environ.get("TLH_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("TLH_LOG_FORMAT", "text")  # "text" or "json"
+LOG_MAX_BYTES = 1024 * 1024   # rotate at 1 MB ...
+LOG_MAX_AGE = 24 * 60 * 60    # ... or after a day, whichever comes first
+LOG_BACKUP_COUNT = 3
+LOG_QUEUE_SIZE = 1000         # records are dropped (and counted) beyond this
+LOG_FLUSH_INTERVAL = 2        # seconds
+
 APP_NAME = "TinyLittleHelper"
 
 # =====================================================
@@ -30,30 +56,122 @@ def get_app_support_dir():
 APP_DIR = get_app_support_dir()
 TOKEN_FILE = APP_DIR / "device_token.txt"
 LOG_FILE = APP_DIR / "helper_debug.log"
+SPOOL_FILE = APP_DIR / "heartbeat_spool.db"
 
 # =====================================================
 # LOGGING
 # =====================================================
 
-def log(msg):
-    try:
-        with open(LOG_FILE, "a") as f:
-            f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {msg}\n")
-    except Exception:
-        pass
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+class BackgroundLogger:
+    """Queues log records and writes them in batches from a daemon thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self.level = LOG_LEVELS.get(LOG_LEVEL, LOG_LEVELS["INFO"])
+        self.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self.dropped = 0
+        self.file = None
+        self.file_started = 0.0
+        self.thread = threading.Thread(target=self._run, name="helper-log", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def log(self, msg, level="INFO"):
+        if LOG_LEVELS.get(level, LOG_LEVELS["INFO"]) < self.level:
+            return
+        try:
+            self.queue.put_nowait((time.time(), level, msg))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        try:
+            self.queue.put(None, timeout=1)
+        except queue.Full:
+            pass
+        self.thread.join(timeout=2)
+
+    def _format(self, ts, level, msg):
+        if LOG_FORMAT == "json":
+            return json.dumps({"t": round(ts, 3), "l": level, "m": str(msg)}, separators=(",", ":")) + "\n"
+        return f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))} - {level} - {msg}\n"
+
+    def _rotate_if_needed(self):
+        if self.file is None:
+            return
+        if self.file.tell() < LOG_MAX_BYTES and time.time() - self.file_started < LOG_MAX_AGE:
+            return
+
+        self.file.close()
+        self.file = None
+        for i in range(LOG_BACKUP_COUNT - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                os.replace(src, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+
+    def _write(self, records):
+        lines = "".join(self._format(*rec) for rec in records)
+        if self.dropped:
+            lines += self._format(time.time(), "WARNING", f"{self.dropped} log records dropped")
+            self.dropped = 0
+
+        self._rotate_if_needed()
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+            self.file_started = time.time()
+        self.file.write(lines)
+        self.file.flush()
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=LOG_FLUSH_INTERVAL)]
+            except queue.Empty:
+                continue
+            while len(batch) < 256:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            records = [rec for rec in batch if rec is not None]
+            try:
+                if records or self.dropped:
+                    self._write(records)
+            except Exception:
+                pass
+            if stop:
+                if self.file:
+                    self.file.close()
+                return
+
+_logger = None
+
+def log(msg, level="INFO"):
+    global _logger
+    if _logger is None:
+        _logger = BackgroundLogger(LOG_FILE)
+    _logger.log(msg, level)
 
 # =====================================================
 # DEVICE TOKEN
 # =====================================================
 
-def get_device_token():
-    if TOKEN_FILE.exists():
-        return TOKEN_FILE.read_text().strip()
-    token = str(uuid.uuid4())
-    TOKEN_FILE.write_text(token)
-    return token
+_device_token = None
 
-DEVICE_TOKEN = get_device_token()
+def get_device_token():
+    global _device_token
+    if _device_token is None:
+        if TOKEN_FILE.exists():
+            _device_token = TOKEN_FILE.read_text().strip()
+        else:
+            _device_token = str(uuid.uuid4())
+            TOKEN_FILE.write_text(_device_token)
+    return _device_token
 
 # =====================================================
 # DEVICE INFO
@@ -77,62 +195,249 @@ def get_local_ip():
 
 def get_public_ip():
     try:
-        r = requests.get("https://api.ipify.org?format=json", timeout=5)
-        return r.json().get("ip", "unknown")
+        status, text, _ = http_request("GET", "https://api.ipify.org?format=json", timeout=5)
+        return json.loads(text).get("ip", "unknown") if status == 200 else "unknown"
     except Exception:
         return "unknown"
 
-def get_ip():
-    public_ip = get_public_ip()
-    local_ip = get_local_ip()
-    log(f"IP detected - Public: {public_ip}, Local: {local_ip}")
+def pick_ip(public_ip, local_ip):
+    log(f"IP detected - Public: {public_ip}, Local: {local_ip}", "DEBUG")
     return public_ip if public_ip != "unknown" else local_ip
 
+def get_ip():
+    return pick_ip(get_public_ip(), get_local_ip())
+
 def get_mac():
     mac_num = uuid.getnode()
     return ":".join(f"{(mac_num >> ele) & 0xff:02x}" for ele in range(40, -1, -8))
 
+# =====================================================
+# OFFLINE SPOOL
+# =====================================================
+
+_next_replay_at = time.monotonic() + random.uniform(0, REPLAY_JITTER)
+_backend_reachable = True
+
+def spool_connect():
+    import sqlite3
+
+    conn = sqlite3.connect(SPOOL_FILE)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS spool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts TEXT NOT NULL,
+            ip TEXT
+        )
+    """)
+    return conn
+
+def spool_heartbeat(payload):
+    try:
+        conn = spool_connect()
+        conn.execute(
+            "INSERT INTO spool (ts, ip) VALUES (?, ?)",
+            (payload["ts"], payload.get("ip"))
+        )
+        # Ring buffer: only the newest SPOOL_MAX_ROWS points are kept
+        conn.execute(
+            "DELETE FROM spool WHERE id <= (SELECT MAX(id) FROM spool) - ?",
+            (SPOOL_MAX_ROWS,)
+        )
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        log(f"Spool write failed: {e}", "ERROR")
+
+def replay_spool():
+    global _next_replay_at
+
+    if time.monotonic() < _next_replay_at:
+        return
+    _next_replay_at = time.monotonic() + REPLAY_MIN_INTERVAL
+
+    try:
+        conn = spool_connect()
+        rows = conn.execute(
+            "SELECT id, ts, ip FROM spool ORDER BY id LIMIT ?",
+            (REPLAY_BATCH_SIZE,)
+        ).fetchall()
+
+        if not rows:
+            conn.close()
+            return
+
+        import gzip
+
+        body = gzip.compress(json.dumps({
+            "token": get_device_token(),
+            "heartbeats": [{"ts": ts, "ip": ip} for _, ts, ip in rows]
+        }).encode())
+
+        status, _, headers = http_request(
+            "POST",
+            HEARTBEAT_BATCH_ENDPOINT,
+            body,
+            {"Content-Type": "application/json", "Content-Encoding": "gzip"},
+            timeout=10
+        )
+        if status == 200:
+            conn.execute("DELETE FROM spool WHERE id <= ?", (rows[-1][0],))
+            conn.commit()
+            log(f"Replayed {len(rows)} spooled heartbeats")
+        elif status in (429, 503):
+            # Server asked us to slow down
+            retry_after = headers.get("Retry-After") or ""
+            delay = int(retry_after) if retry_after.isdigit() else REPLAY_JITTER
+            _next_replay_at = time.monotonic() + delay + random.uniform(0, REPLAY_JITTER)
+        elif 400 <= status < 500 and status != 408:
+            # Rejected for good (unknown device, bad or oversized batch):
+            # retrying would block the rest of the spool behind it
+            conn.execute("DELETE FROM spool WHERE id <= ?", (rows[-1][0],))
+            conn.commit()
+            log(f"Spool replay rejected ({status}), dropped {len(rows)} heartbeats", "ERROR")
+        else:
+            log(f"Spool replay failed ({status})", "WARNING")
+
+        conn.close()
+    except Exception as e:
+        log(f"Spool replay exception: {e}", "ERROR")
+
 # =====================================================
 # BACKEND COMMUNICATION
 # =====================================================
 
+_ssl_context = None
+
+def http_request(method, url, body=None, headers=None, timeout=10):
+    """Returns (status, text, headers) using the configured HTTP backend."""
+    global _ssl_context
+
+    if HTTP_BACKEND == "requests":
+        import requests
+
+        r = requests.request(method, url, data=body, headers=headers, timeout=timeout)
+        return r.status_code, r.text, r.headers
+
+    import ssl
+    import urllib.request
+    import urllib.error
+
+    if _ssl_context is None:
+        try:
+            import certifi
+            _ssl_context = ssl.create_default_context(cafile=certifi.where())
+        except ImportError:
+            _ssl_context = ssl.create_default_context()
+
+    req = urllib.request.Request(url, data=body, headers=headers or {}, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout, context=_ssl_context) as resp:
+            return resp.status, resp.read().decode("utf-8", "replace"), resp.headers
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode("utf-8", "replace"), e.headers
+
+def encode_payload(payload):
+    if WIRE_FORMAT == "msgpack":
+        try:
+            import msgpack
+            return msgpack.packb(payload), "application/msgpack"
+        except ImportError:
+            pass
+    return json.dumps(payload).encode(), "application/json"
+
+def post_payload(url, payload, timeout=10):
+    global WIRE_FORMAT
+
+    body, content_type = encode_payload(payload)
+    status, text, headers = http_request("POST", url, body, {"Content-Type": content_type}, timeout=timeout)
+    if status == 415 and content_type != "application/json":
+        log(f"Server can't read {content_type}, switching to JSON", "WARNING")
+        WIRE_FORMAT = "json"
+        body, content_type = encode_payload(payload)
+        status, text, headers = http_request("POST", url, body, {"Content-Type": content_type}, timeout=timeout)
+    return status, text, headers
+
+def gather_device_facts():
+    """Looks up the public and local IP concurrently."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        public_ip = pool.submit(get_public_ip)
+        local_ip = pool.submit(get_local_ip)
+        facts = {
+            "token": get_device_token(),
+            "device_name": get_device_name(),
+            "mac": get_mac(),
+            "os": get_os(),
+        }
+        facts["ip"] = pick_ip(public_ip.result(), local_ip.result())
+        facts["recent_sites"] = []  # intentionally empty on macOS
+    return facts
+
 def register_device():
-    payload = {
-        "token": DEVICE_TOKEN,
-        "device_name": get_device_name(),
-        "ip": get_ip(),
-        "mac": get_mac(),
-        "os": get_os(),
-        "recent_sites": []  # intentionally empty on macOS
-    }
+    payload = gather_device_facts()
 
     try:
-        r = requests.post(REGISTER_ENDPOINT, json=payload, timeout=10)
-        if r.status_code == 200:
-            log(f"Device registered successfully: {r.text}")
+        status, text, _ = post_payload(REGISTER_ENDPOINT, payload, timeout=10)
+        if status == 200:
+            log(f"Device registered successfully: {text}")
             return True
         else:
-            log(f"Registration failed ({r.status_code}): {r.text}")
+            log(f"Registration failed ({status}): {text}", "WARNING")
             return False
     except Exception as e:
-        log(f"Registration exception: {e}")
+        log(f"Registration exception: {e}", "ERROR")
         return False
 
 def send_heartbeat():
-    payload = {
-        "token": DEVICE_TOKEN,
-        "device_name": get_device_name(),
-        "ip": get_ip(),
-        "mac": get_mac(),
-        "recent_sites": []
-    }
+    global _backend_reachable, _next_replay_at
+
+    payload = gather_device_facts()
+    payload["ts"] = datetime.utcnow().isoformat()
 
     try:
-        r = requests.post(HEARTBEAT_ENDPOINT, json=payload, timeout=5)
-        if r.status_code != 200:
-            log(f"Heartbeat failed ({r.status_code})")
+        status, _, _ = post_payload(HEARTBEAT_ENDPOINT, payload, timeout=5)
+        if status != 200:
+            log(f"Heartbeat failed ({status})", "WARNING")
+            if status >= 500:
+                _backend_reachable = False
+                spool_heartbeat(payload)
+            return
     except Exception as e:
-        log(f"Heartbeat exception: {e}")
+        log(f"Heartbeat exception: {e}", "ERROR")
+        _backend_reachable = False
+        spool_heartbeat(payload)
+        return
+
+    if not _backend_reachable:
+        # Back online: spread replays out so helpers don't all hit the server at once
+        _backend_reachable = True
+        _next_replay_at = time.monotonic() + random.uniform(0, REPLAY_JITTER)
+
+    replay_spool()
+
+def wait_for_registration():
+    """Retries registration with jittered backoff, spooling heartbeats meanwhile.
+
+    A helper started during a backend outage (e.g. after a reboot) keeps its
+    uptime history this way; the spool is replayed once registration works.
+    """
+    global _backend_reachable
+
+    delay = REGISTER_RETRY_MIN
+    retry_at = time.monotonic()
+    while True:
+        if time.monotonic() >= retry_at:
+            if register_device():
+                return
+            wait = random.uniform(delay / 2, delay)
+            log(f"Registration failed, retrying in {int(wait)}s", "WARNING")
+            retry_at = time.monotonic() + wait
+            delay = min(delay * 2, REGISTER_RETRY_MAX)
+
+        _backend_reachable = False
+        spool_heartbeat({"ts": datetime.utcnow().isoformat(), "ip": get_local_ip()})
+        time.sleep(HEARTBEAT_INTERVAL)
 
 # =====================================================
 # MAIN LOOP
@@ -141,9 +446,7 @@ def send_heartbeat():
 def main():
     log("=== TinyLittleHelper macOS started ===")
 
-    if not register_device():
-        log("Initial registration failed. Exiting.")
-        sys.exit(1)
+    wait_for_registration()
 
     while True:
         send_heartbeat()
@@ -0,0 +1,238 @@
+import asyncio
+import heapq
+import os
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+
+from db import get_db, get_shard_db, shard_for_id
+from profiling import span
+import shared_state
+
+# --------------------------------------------------
+# OFFLINE ALERTS
+# --------------------------------------------------
+# Status transitions are pushed in by whatever notices them (the offline
+# sweep, heartbeats, the prober); devices are never scanned here, so the
+# work is proportional to the number of transitions.
+#
+#   debounce – a device must stay offline for ALERT_DEBOUNCE seconds
+#              before it is alerted, so flapping devices stay quiet
+#   grouping – alerts for one user are collected for ALERT_GROUP_WINDOW
+#              seconds and sent as a single digest
+#   sending  – all digests that are due go out over one SMTP connection
+ALERTS_ENABLED = os.getenv("ALERTS_ENABLED", "1") == "1"
+ALERT_DEBOUNCE = int(os.getenv("ALERT_DEBOUNCE", 120))
+ALERT_GROUP_WINDOW = int(os.getenv("ALERT_GROUP_WINDOW", 300))
+ALERT_TICK = 5
+ALERT_QUERY_CHUNK = 500  # ids per IN (...) query
+ALERT_MAX_LISTED = 50  # names per section of a digest
+
+
+class AlertEngine:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}      # device_id -> (user_id, generation), waiting out the debounce
+        self.alerted = set()   # devices whose offline alert went out
+        self.heap = []         # (due, device_id, generation)
+        self.batches = {}      # user_id -> {"opened", "offline", "online"}
+        self.generation = 0
+        # Set when transitions have to reach other app nodes too (see shared_state)
+        self.on_record = None
+        self.stats = {
+            "transitions": 0,
+            "flaps_suppressed": 0,
+            "digests_sent": 0,
+            "send_errors": 0,
+        }
+
+    def record(self, device_id, user_id, status, broadcast=True):
+        if not ALERTS_ENABLED:
+            return
+        if broadcast and self.on_record is not None:
+            self.on_record(device_id, user_id, status)
+
+        now = time.monotonic()
+        with self.lock:
+            self.stats["transitions"] += 1
+
+            if status == "offline":
+                if device_id in self.pending or device_id in self.alerted:
+                    return
+                self.generation += 1
+                self.pending[device_id] = (user_id, self.generation)
+                heapq.heappush(self.heap, (now + ALERT_DEBOUNCE, device_id, self.generation))
+                return
+
+            # Back online before the debounce ran out: nothing to report
+            if self.pending.pop(device_id, None) is not None:
+                self.stats["flaps_suppressed"] += 1
+                return
+
+            if device_id in self.alerted:
+                self.alerted.discard(device_id)
+                batch = self.batches.get(user_id)
+                if batch and device_id in batch["offline"]:
+                    # Offline alert not sent yet, so it cancels out
+                    batch["offline"].discard(device_id)
+                    self.stats["flaps_suppressed"] += 1
+                else:
+                    self._add(user_id, "online", device_id, now)
+
+    def _add(self, user_id, kind, device_id, now):
+        batch = self.batches.get(user_id)
+        if batch is None:
+            batch = self.batches[user_id] = {"opened": now, "offline": set(), "online": set()}
+        batch[kind].add(device_id)
+
+    def due(self):
+        """Moves debounced devices into batches, returns the batches that are ready."""
+        now = time.monotonic()
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, device_id, generation = heapq.heappop(self.heap)
+                entry = self.pending.get(device_id)
+                if entry is None or entry[1] != generation:
+                    continue  # recovered, or superseded by a later transition
+                del self.pending[device_id]
+                self.alerted.add(device_id)
+                self._add(entry[0], "offline", device_id, now)
+
+            ready = [
+                user_id for user_id, batch in self.batches.items()
+                if now - batch["opened"] >= ALERT_GROUP_WINDOW
+            ]
+            return {user_id: self.batches.pop(user_id) for user_id in ready}
+
+    def requeue(self, batches):
+        """Puts batches back after a failed send; they go out with the next window."""
+        now = time.monotonic()
+        with self.lock:
+            for user_id, batch in batches.items():
+                for kind in ("offline", "online"):
+                    for device_id in batch[kind]:
+                        self._add(user_id, kind, device_id, now)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                **self.stats,
+                "pending": len(self.pending),
+                "alerted": len(self.alerted),
+                "open_batches": len(self.batches),
+            }
+
+# --------------------------------------------------
+# DIGESTS
+# --------------------------------------------------
+def _lookup(conn, sql, ids):
+    ids = list(ids)
+    found = {}
+    for i in range(0, len(ids), ALERT_QUERY_CHUNK):
+        chunk = ids[i:i + ALERT_QUERY_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        for row in conn.execute(sql.format(placeholders), chunk):
+            found[row[0]] = row[1:]
+    return found
+
+
+def _listing(names):
+    names = sorted(names)
+    lines = [f"  - {name}" for name in names[:ALERT_MAX_LISTED]]
+    if len(names) > ALERT_MAX_LISTED:
+        lines.append(f"  ... and {len(names) - ALERT_MAX_LISTED} more")
+    return lines
+
+
+def build_digest(email, username, offline, online):
+    app_name = os.getenv("APP_NAME", "Tiny Little Helper")
+
+    parts = []
+    if offline:
+        parts.append(f"{len(offline)} offline")
+    if online:
+        parts.append(f"{len(online)} back online")
+
+    lines = [f"Hi {username},", ""]
+    if offline:
+        lines.append("These devices went offline:")
+        lines += _listing(offline)
+        lines.append("")
+    if online:
+        lines.append("These devices are back online:")
+        lines += _listing(online)
+        lines.append("")
+    lines.append("Dashboard:")
+    lines.append(f"{os.getenv('DOMAIN')}/dashboard")
+
+    msg = MIMEText("\n".join(lines) + "\n", "plain")
+    msg["From"] = os.getenv("FROM_EMAIL")
+    msg["To"] = email
+    msg["Subject"] = f"[{app_name}] Devices: {', '.join(parts)}"
+    return msg
+
+
+def send_digests(batches):
+    device_ids = set()
+    for batch in batches.values():
+        device_ids |= batch["offline"] | batch["online"]
+
+    by_shard = {}
+    for device_id in device_ids:
+        by_shard.setdefault(shard_for_id(device_id), []).append(device_id)
+
+    names = {}
+    for shard, ids in by_shard.items():
+        conn = get_shard_db(shard)
+        names.update(_lookup(conn, "SELECT id, device_name FROM devices WHERE id IN ({})", ids))
+        conn.close()
+
+    conn = get_db()
+    users = _lookup(conn, "SELECT id, email, username FROM users WHERE id IN ({})", batches.keys())
+    conn.close()
+
+    messages = []
+    for user_id, batch in batches.items():
+        if user_id not in users:
+            continue
+        email, username = users[user_id]
+        # Devices deleted in the meantime are left out
+        offline = [names[d][0] for d in batch["offline"] if d in names]
+        online = [names[d][0] for d in batch["online"] if d in names]
+        if email and (offline or online):
+            messages.append(build_digest(email, username, offline, online))
+
+    if not messages:
+        return 0
+
+    with span("email"), smtplib.SMTP(os.getenv("SMTP_HOST"), int(os.getenv("SMTP_PORT", 587))) as server:
+        if os.getenv("SMTP_STARTTLS", "1") == "1":
+            server.starttls()
+        if os.getenv("SMTP_USER"):
+            server.login(os.getenv("SMTP_USER"), os.getenv("SMTP_PASSWORD"))
+        for msg in messages:
+            server.send_message(msg)
+
+    return len(messages)
+
+
+engine = AlertEngine()
+
+
+async def alert_loop():
+    if not ALERTS_ENABLED:
+        return
+    while True:
+        await asyncio.sleep(ALERT_TICK)
+        ready = engine.due()
+        # Every node tracks transitions, only the leader sends
+        if not ready or not shared_state.is_leader():
+            continue
+        try:
+            sent = await asyncio.to_thread(send_digests, ready)
+            engine.stats["digests_sent"] += sent
+        except Exception as e:
+            print("Alert email error:", e)
+            engine.stats["send_errors"] += 1
+            engine.requeue(ready)
@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+# --------------------------------------------------
+# BULK IMPORT / EXPORT BENCHMARK
+# --------------------------------------------------
+# Starts the app under uvicorn, streams --rows devices into /devices/import
+# and back out of /devices/export, and reports rows/sec and the server's
+# peak RSS above its idle RSS for each phase. Both bodies are streamed, so
+# the client doesn't hold them in memory either.
+#
+#   python benchmarks/bench_bulk_devices.py --rows 1000000
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class RssSampler:
+    """Peak VmRSS (KB) of a process while the block runs, sampled every 10 ms (Linux)."""
+
+    def __init__(self, pid):
+        self.pid = pid
+
+    def __enter__(self):
+        self.peak = self.start = self.rss()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while self.running:
+            self.peak = max(self.peak, self.rss())
+            time.sleep(0.01)
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+
+    def rss(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+
+
+def _body(fmt, rows, prefix):
+    chunk = []
+    if fmt == "csv":
+        yield b"device_key,device_name,ip,os,status\n"
+    for i in range(rows):
+        if fmt == "csv":
+            chunk.append(f"{prefix}-{i},device {i},10.0.{i % 256}.{i // 256 % 256},Linux,offline\n")
+        else:
+            chunk.append(json.dumps({
+                "device_key": f"{prefix}-{i}", "device_name": f"device {i}",
+                "ip": f"10.0.{i % 256}.{i // 256 % 256}", "os": "Linux", "status": "offline",
+            }) + "\n")
+        if len(chunk) == 1000:
+            yield "".join(chunk).encode()
+            chunk = []
+    if chunk:
+        yield "".join(chunk).encode()
+
+
+def _session(db_path):
+    # Runs in this process against the server's database file
+    sys.path.insert(0, str(ROOT))
+    os.environ["DB_PATH"] = db_path
+    from datetime import datetime
+    from db import get_db
+    import session_tokens
+
+    session_tokens.load_keys()
+    username = f"bench-{uuid.uuid4().hex[:6]}"
+    conn = get_db()
+    user_id = conn.execute(
+        "INSERT INTO users (username, email, password, created_at) VALUES (?, ?, ?, ?)",
+        (username, "bench@example.com", "pw", datetime.utcnow().isoformat())
+    ).lastrowid
+    conn.commit()
+    conn.close()
+    return session_tokens.issue(username, user_id)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming device import/export throughput and memory")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    args = parser.parse_args()
+
+    import httpx
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="tlh-bench-"), "bench.db")
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=dict(os.environ, DB_PATH=db_path, PROBE_ENABLED="0"),
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        for _ in range(100):
+            try:
+                httpx.get(f"{base}/login")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+
+        headers = {"Cookie": f"session={_session(db_path)}"}
+        with httpx.Client(base_url=base, timeout=None, headers=headers) as client:
+            with RssSampler(server.pid) as rss:
+                started = time.perf_counter()
+                response = client.post(f"/devices/import?format={args.format}",
+                                       content=_body(args.format, args.rows, uuid.uuid4().hex[:6]))
+                elapsed = time.perf_counter() - started
+            assert response.status_code == 200, response.text
+            print(f"import ({args.format}): {args.rows / elapsed:>9.0f} rows/s   "
+                  f"server peak RSS +{(rss.peak - rss.start) / 1024:.1f} MB")
+
+            with RssSampler(server.pid) as rss:
+                started = time.perf_counter()
+                exported = 0
+                with client.stream("GET", f"/devices/export?format={args.format}") as response:
+                    for chunk in response.iter_bytes():
+                        exported += chunk.count(b"\n")
+                elapsed = time.perf_counter() - started
+            if args.format == "csv":
+                exported -= 1  # header
+            print(f"export ({args.format}): {exported / elapsed:>9.0f} rows/s   "
+                  f"server peak RSS +{(rss.peak - rss.start) / 1024:.1f} MB")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
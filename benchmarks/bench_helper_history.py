@@ -0,0 +1,87 @@
+import argparse
+import importlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# --------------------------------------------------
+# BROWSER HISTORY COLLECTION BENCHMARK
+# --------------------------------------------------
+# Builds synthetic Chrome-style History databases and times one collection
+# cycle three ways: the old full copy per read, a read-only immutable open,
+# and a repeat cycle on an unchanged file (answered from the cache).
+#
+#   python benchmarks/bench_helper_history.py --mb 200 --sources 3
+HELPER_DIR = Path(__file__).resolve().parent.parent / "Helper"
+QUERY = "SELECT url, title FROM urls ORDER BY last_visit_time DESC LIMIT ?"
+
+
+def build_history(path, megabytes):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE urls (id INTEGER PRIMARY KEY, url TEXT, title TEXT, last_visit_time INTEGER)")
+    conn.execute("CREATE INDEX urls_last_visit ON urls (last_visit_time)")
+    padding = "x" * 900
+    rows = megabytes * 1024
+    conn.executemany(
+        "INSERT INTO urls (url, title, last_visit_time) VALUES (?, ?, ?)",
+        ((f"https://example.com/{i}/{padding}", f"Page {i}", i) for i in range(rows))
+    )
+    conn.commit()
+    conn.close()
+
+
+def legacy_read(db_path, limit=10):
+    # What the helper did before: copy the whole database, then read 10 rows
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        tmp_db = Path(tmp_dir) / "history.db"
+        shutil.copy2(db_path, tmp_db)
+        conn = sqlite3.connect(tmp_db)
+        rows = conn.execute(QUERY, (limit,)).fetchall()
+        conn.close()
+        return rows
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _timed(fn, sources):
+    started = time.perf_counter()
+    for path in sources:
+        fn(path)
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Browser history collection benchmark")
+    parser.add_argument("--mb", type=int, default=100, help="size of each synthetic History file")
+    parser.add_argument("--sources", type=int, default=3, help="number of browser databases")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(HELPER_DIR))
+    helper = importlib.import_module("tiny_helper")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        sources = [Path(tmp) / f"History-{i}" for i in range(args.sources)]
+        for path in sources:
+            build_history(path, args.mb)
+        size = sum(p.stat().st_size for p in sources) / 1024 / 1024
+        print(f"{args.sources} sources, {size:.0f} MB total")
+
+        legacy = _timed(legacy_read, sources)
+        helper._history_cache.clear()
+        fresh = _timed(lambda p: helper.read_sqlite_safely(p, QUERY), sources)
+        cached = _timed(lambda p: helper.read_sqlite_safely(p, QUERY), sources)
+        os.chdir(HELPER_DIR)
+
+    print(f"{'full copy per read (old)':<32} {legacy:>9.1f} ms/cycle")
+    print(f"{'read-only immutable open':<32} {fresh:>9.1f} ms/cycle")
+    print(f"{'unchanged sources (cached)':<32} {cached:>9.3f} ms/cycle")
+
+
+if __name__ == "__main__":
+    main()
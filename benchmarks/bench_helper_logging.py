@@ -0,0 +1,79 @@
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# --------------------------------------------------
+# HELPER LOGGING BENCHMARK
+# --------------------------------------------------
+# Per-call overhead of the helper's log() against the old implementation,
+# which opened, appended to and closed helper_debug.log on every call.
+#
+#   python benchmarks/bench_helper_logging.py --calls 100000
+HELPER_DIR = Path(__file__).resolve().parent.parent / "Helper"
+
+
+def legacy_log(path, msg):
+    try:
+        with open(path, "a") as f:
+            f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {msg}\n")
+    except:
+        pass
+
+
+def _per_call_us(fn, calls):
+    started = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Helper log() call overhead")
+    parser.add_argument("--calls", type=int, default=100_000)
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(HELPER_DIR))
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        helper = importlib.import_module("tiny_helper")
+
+        # The queue drops records rather than block, so it is sized to hold
+        # the whole run; otherwise we'd partly be timing the drop path
+        helper.LOG_QUEUE_SIZE = args.calls + 1
+        helper.LOG_FILE = Path(tmp) / "helper_debug.log"
+
+        results = {
+            "legacy open/append/close": _per_call_us(
+                lambda i: legacy_log(Path(tmp) / "legacy.log", f"heartbeat {i} sent"), args.calls
+            ),
+        }
+        for fmt in ("text", "json"):
+            helper.LOG_FORMAT = fmt
+            helper._logger = None
+            helper.log("warm up")
+            results[f"background ({fmt})"] = _per_call_us(
+                lambda i: helper.log(f"heartbeat {i} sent"), args.calls
+            )
+            drained = time.perf_counter()
+            helper._logger.close()
+            results[f"  drain after run ({fmt}), total ms"] = (time.perf_counter() - drained) * 1000
+
+        helper.LOG_LEVEL = "WARNING"
+        helper._logger = None
+        results["background, filtered by level"] = _per_call_us(
+            lambda i: helper.log(f"heartbeat {i} sent", "DEBUG"), args.calls
+        )
+        helper._logger.close()
+        os.chdir(HELPER_DIR)
+
+    for name, value in results.items():
+        unit = "" if "total ms" in name else " us/call"
+        print(f"{name:<36} {value:>9.2f}{unit}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# --------------------------------------------------
+# HELPER STARTUP BENCHMARK
+# --------------------------------------------------
+# Imports each helper variant in a fresh interpreter with -X importtime and
+# reports the import cost of tiny_helper itself (modules that site or the
+# interpreter already loaded don't count) plus the RSS right after import.
+#
+#   python benchmarks/bench_helper_startup.py --runs 20
+#
+# tests/test_helper_startup.py enforces the budgets below.
+HELPER_DIR = Path(__file__).resolve().parent.parent / "Helper"
+VARIANTS = {
+    "generic": HELPER_DIR,
+    "mac": HELPER_DIR / "mac",
+    "windows": HELPER_DIR / "windows",
+}
+
+IMPORT_BUDGET_US = 60_000  # cumulative import time of tiny_helper
+RSS_BUDGET_KB = 40_000     # RSS of the process after the import
+
+# Loaded lazily, when the helper first needs them
+DEFERRED_MODULES = {
+    "requests", "sqlite3", "ssl", "http.client", "urllib.request",
+    "concurrent.futures", "gzip", "msgpack", "certifi",
+}
+
+# ru_maxrss survives exec on Linux (it would report the parent's peak), so
+# the current RSS is read from /proc where available
+_PROBE = """
+import sys, tiny_helper
+try:
+    with open("/proc/self/status") as f:
+        rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+except OSError:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(rss)
+print(",".join(sorted(sys.modules)))
+"""
+
+
+def _parse_importtime(stderr, module="tiny_helper"):
+    """Returns ({module: cumulative us} for modules first imported by `module`, total us)."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((name.strip(), int(cumulative), depth))
+
+    # -X importtime prints children before their parent
+    for end, (name, cumulative, depth) in enumerate(rows):
+        if name == module and depth == 0:
+            start = end
+            while start > 0 and rows[start - 1][2] > 0:
+                start -= 1
+            return {n: c for n, c, _ in rows[start:end]}, cumulative
+    raise RuntimeError(f"{module} not found in -X importtime output")
+
+
+def measure(variant):
+    """One cold import of a helper variant: (total us, sub-imports, RSS in KB, sys.modules)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        # The helpers write their token/log/spool files relative to cwd or $HOME
+        env = dict(os.environ, PYTHONPATH=str(VARIANTS[variant]), HOME=tmp)
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _PROBE],
+            cwd=tmp, env=env, capture_output=True, text=True, check=True,
+        )
+    imports, total = _parse_importtime(result.stderr)
+    rss, modules = result.stdout.splitlines()
+    return total, imports, int(rss), set(modules.split(","))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Helper import time / RSS benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'variant':<10} {'import ms (median)':>19} {'min':>8} {'RSS MB':>11}")
+    for variant in VARIANTS:
+        totals, rss = [], []
+        for _ in range(args.runs):
+            total, imports, kb, _ = measure(variant)
+            totals.append(total)
+            rss.append(kb)
+        print(
+            f"{variant:<10} {statistics.median(totals) / 1000:>19.1f} "
+            f"{min(totals) / 1000:>8.1f} {max(rss) / 1024:>11.1f}"
+        )
+
+    _, imports, _, _ = measure("generic")
+    print("\nSlowest imports pulled in by tiny_helper (cumulative ms):")
+    for name, us in sorted(imports.items(), key=lambda item: -item[1])[:10]:
+        print(f"  {name:<30} {us / 1000:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# --------------------------------------------------
+# STATIC PAGE BENCHMARK
+# --------------------------------------------------
+# Requests/sec for /, /signup, /login and a static asset, served in-process
+# through the ASGI app (no network), against rendering the template on
+# every hit as the routes used to.
+#
+#   python benchmarks/bench_pages.py --requests 5000
+ROOT = Path(__file__).resolve().parent.parent
+
+
+async def _rate(client, path, requests, headers=None):
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(path, headers=headers or {})
+        assert response.status_code in (200, 304), (path, response.status_code)
+    return requests / (time.perf_counter() - started)
+
+
+async def run(requests):
+    import httpx
+    from fastapi import Request
+    from fastapi.responses import HTMLResponse
+
+    import main
+
+    @main.app.get("/__render/{name}", response_class=HTMLResponse)
+    async def render_every_time(request: Request, name: str):
+        # The old handlers: TemplateResponse on every request
+        return main.templates.TemplateResponse(name, {"request": request})
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        rows = []
+        for path, template in (("/", "index.html"), ("/signup", "signup.html"), ("/login", "login.html")):
+            etag = (await client.get(path, headers={"Accept-Encoding": "gzip"})).headers["etag"]
+            rows.append((path, {
+                "render per hit": await _rate(client, f"/__render/{template}", requests),
+                "prerendered": await _rate(client, path, requests),
+                "prerendered gzip": await _rate(client, path, requests, {"Accept-Encoding": "gzip"}),
+                "304": await _rate(client, path, requests, {"Accept-Encoding": "gzip", "If-None-Match": etag}),
+            }))
+
+        css = await client.get("/static/style.css", headers={"Accept-Encoding": "gzip"})
+        rows.append(("/static/style.css", {
+            "render per hit": None,
+            "prerendered": await _rate(client, "/static/style.css", requests),
+            "prerendered gzip": await _rate(client, "/static/style.css", requests, {"Accept-Encoding": "gzip"}),
+            "304": await _rate(client, "/static/style.css", requests,
+                               {"Accept-Encoding": "gzip", "If-None-Match": css.headers["etag"]}),
+        }))
+
+    columns = list(rows[0][1])
+    print(f"{'req/s':<20}" + "".join(f"{c:>18}" for c in columns))
+    for path, rates in rows:
+        print(f"{path:<20}" + "".join(f"{'-' if r is None else f'{r:.0f}':>18}" for r in rates.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Static page requests/sec")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="tlh-bench-"), "bench.db"))
+    os.chdir(ROOT)  # templates/ and static/ are relative
+    sys.path.insert(0, str(ROOT))
+    asyncio.run(run(args.requests))
+
+
+if __name__ == "__main__":
+    main()
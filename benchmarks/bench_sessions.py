@@ -0,0 +1,92 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+# --------------------------------------------------
+# SESSION LOOKUP BENCHMARK
+# --------------------------------------------------
+# Latency of an authenticated request (/fleet/summary, served from the fleet
+# counters) with a signed session cookie vs a legacy DB-backed session,
+# with the sessions table pre-filled to --sessions rows.
+#
+#   python benchmarks/bench_sessions.py --sessions 100000 --requests 2000
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _fill_sessions(count, username):
+    from db import get_db
+
+    now = datetime.utcnow().isoformat()
+    conn = get_db()
+    conn.executemany(
+        "INSERT INTO sessions (session_id, username, created_at) VALUES (?, ?, ?)",
+        ((str(uuid.uuid4()), username, now) for _ in range(count))
+    )
+    legacy = str(uuid.uuid4())
+    conn.execute("INSERT INTO sessions (session_id, username, created_at) VALUES (?, ?, ?)", (legacy, username, now))
+    user_id = conn.execute(
+        "INSERT INTO users (username, email, password, created_at) VALUES (?, ?, ?, ?)",
+        (username, "bench@example.com", "pw", now)
+    ).lastrowid
+    conn.commit()
+    conn.close()
+    return user_id, legacy
+
+
+async def _latencies(client, cookie, requests):
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = await client.get("/fleet/summary", headers={"Cookie": f"session={cookie}"})
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.status_code
+    return samples
+
+
+async def run(sessions, requests):
+    import httpx
+
+    import main
+    import session_tokens
+
+    username = f"bench-{uuid.uuid4().hex[:6]}"
+    user_id, legacy = _fill_sessions(sessions, username)
+    signed = session_tokens.issue(username, user_id)
+
+    # authenticate() alone, without the HTTP stack
+    for name, cookie in (("signed", signed), ("db session", legacy)):
+        started = time.perf_counter()
+        for _ in range(requests):
+            assert main.authenticate(cookie)
+        print(f"authenticate(), {name:<11} {(time.perf_counter() - started) / requests * 1e6:>8.1f} us")
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"\n{'/fleet/summary':<26} {'p50 ms':>8} {'p95 ms':>8}")
+        for name, cookie in (("signed", signed), ("db session", legacy)):
+            samples = sorted(await _latencies(client, cookie, requests))
+            p95 = samples[int(len(samples) * 0.95)]
+            print(f"{name:<26} {statistics.median(samples):>8.3f} {p95:>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Signed vs DB-backed session latency")
+    parser.add_argument("--sessions", type=int, default=100_000, help="rows in the sessions table")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="tlh-bench-"), "bench.db"))
+    os.chdir(ROOT)
+    sys.path.insert(0, str(ROOT))
+    asyncio.run(run(args.sessions, args.requests))
+
+
+if __name__ == "__main__":
+    main()
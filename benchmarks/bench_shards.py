@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+# --------------------------------------------------
+# SHARD WRITE THROUGHPUT BENCHMARK
+# --------------------------------------------------
+# Heartbeat writes per second for each DB_SHARDS value. DB_SHARDS is read
+# at import time, so every shard count runs in its own process with its own
+# scratch database, measured two ways:
+#
+#   writer – _record_heartbeat jobs submitted straight to the shard writers
+#            (the SQLite side alone)
+#   http   – POST /device_heartbeat in-process over ASGI, --concurrency at
+#            a time (includes decoding, the token index and the response)
+#
+# Scaling needs cores: the writers overlap while SQLite has the GIL released
+# (page writes, fsync), everything else is serialized by the interpreter.
+#
+#   python benchmarks/bench_shards.py --shards 1,2,4,8 --devices 10000 --heartbeats 50000
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _add_devices(count):
+    from db import get_db, get_shard_db, new_device_id_sql, shard_for_key, DB_SHARDS
+    from token_index import index
+
+    now = datetime.utcnow().isoformat()
+    conn = get_db()
+    user_id = conn.execute(
+        "INSERT INTO users (username, email, password, created_at) VALUES (?, ?, ?, ?)",
+        (f"bench-{uuid.uuid4().hex[:6]}", "bench@example.com", "pw", now)
+    ).lastrowid
+    conn.commit()
+    conn.close()
+
+    keys = [str(uuid.uuid4()) for _ in range(count)]
+    by_shard = {}
+    for key in keys:
+        by_shard.setdefault(shard_for_key(key), []).append(key)
+    for shard in range(DB_SHARDS):
+        conn = get_shard_db(shard)
+        for key in by_shard.get(shard, []):
+            conn.execute(f"""
+                INSERT INTO devices (id, user_id, device_key, device_name, os, status, last_seen)
+                VALUES ({new_device_id_sql(shard)}, ?, ?, ?, 'Linux', 'online', ?)
+            """, (user_id, key, f"dev-{key[:8]}", now))
+        conn.commit()
+        conn.close()
+    for key in keys:
+        index.add(key)
+    return keys
+
+
+def _writer_rate(keys, heartbeats):
+    import main
+    from db import shard_write
+
+    started = time.perf_counter()
+    futures = [
+        shard_write(key, main._record_heartbeat, key, datetime.utcnow().isoformat())
+        for key in (keys[i % len(keys)] for i in range(heartbeats))
+    ]
+    for future in futures:
+        future.result()
+    return heartbeats / (time.perf_counter() - started)
+
+
+async def _http_rate(keys, heartbeats, concurrency):
+    import httpx
+
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker(offset):
+            for i in range(offset, heartbeats, concurrency):
+                r = await client.post("/device_heartbeat", json={"token": keys[i % len(keys)]})
+                assert r.status_code == 200, r.status_code
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+        return heartbeats / (time.perf_counter() - started)
+
+
+def _worker(devices, heartbeats, concurrency):
+    sys.path.insert(0, str(ROOT))
+    import main  # noqa: F401  (creates the schema)
+    from db import writer_stats
+
+    keys = _add_devices(devices)
+    writer = _writer_rate(keys, heartbeats)
+    http = asyncio.run(_http_rate(keys, heartbeats, concurrency))
+    commits = sum(w["commits"] for w in writer_stats()["writers"].values())
+    print(json.dumps({"writer": writer, "http": http, "commits": commits}))
+
+
+def run(shard_counts, devices, heartbeats, concurrency):
+    print(f"{os.cpu_count()} CPU(s), {devices} devices, {heartbeats} heartbeats per run\n")
+    print(f"{'shards':>6} {'writer hb/s':>12} {'speedup':>8} {'http hb/s':>10} {'speedup':>8} {'commits':>8}")
+    base = None
+    for shards in shard_counts:
+        scratch = tempfile.mkdtemp(prefix="tlh-bench-shards-")
+        env = {
+            **os.environ,
+            "DB_SHARDS": str(shards),
+            "DB_PATH": os.path.join(scratch, "bench.db"),
+            "SHARD_DIR": os.path.join(scratch, "shards"),
+            "PROBE_ENABLED": "0",
+            "ALERTS_ENABLED": "0",
+        }
+        out = subprocess.run(
+            [sys.executable, __file__, "--worker", "--devices", str(devices),
+             "--heartbeats", str(heartbeats), "--concurrency", str(concurrency)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        base = base or result
+        print(f"{shards:>6} {result['writer']:>12.0f} {result['writer'] / base['writer']:>7.2f}x "
+              f"{result['http']:>10.0f} {result['http'] / base['http']:>7.2f}x {result['commits']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Heartbeat write throughput by shard count")
+    parser.add_argument("--shards", default="1,2,4,8", help="comma separated DB_SHARDS values")
+    parser.add_argument("--devices", type=int, default=10_000)
+    parser.add_argument("--heartbeats", type=int, default=50_000)
+    parser.add_argument("--concurrency", type=int, default=64, help="requests in flight (http)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker(args.devices, args.heartbeats, args.concurrency)
+    else:
+        run([int(n) for n in args.shards.split(",")], args.devices, args.heartbeats, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+# --------------------------------------------------
+# MULTI-NODE HEARTBEAT BENCHMARK
+# --------------------------------------------------
+# Starts 1, 2 and 4 app nodes under uvicorn, all on one SQLite database and
+# one Redis, and sends --heartbeats heartbeats round-robin across the nodes
+# with --concurrency in flight. A single node without the shared tier is
+# measured first as the baseline. Reports heartbeats/s, latency and the
+# heartbeats the nodes had to send to SQLite because Redis failed.
+#
+# Without --redis-url a fakeredis TCP server runs in this process; it is
+# single threaded Python and drops the odd connection (a few fallbacks per
+# run), so use a real redis-server for absolute numbers.
+# Scaling with nodes needs as many cores as nodes (plus the client).
+#
+#   python benchmarks/bench_shared_state.py --nodes 1,2,4 --heartbeats 20000
+#   python benchmarks/bench_shared_state.py --redis-url redis://127.0.0.1:6379/0
+ROOT = Path(__file__).resolve().parent.parent
+ADMIN_TOKEN = uuid.uuid4().hex
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_fake_redis():
+    from fakeredis import TcpFakeServer
+
+    port = _free_port()
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0"
+
+
+def _add_devices(count):
+    # Before the nodes start: each loads its token index at import
+    sys.path.insert(0, str(ROOT))
+    from db import get_db, get_shard_db, init_db, new_device_id_sql, shard_for_key
+
+    init_db()
+    now = datetime.utcnow().isoformat()
+    conn = get_db()
+    user_id = conn.execute(
+        "INSERT INTO users (username, email, password, created_at) VALUES (?, ?, ?, ?)",
+        (f"bench-{uuid.uuid4().hex[:6]}", "bench@example.com", "pw", now)
+    ).lastrowid
+    conn.commit()
+    conn.close()
+
+    keys = [str(uuid.uuid4()) for _ in range(count)]
+    for key in keys:
+        shard = shard_for_key(key)
+        conn = get_shard_db(shard)
+        conn.execute(f"""
+            INSERT INTO devices (id, user_id, device_key, device_name, os, status, last_seen)
+            VALUES ({new_device_id_sql(shard)}, ?, ?, ?, 'Linux', 'online', ?)
+        """, (user_id, key, f"dev-{key[:8]}", now))
+        conn.commit()
+        conn.close()
+    return keys
+
+
+def _start_nodes(count, redis_url):
+    import httpx
+
+    nodes = []
+    for _ in range(count):
+        port = _free_port()
+        env = dict(os.environ, REDIS_URL=redis_url, PROBE_ENABLED="0", ALERTS_ENABLED="0",
+                   ADMIN_TOKEN=ADMIN_TOKEN)
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+        )
+        nodes.append((process, f"http://127.0.0.1:{port}"))
+
+    for _, base in nodes:
+        for _ in range(200):
+            try:
+                httpx.get(f"{base}/login")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+    return nodes
+
+
+async def _load(bases, keys, heartbeats, concurrency):
+    import httpx
+
+    clients = [httpx.AsyncClient(base_url=base, timeout=30) for base in bases]
+    latencies = []
+
+    async def worker(offset):
+        for i in range(offset, heartbeats, concurrency):
+            started = time.perf_counter()
+            r = await clients[i % len(clients)].post("/device_heartbeat", json={"token": keys[i % len(keys)]})
+            latencies.append((time.perf_counter() - started) * 1000)
+            assert r.status_code == 200, r.status_code
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        fallbacks = 0
+        for client in clients:
+            stats = (await client.get("/admin/stats", headers={"X-Admin-Token": ADMIN_TOKEN})).json()
+            fallbacks += stats["shared_state"]["fallbacks"]
+    finally:
+        for client in clients:
+            await client.aclose()
+
+    latencies.sort()
+    return heartbeats / elapsed, statistics.median(latencies), latencies[int(len(latencies) * 0.95)], fallbacks
+
+
+def run(node_counts, devices, heartbeats, concurrency, redis_url):
+    keys = _add_devices(devices)
+    redis_url = redis_url or _start_fake_redis()
+
+    print(f"{os.cpu_count()} CPU(s), {devices} devices, {heartbeats} heartbeats, {concurrency} in flight\n")
+    print(f"{'nodes':<22} {'hb/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'fallbacks':>10}")
+    for label, count, url in [("1 (SQLite only)", 1, "")] + [(str(n), n, redis_url) for n in node_counts]:
+        nodes = _start_nodes(count, url)
+        try:
+            rate, p50, p95, fallbacks = asyncio.run(
+                _load([base for _, base in nodes], keys, heartbeats, concurrency)
+            )
+        finally:
+            for process, _ in nodes:
+                process.terminate()
+                process.wait()
+        print(f"{label:<22} {rate:>8.0f} {p50:>8.2f} {p95:>8.2f} {fallbacks:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Heartbeat throughput with 1, 2 and 4 app nodes")
+    parser.add_argument("--nodes", default="1,2,4", help="comma separated node counts")
+    parser.add_argument("--devices", type=int, default=10_000)
+    parser.add_argument("--heartbeats", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--redis-url", default="", help="shared Redis (default: in-process fakeredis)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="tlh-bench-"), "bench.db"))
+    os.environ.setdefault("SHARD_DIR", os.path.join(os.path.dirname(os.environ["DB_PATH"]), "shards"))
+    run([int(n) for n in args.nodes.split(",")], args.devices, args.heartbeats, args.concurrency, args.redis_url)
+
+
+if __name__ == "__main__":
+    main()
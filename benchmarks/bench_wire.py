@@ -0,0 +1,91 @@
+import argparse
+import json
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# --------------------------------------------------
+# WIRE FORMAT BENCHMARK
+# --------------------------------------------------
+# Payload size and server-side decode + validate time of the helper bodies
+# in each format the server accepts: stdlib json, orjson, msgpack and CBOR.
+# Formats whose package isn't installed are skipped.
+#
+#   python benchmarks/bench_wire.py --sites 50 --batch 200 --rounds 2000
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _payloads(sites, batch):
+    token = str(uuid.uuid4())
+    now = datetime.utcnow()
+    registration = {
+        "token": token,
+        "device_name": "bench-laptop",
+        "ip": "203.0.113.7",
+        "mac": "aa:bb:cc:dd:ee:ff",
+        "os": "Linux",
+        "recent_sites": [
+            {"url": f"https://site{i}.example.com/path/{i}", "title": f"Site {i}", "visits": i}
+            for i in range(sites)
+        ],
+    }
+    heartbeats = {
+        "token": token,
+        "heartbeats": [
+            {"ts": (now - timedelta(seconds=30 * i)).isoformat(), "ip": "192.168.1.20"}
+            for i in range(batch)
+        ],
+    }
+    return (("registration", registration, "DeviceRegistration"),
+            ("heartbeat batch", heartbeats, "HeartbeatBatch"))
+
+
+def _formats(wire):
+    formats = [("json", lambda o: json.dumps(o).encode(), json.loads)]
+    if wire.orjson is not None:
+        formats.append(("orjson", wire.orjson.dumps, wire.orjson.loads))
+    if wire.msgpack is not None:
+        formats.append(("msgpack", wire.msgpack.packb, lambda b: wire.msgpack.unpackb(b, raw=False)))
+    if wire.cbor2 is not None:
+        formats.append(("cbor", wire.cbor2.dumps, wire.cbor2.loads))
+    return formats
+
+
+def _per_call_us(fn, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def run(sites, batch, rounds):
+    import wire
+
+    for name, payload, model_name in _payloads(sites, batch):
+        model = getattr(wire, model_name)
+        print(f"\n{name} ({model_name})")
+        print(f"{'format':<10} {'bytes':>8} {'decode us':>10} {'validate us':>12} {'total us':>10}")
+        for fmt, dumps, loads in _formats(wire):
+            body = dumps(payload)
+            data = loads(body)
+            decode_us = _per_call_us(lambda: loads(body), rounds)
+            validate_us = _per_call_us(lambda: model.model_validate(data), rounds)
+            total_us = _per_call_us(lambda: model.model_validate(loads(body)), rounds)
+            print(f"{fmt:<10} {len(body):>8} {decode_us:>10.1f} {validate_us:>12.1f} {total_us:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Helper payload size and decode time per wire format")
+    parser.add_argument("--sites", type=int, default=50, help="recent_sites entries in a registration")
+    parser.add_argument("--batch", type=int, default=200, help="heartbeats in a replay batch")
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(ROOT))
+    run(args.sites, args.batch, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import csv
+import heapq
+import io
+import json
+from itertools import islice
+
+from db import DB_SHARDS, get_shard_db, shard_for_key, new_device_id_sql
+from prober import check_target
+
+# --------------------------------------------------
+# STREAMING DEVICE EXPORT / IMPORT
+# --------------------------------------------------
+# Export walks the devices table with keyset pagination (id > last id), one
+# short read per chunk, so memory stays flat however large the fleet is.
+# With several shards the per-shard walks are merged back into id order.
+# Import parses the request body line by line and writes batched
+# transactions.
+DEVICE_COLUMNS = (
+    "device_key", "device_name", "ip", "mac", "os", "status", "last_seen", "recent_sites", "source",
+)
+SOURCES = ("helper", "manual")
+EXPORT_CHUNK_ROWS = 1000
+IMPORT_BATCH_ROWS = 5000
+MAX_LINE_BYTES = 1024 * 1024
+
+# The csv module's default field limit (128 KB) is below the record cap
+csv.field_size_limit(MAX_LINE_BYTES)
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _iter_shard(user_id, shard):
+    last_id = 0
+    while True:
+        conn = get_shard_db(shard)
+        rows = conn.execute(f"""
+            SELECT id, {", ".join(DEVICE_COLUMNS)} FROM devices
+            WHERE user_id=? AND id > ?
+            ORDER BY id LIMIT ?
+        """, (user_id, last_id, EXPORT_CHUNK_ROWS)).fetchall()
+        conn.close()
+
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield from rows
+
+
+def iter_export(user_id, fmt):
+    if fmt == "csv":
+        yield _csv_line(DEVICE_COLUMNS)
+
+    merged = heapq.merge(*(_iter_shard(user_id, shard) for shard in range(DB_SHARDS)))
+    while True:
+        rows = list(islice(merged, EXPORT_CHUNK_ROWS))
+        if not rows:
+            return
+
+        if fmt == "csv":
+            yield "".join(_csv_line(row[1:]) for row in rows)
+        else:
+            yield "".join(
+                json.dumps(dict(zip(DEVICE_COLUMNS, row[1:])), separators=(",", ":")) + "\n"
+                for row in rows
+            )
+
+
+def _csv_line(values):
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerow(values)
+    return out.getvalue()
+
+
+class ImportParser:
+    """Turns chunks of an NDJSON or CSV body into device rows."""
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.buffer = b""
+        self.pending = []         # lines of a CSV record with an open quote
+        self.pending_size = 0
+        self.in_quotes = False
+        self.header = None
+        self.skipped = 0
+
+    def feed(self, chunk: bytes):
+        self.buffer += chunk
+        lines = self.buffer.split(b"\n")
+        self.buffer = lines.pop()
+        if len(self.buffer) > MAX_LINE_BYTES:
+            raise ValueError("Line too long")
+        return self._parse_lines(lines)
+
+    def close(self):
+        lines, self.buffer = [self.buffer], b""
+        rows = self._parse_lines(lines)
+        if self.pending:
+            self.skipped += 1
+        return rows
+
+    def _parse_lines(self, lines):
+        rows = []
+        for raw in lines:
+            line = raw.decode("utf-8", "replace").rstrip("\r")
+            record = self._parse_csv(line) if self.fmt == "csv" else self._parse_ndjson(line)
+            if record is None:
+                continue
+            row = self._row(record)
+            if row is None:
+                self.skipped += 1
+            else:
+                rows.append(row)
+        return rows
+
+    def _row(self, record):
+        """Column tuple for a record, or None if it is invalid."""
+        values = {}
+        for col in DEVICE_COLUMNS:
+            value = record.get(col)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = str(value)
+            elif col == "recent_sites" and isinstance(value, (list, dict)):
+                value = str(value)  # stored like a registration's
+            elif value is not None and not isinstance(value, str):
+                return None
+            values[col] = value or None
+        if not values["device_key"] or not values["device_name"]:
+            return None
+        values["status"] = values["status"] or "offline"
+        values["source"] = values["source"] or "helper"
+        if values["source"] not in SOURCES:
+            return None
+        if values["source"] == "manual" and values["ip"]:
+            # The prober will connect to it, same rules as /add_device
+            try:
+                values["ip"] = check_target(values["ip"])
+            except ValueError:
+                return None
+        return tuple(values[col] for col in DEVICE_COLUMNS)
+
+    def _parse_ndjson(self, line):
+        if not line.strip():
+            return None
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            self.skipped += 1
+            return None
+        return record
+
+    def _parse_csv(self, line):
+        # A quoted field may contain newlines: keep collecting until the
+        # quotes balance (doubled "" escapes keep the count even). Only the
+        # new line is counted, and a stray quote can't swallow the rest of
+        # the body: the record is capped like a line.
+        self.pending.append(line)
+        self.pending_size += len(line) + 1
+        if line.count('"') % 2:
+            self.in_quotes = not self.in_quotes
+        if self.in_quotes:
+            if self.pending_size > MAX_LINE_BYTES:
+                raise ValueError("CSV record too long (unbalanced quote?)")
+            return None
+
+        text = "\n".join(self.pending)
+        self.pending, self.pending_size = [], 0
+        if not text:
+            return None
+
+        try:
+            values = next(csv.reader([text]))
+        except csv.Error:
+            self.skipped += 1
+            return None
+        if self.header is None:
+            self.header = values
+            return None
+        return dict(zip(self.header, values))
+
+
+def write_batch(user_id, rows):
+    by_shard = {}
+    for row in rows:
+        by_shard.setdefault(shard_for_key(row[0]), []).append((user_id, *row))
+
+    for shard, shard_rows in by_shard.items():
+        conn = get_shard_db(shard)
+        conn.executemany(f"""
+            INSERT OR REPLACE INTO devices
+            (id, user_id, {", ".join(DEVICE_COLUMNS)})
+            VALUES ({new_device_id_sql(shard)}, ?, {", ".join("?" for _ in DEVICE_COLUMNS)})
+        """, shard_rows)
+        conn.commit()
+        conn.close()
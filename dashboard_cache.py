@@ -0,0 +1,97 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from db import get_db
+
+# --------------------------------------------------
+# PER-USER DASHBOARD RENDER CACHE
+# --------------------------------------------------
+# Every change to a user's devices bumps that user's version. Rendered
+# dashboards are cached under (user_id, version), so a bump is all it takes
+# to invalidate; old entries simply age out of the LRU.
+#
+# The versions live in the dashboard_versions table, so every worker (and
+# every app node sharing the database) agrees on them; only the rendered
+# bodies are per process. Bumps are status changes, not heartbeats.
+DASHBOARD_CACHE_SIZE = int(os.getenv("DASHBOARD_CACHE_SIZE", 512))
+
+# Versions outlive deploys; the template hash keeps ETags of an older
+# dashboard.html from matching
+with open(os.path.join("templates", "dashboard.html"), "rb") as _f:
+    _EPOCH = hashlib.sha256(_f.read()).hexdigest()[:8]
+
+_lock = threading.Lock()
+_cache = OrderedDict()
+_stats = {
+    "hits": 0,
+    "not_modified": 0,
+    "misses": 0,
+    "render_seconds": 0.0,
+}
+
+
+def bump(*user_ids):
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    conn = get_db()
+    conn.executemany("""
+        INSERT INTO dashboard_versions (user_id, version) VALUES (?, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+    """, [(user_id,) for user_id in user_ids])
+    conn.commit()
+    conn.close()
+
+
+def version(user_id):
+    conn = get_db()
+    row = conn.execute("SELECT version FROM dashboard_versions WHERE user_id=?", (user_id,)).fetchone()
+    conn.close()
+    return row[0] if row else 0
+
+
+def etag(user_id, version):
+    return f'"dash-{_EPOCH}-{user_id}-{version}"'
+
+
+def get(user_id, version):
+    with _lock:
+        body = _cache.get((user_id, version))
+        if body is None:
+            _stats["misses"] += 1
+            return None
+        _cache.move_to_end((user_id, version))
+        _stats["hits"] += 1
+        return body
+
+
+def put(user_id, version, body, render_seconds):
+    with _lock:
+        _stats["render_seconds"] += render_seconds
+        _cache[(user_id, version)] = body
+        _cache.move_to_end((user_id, version))
+        while len(_cache) > DASHBOARD_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def record_not_modified():
+    with _lock:
+        _stats["not_modified"] += 1
+
+
+def stats():
+    with _lock:
+        served = _stats["hits"] + _stats["not_modified"]
+        total = served + _stats["misses"]
+        avg_render = _stats["render_seconds"] / _stats["misses"] if _stats["misses"] else 0.0
+        return {
+            "entries": len(_cache),
+            "hits": _stats["hits"],
+            "not_modified": _stats["not_modified"],
+            "misses": _stats["misses"],
+            "hit_ratio": round(served / total, 4) if total else 0.0,
+            "avg_render_ms": round(avg_render * 1000, 3),
+            "render_ms_saved": round(served * avg_render * 1000, 3),
+        }
@@ -1,31 +1,227 @@
 import sqlite3
 import os
+import queue
+import threading
+import zlib
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
 from pathlib import Path
 
+from profiling import TimedConnection, span
+
 # --------------------------------------------------
 # DATABASE PATH (ABSOLUTE – FIXES SQLITE BUGS)
 # --------------------------------------------------
-DB_PATH = "/data/tinylittlehelper.db"
+DB_PATH = os.getenv("DB_PATH", "/data/tinylittlehelper.db")
 
-os.makedirs("/data", exist_ok=True)
+os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
 print("DB FILE LOCATION:", DB_PATH)
 print("DB EXISTS:", os.path.exists(DB_PATH))
 
+# --------------------------------------------------
+# SHARDED DEVICE STORAGE (optional)
+# --------------------------------------------------
+# With DB_SHARDS > 1, devices, device_heartbeats and fleet_counters are split
+# across DB_SHARDS files by a stable hash of device_key; users and sessions
+# stay in DB_PATH. Every shard is a separate SQLite file with its own write
+# lock, so heartbeats for different shards don't queue behind each other.
+#
+# Device ids stay unique across shards: shard i only hands out ids with
+# id % DB_SHARDS == i, so an id alone is enough to find the shard.
+# With the default DB_SHARDS=1 the only shard is DB_PATH itself.
+# Use reshard.py to move existing data when changing the count.
+DB_SHARDS = max(int(os.getenv("DB_SHARDS", 1)), 1)
+SHARD_DIR = os.getenv("SHARD_DIR", "/data/shards")
+
+
+def shard_paths(count=None):
+    count = count or DB_SHARDS
+    if count == 1:
+        return [DB_PATH]
+    return [os.path.join(SHARD_DIR, str(count), f"devices-{i:02d}.db") for i in range(count)]
+
+
+def shard_for_key(device_key, count=None):
+    # crc32 rather than hash(): it must not change between processes
+    return zlib.crc32(device_key.encode("utf-8")) % (count or DB_SHARDS)
+
+
+def shard_for_id(device_id):
+    return device_id % DB_SHARDS
+
+
+def new_device_id_sql(shard, count=None):
+    """SQL expression for the id of a new devices row in `shard`."""
+    count = count or DB_SHARDS
+    if count == 1:
+        return "NULL"  # plain AUTOINCREMENT
+    # Next id above everything the shard ever handed out, in its residue class
+    return (
+        "((SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name='devices')"
+        f" / {count} + 1) * {count} + {shard}"
+    )
+
 # --------------------------------------------------
 # DATABASE CONNECTION
 # --------------------------------------------------
+def connect(path):
+    # TimedConnection adds statement time to the current request's 'db' span
+    conn = sqlite3.connect(path, factory=TimedConnection)
+    # INSERT OR REPLACE must fire the delete trigger for the replaced row,
+    # otherwise fleet_counters drift
+    conn.execute("PRAGMA recursive_triggers = ON")
+    return conn
+
+
 def get_db():
-    return sqlite3.connect(DB_PATH)
+    return connect(DB_PATH)
+
+
+def get_shard_db(shard):
+    return connect(shard_paths()[shard])
+
+
+def device_db(device_key):
+    """Connection to the shard that holds `device_key`."""
+    return get_shard_db(shard_for_key(device_key))
+
+
+_read_pool = ThreadPoolExecutor(max_workers=DB_SHARDS, thread_name_prefix="shard-read") if DB_SHARDS > 1 else None
 
 
+def fan_out(fn, *args):
+    """Runs fn(conn, *args) on every shard in parallel; results in shard order."""
+    def run(shard):
+        conn = get_shard_db(shard)
+        try:
+            return fn(conn, *args)
+        finally:
+            conn.close()
+
+    if _read_pool is None:
+        return [run(0)]
+    with span("db"):
+        return list(_read_pool.map(run, range(DB_SHARDS)))
+
+# --------------------------------------------------
+# SHARD WRITERS
+# --------------------------------------------------
+# Hot-path writes (heartbeats) go through one writer thread per shard. The
+# writer keeps its connection open and commits everything that queued up
+# during the previous commit as one transaction (group commit). Each job
+# runs in its own savepoint, so a failing job doesn't undo the others.
+WRITER_MAX_BATCH = 256
+
+
+class ShardWriter:
+    def __init__(self, shard):
+        self.shard = shard
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {"jobs": 0, "commits": 0, "errors": 0}
+
+    def submit(self, fn, *args):
+        """Queues fn(conn, *args); returns a concurrent.futures.Future."""
+        future = Future()
+        self.queue.put((fn, args, future))
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(
+                        target=self._run, name=f"shard-writer-{self.shard}", daemon=True
+                    )
+                    self.thread.start()
+        return future
+
+    def _run(self):
+        conn = get_shard_db(self.shard)
+        conn.isolation_level = None  # transactions are managed here
+
+        # Nothing may end this loop: a dead writer leaves every later write
+        # to the shard waiting forever
+        while True:
+            jobs = [self.queue.get()]
+            while len(jobs) < WRITER_MAX_BATCH:
+                try:
+                    jobs.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Jobs whose caller gave up (cancelled while queued) are dropped
+            jobs = [job for job in jobs if job[2].set_running_or_notify_cancel()]
+            if not jobs:
+                continue
+
+            results = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for fn, args, future in jobs:
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        results.append((future, fn(conn, *args), None))
+                        conn.execute("RELEASE job")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO job")
+                        conn.execute("RELEASE job")
+                        results.append((future, None, e))
+                conn.execute("COMMIT")
+            except Exception as e:
+                self.stats["errors"] += 1
+                results = [(future, None, e) for _, _, future in jobs]
+                try:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    # Connection is unusable; start over with a new one
+                    conn.close()
+                    conn = get_shard_db(self.shard)
+                    conn.isolation_level = None
+
+            self.stats["jobs"] += len(jobs)
+            self.stats["commits"] += 1
+            for future, result, error in results:
+                try:
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(result)
+                except InvalidStateError:
+                    pass
+
+
+_writers = [ShardWriter(shard) for shard in range(DB_SHARDS)]
+
+
+def shard_write(device_key, fn, *args):
+    """Runs fn(conn, *args) on the writer of `device_key`'s shard."""
+    return write_shard(shard_for_key(device_key), fn, *args)
+
+
+def write_shard(shard, fn, *args):
+    return _writers[shard].submit(fn, *args)
+
+
+def writer_stats():
+    return {
+        "shards": DB_SHARDS,
+        "writers": {w.shard: dict(w.stats) for w in _writers if w.thread is not None},
+    }
 
 # --------------------------------------------------
 # INITIALIZE DATABASE
 # --------------------------------------------------
+def _init_file(conn):
+    # WAL lets readers and the maintenance jobs run alongside writers.
+    # auto_vacuum only takes effect on a new, empty database; older files
+    # are converted by the maintenance vacuum job.
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+
+
 def init_db():
     conn = get_db()
     print("INIT DB USING:", DB_PATH)
+    _init_file(conn)
 
     cur = conn.cursor()
 
@@ -50,6 +246,56 @@ def init_db():
         )
     """)
 
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_sessions_created_at
+        ON sessions (created_at)
+    """)
+
+    # DASHBOARD VERSIONS (bumped whenever a user's devices change, see dashboard_cache)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS dashboard_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    """)
+
+    # SESSION KEYS (generated signing key when SESSION_KEYS isn't set)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS session_keys (
+            kid TEXT PRIMARY KEY,
+            secret TEXT NOT NULL
+        )
+    """)
+
+    # REVOKED SESSIONS (signed tokens logged out before expiry)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS revoked_sessions (
+            jti TEXT PRIMARY KEY,
+            expires_at INTEGER NOT NULL
+        )
+    """)
+
+    conn.commit()
+    conn.close()
+
+    init_device_files()
+
+
+def init_device_files(count=None):
+    """Creates the device tables in every shard file of the layout."""
+    for path in shard_paths(count):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = connect(path)
+        if path != DB_PATH:
+            _init_file(conn)
+        _init_device_tables(conn)
+        conn.commit()
+        conn.close()
+
+
+def _init_device_tables(conn):
+    cur = conn.cursor()
+
     # DEVICES (helper exe + web)
     cur.execute("""
         CREATE TABLE IF NOT EXISTS devices (
@@ -63,10 +309,28 @@ def init_db():
             status TEXT DEFAULT 'offline',
             last_seen TEXT,
             recent_sites TEXT,
+            source TEXT DEFAULT 'helper',
             UNIQUE(user_id, device_key)
         )
     """)
 
+    # 'helper' devices heartbeat, 'manual' ones are probed by the server
+    cur.execute("PRAGMA table_info(devices)")
+    if "source" not in {row[1] for row in cur.fetchall()}:
+        cur.execute("ALTER TABLE devices ADD COLUMN source TEXT DEFAULT 'helper'")
+
+    # Heartbeats look devices up by key alone
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_devices_device_key
+        ON devices (device_key)
+    """)
+
+    # Per-user scans in id order (dashboard, keyset-paginated export)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_devices_user_id
+        ON devices (user_id)
+    """)
+
     # DEVICE HEARTBEATS (helper polling)
     cur.execute("""
         CREATE TABLE IF NOT EXISTS device_heartbeats (
@@ -77,5 +341,133 @@ def init_db():
         )
     """)
 
+    # FLEET COUNTERS (devices per owner/os/status, kept by triggers)
+    cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='fleet_counters'"
+    )
+    counters_exist = cur.fetchone() is not None
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS fleet_counters (
+            user_id INTEGER NOT NULL,
+            os TEXT NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, os, status)
+        )
+    """)
+
+    cur.executescript(f"""
+        CREATE TRIGGER IF NOT EXISTS fleet_counters_insert
+        AFTER INSERT ON devices
+        BEGIN
+            {_COUNTER_INCREMENT.format(row="NEW")}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS fleet_counters_delete
+        AFTER DELETE ON devices
+        BEGIN
+            {_COUNTER_DECREMENT.format(row="OLD")}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS fleet_counters_update
+        AFTER UPDATE OF user_id, os, status ON devices
+        WHEN OLD.user_id IS NOT NEW.user_id
+          OR OLD.os IS NOT NEW.os
+          OR OLD.status IS NOT NEW.status
+        BEGIN
+            {_COUNTER_DECREMENT.format(row="OLD")}
+            {_COUNTER_INCREMENT.format(row="NEW")}
+        END;
+    """)
+
+    if not counters_exist:
+        rebuild_fleet_counters(conn)
+
+# --------------------------------------------------
+# FLEET COUNTERS
+# --------------------------------------------------
+# Devices without an owner count under user_id 0, unknown OS under ''.
+_COUNTER_KEY = "COALESCE({row}.user_id, 0), COALESCE({row}.os, ''), COALESCE({row}.status, 'offline')"
+
+_COUNTER_INCREMENT = f"""
+            INSERT INTO fleet_counters (user_id, os, status, count)
+            VALUES ({_COUNTER_KEY}, 1)
+            ON CONFLICT (user_id, os, status) DO UPDATE SET count = count + 1;"""
+
+_COUNTER_DECREMENT = f"""
+            UPDATE fleet_counters SET count = count - 1
+            WHERE (user_id, os, status) = ({_COUNTER_KEY});"""
+
+_COUNTER_QUERY = """
+    SELECT COALESCE(user_id, 0), COALESCE(os, ''), COALESCE(status, 'offline'), COUNT(*)
+    FROM devices GROUP BY 1, 2, 3
+"""
+
+
+def rebuild_fleet_counters(conn=None):
+    """Recomputes fleet_counters from a full scan of devices (every shard if no conn)."""
+    if conn is None:
+        fan_out(rebuild_fleet_counters)
+        return
+
+    conn.execute("DELETE FROM fleet_counters")
+    conn.execute(f"INSERT INTO fleet_counters (user_id, os, status, count) {_COUNTER_QUERY}")
     conn.commit()
-    conn.close()
+
+
+def _check_shard_counters(conn):
+    conn.execute("BEGIN")
+    expected = {row[:3]: row[3] for row in conn.execute(_COUNTER_QUERY)}
+    actual = {
+        row[:3]: row[3]
+        for row in conn.execute("SELECT user_id, os, status, count FROM fleet_counters")
+        if row[3]
+    }
+    conn.rollback()
+
+    return {
+        f"{user_id}/{os_name}/{status}": {"expected": expected.get(key, 0), "actual": actual.get(key, 0)}
+        for key in expected.keys() | actual.keys()
+        if expected.get(key, 0) != actual.get(key, 0)
+        for user_id, os_name, status in [key]
+    }
+
+
+def check_fleet_counters():
+    """Compares fleet_counters with a full scan; returns the mismatched keys."""
+    mismatches = {}
+    for shard, shard_mismatches in enumerate(fan_out(_check_shard_counters)):
+        for key, counts in shard_mismatches.items():
+            mismatches[f"shard{shard}/{key}" if DB_SHARDS > 1 else key] = counts
+    return mismatches
+
+
+def fleet_summary(user_id=None):
+    """Device totals by status and OS, read from fleet_counters (no device scan)."""
+    def read(conn):
+        if user_id is None:
+            return conn.execute(
+                "SELECT user_id, os, status, count FROM fleet_counters WHERE count > 0"
+            ).fetchall()
+        return conn.execute(
+            "SELECT user_id, os, status, count FROM fleet_counters WHERE user_id=? AND count > 0",
+            (user_id,)
+        ).fetchall()
+
+    rows = [row for shard_rows in fan_out(read) for row in shard_rows]
+
+    summary = {"total": 0, "online": 0, "by_status": {}, "by_os": {}}
+    if user_id is None:
+        summary["by_user"] = {}
+
+    for owner, os_name, status, count in rows:
+        summary["total"] += count
+        if status == "online":
+            summary["online"] += count
+        summary["by_status"][status] = summary["by_status"].get(status, 0) + count
+        summary["by_os"][os_name or "unknown"] = summary["by_os"].get(os_name or "unknown", 0) + count
+        if user_id is None:
+            summary["by_user"][owner] = summary["by_user"].get(owner, 0) + count
+
+    return summary
@@ -1,15 +1,35 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from fastapi import FastAPI, Request, Form, Cookie, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 import uuid
 import subprocess
 import re
 import os
 import sqlite3
-
-from db import get_db, init_db
+import time
+import hmac
+import asyncio
+import signal
+from contextlib import asynccontextmanager
+
+from db import (
+    get_db, init_db, fleet_summary, check_fleet_counters, rebuild_fleet_counters,
+    device_db, get_shard_db, shard_for_key, new_device_id_sql, fan_out, shard_write, writer_stats,
+)
+from pages import PrecompressedStaticFiles, precompress_static, prerender, etag_matches
+import dashboard_cache
+import bulk_devices
+from prober import check_target as check_probe_target, run_prober
+import wire
+import maintenance
+import alerts
+import profiling
+from profiling import span
+from wire import WireError
+import session_tokens
+import shared_state
+from token_index import index as token_index, refresh_loop as token_index_refresh_loop
 
 # Email
 import smtplib
@@ -22,23 +42,83 @@ load_dotenv()
 # --------------------------------------------------
 # APP SETUP
 # --------------------------------------------------
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    tasks = [
+        asyncio.create_task(session_tokens.reaper_loop()),
+        asyncio.create_task(token_index_refresh_loop()),
+        asyncio.create_task(run_prober()),
+        asyncio.create_task(maintenance.scheduler_loop()),
+        asyncio.create_task(offline_sweep_loop()),
+        asyncio.create_task(alerts.alert_loop()),
+        asyncio.create_task(shared_state.run()),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=wire.FastJSONResponse)
 
 print("🚀 Initializing DB...")
 init_db()
-
-app.mount("/static", StaticFiles(directory="static"), name="static")
+session_tokens.load_keys()
+session_tokens.load_revocations()
+token_index.load()
+
+# Several app nodes: local changes are published, the others' applied
+if shared_state.enabled:
+    session_tokens.on_revoke = lambda jti, expires_at: shared_state.queue("revoke", [jti, expires_at])
+    alerts.engine.on_record = lambda *transition: shared_state.queue("transition", list(transition))
+    shared_state.handlers.update({
+        "revoke": lambda item: session_tokens.remember_revocation(*item),
+        "transition": lambda item: alerts.engine.record(*item, broadcast=False),
+        "token": token_index.add,
+    })
+
+precompress_static("static")
+app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    # Maintenance jobs wait for low-load windows
+    maintenance.record_request()
+
+    # Slow requests keep a per-span breakdown (db, render, email, subprocess)
+    token = profiling.start_request()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        profiling.finish_request(token, request.method, request.url.path,
+                                 status_code, time.perf_counter() - started)
+
+
+# `kill -USR1 <pid>` records a profile without going through HTTP
+if hasattr(signal, "SIGUSR1"):
+    profiling.install_signal_handler(signal.SIGUSR1)
+
+# Pages without per-request data are rendered once and served with ETags
+STATIC_PAGES = {
+    name: prerender(templates, name)
+    for name in ("index.html", "signup.html", "login.html")
+}
+
 # --------------------------------------------------
 # UTILITIES
 # --------------------------------------------------
 def get_mac_from_ip(ip_address: str):
     try:
-        subprocess.run(["ping", ip_address, "-n", "1"],
-                       stdout=subprocess.DEVNULL,
-                       stderr=subprocess.DEVNULL)
-        arp_output = subprocess.check_output(["arp", "-a"], text=True)
+        with span("subprocess"):
+            subprocess.run(["ping", ip_address, "-n", "1"],
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+            arp_output = subprocess.check_output(["arp", "-a"], text=True)
         match = re.search(rf"{re.escape(ip_address)}\s+([a-fA-F0-9:-]+)", arp_output)
         if match:
             return match.group(1)
@@ -48,43 +128,104 @@ def get_mac_from_ip(ip_address: str):
 
 
 def mark_offline_devices(timeout_seconds=60):
-    now = datetime.utcnow()
-    conn = get_db()
-    cur = conn.cursor()
+    cutoff = (datetime.utcnow() - timedelta(seconds=timeout_seconds)).isoformat()
 
-    cur.execute("SELECT id FROM users")
-    users = cur.fetchall()
+    def flip(conn):
+        cur = conn.cursor()
+        # Only devices that actually flip are touched; manual devices are
+        # kept up to date by the prober instead
+        cur.execute("""
+            SELECT id, user_id FROM devices
+            WHERE status != 'offline' AND last_seen < ? AND source IS NOT 'manual'
+        """, (cutoff,))
+        stale = cur.fetchall()
+
+        if stale:
+            cur.executemany(
+                "UPDATE devices SET status='offline' WHERE id=?",
+                [(device_id,) for device_id, _ in stale]
+            )
+            conn.commit()
+        return stale
+
+    stale = [row for shard_stale in fan_out(flip) for row in shard_stale]
+    record_offline(stale)
+
+
+def record_offline(stale):
+    dashboard_cache.bump(*{user_id for _, user_id in stale})
+    for device_id, user_id in stale:
+        alerts.engine.record(device_id, user_id, "offline")
+
+
+OFFLINE_SWEEP_INTERVAL = 30
+
+
+async def offline_sweep_loop():
+    # Alerts can't wait for someone to open the dashboard
+    while True:
+        try:
+            if shared_state.enabled:
+                # Liveness keys expire in the shared tier; only those are read
+                await asyncio.sleep(shared_state.SWEEP_INTERVAL)
+                try:
+                    record_offline(await shared_state.sweep())
+                except shared_state.RedisError as e:
+                    # The degraded dashboard and the alerts read SQLite
+                    print("Shared state unavailable, offline sweep runs on SQLite:", e)
+                    await asyncio.to_thread(mark_offline_devices)
+            else:
+                await asyncio.sleep(OFFLINE_SWEEP_INTERVAL)
+                await asyncio.to_thread(mark_offline_devices)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("Offline sweep error:", e)
+
+
+def authenticate(session):
+    """Returns (username, user_id) for a session cookie, or None."""
+    if not session:
+        return None
 
-    for (user_id,) in users:
-        cur.execute(
-            "SELECT device_key, last_seen FROM devices WHERE user_id=?",
-            (user_id,)
-        )
-        for device_key, last_seen in cur.fetchall():
-            if last_seen:
-                delta = now - datetime.fromisoformat(last_seen)
-                if delta.total_seconds() > timeout_seconds:
-                    cur.execute(
-                        "UPDATE devices SET status='offline' WHERE user_id=? AND device_key=?",
-                        (user_id, device_key)
-                    )
+    if session_tokens.is_signed(session):
+        payload = session_tokens.verify(session)
+        return (payload["u"], payload["uid"]) if payload else None
 
-    conn.commit()
+    # Legacy DB-backed session (until the reaper expires it)
+    cutoff = (datetime.utcnow() - timedelta(seconds=session_tokens.SESSION_TTL)).isoformat()
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT users.username, users.id FROM sessions
+        JOIN users ON users.username = sessions.username
+        WHERE sessions.session_id=? AND sessions.created_at >= ?
+    """, (session, cutoff))
+    row = cur.fetchone()
     conn.close()
+    return row
+
+
+def require_admin(request: Request):
+    admin_token = os.getenv("ADMIN_TOKEN")
+    supplied = request.headers.get("x-admin-token", "")
+    # Bytes: compare_digest raises TypeError on non-ASCII str
+    if not admin_token or not hmac.compare_digest(supplied.encode(), admin_token.encode()):
+        raise HTTPException(status_code=403)
 
 # --------------------------------------------------
 # INDEX
 # --------------------------------------------------
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return STATIC_PAGES["index.html"].response(request)
 
 # --------------------------------------------------
 # SIGNUP
 # --------------------------------------------------
 @app.get("/signup", response_class=HTMLResponse)
 async def signup_page(request: Request):
-    return templates.TemplateResponse("signup.html", {"request": request})
+    return STATIC_PAGES["signup.html"].response(request)
 
 
 @app.post("/signup")
@@ -123,7 +264,7 @@ Log in here:
 """
         msg.attach(MIMEText(body, "plain"))
 
-        with smtplib.SMTP(os.getenv("SMTP_HOST"), int(os.getenv("SMTP_PORT", 587))) as server:
+        with span("email"), smtplib.SMTP(os.getenv("SMTP_HOST"), int(os.getenv("SMTP_PORT", 587))) as server:
             server.starttls()
             server.login(os.getenv("SMTP_USER"), os.getenv("SMTP_PASSWORD"))
             server.send_message(msg)
@@ -138,7 +279,7 @@ Log in here:
 # --------------------------------------------------
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
+    return STATIC_PAGES["login.html"].response(request)
 
 
 @app.post("/login")
@@ -161,17 +302,16 @@ async def login(request: Request,
             {"request": request, "error": "Invalid credentials"}
         )
 
-    session_id = str(uuid.uuid4())
-    cur.execute(
-        "INSERT INTO sessions (session_id, username, created_at) VALUES (?, ?, ?)",
-        (session_id, username, datetime.utcnow().isoformat())
-    )
-
-    conn.commit()
     conn.close()
 
     response = RedirectResponse("/dashboard", status_code=302)
-    response.set_cookie("session", session_id, httponly=True)
+    response.set_cookie(
+        "session",
+        session_tokens.issue(username, user[0]),
+        max_age=session_tokens.SESSION_TTL,
+        httponly=True,
+        samesite="lax"
+    )
     return response
 
 # --------------------------------------------------
@@ -179,77 +319,146 @@ async def login(request: Request,
 # --------------------------------------------------
 @app.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(request: Request, session: str = Cookie(None)):
-    if not session:
+    auth = authenticate(session)
+    if not auth:
         return RedirectResponse("/login", status_code=303)
 
-    conn = get_db()
-    cur = conn.cursor()
+    username, user_id = auth
 
-    cur.execute("SELECT username FROM sessions WHERE session_id=?", (session,))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        return RedirectResponse("/login", status_code=303)
+    # Stale devices are flipped to offline by offline_sweep_loop, which
+    # bumps the cache version, so page views never write
+    version = dashboard_cache.version(user_id)
+    headers = {
+        "ETag": dashboard_cache.etag(user_id, version),
+        "Cache-Control": "private, no-cache",
+    }
 
-    username = row[0]
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        dashboard_cache.record_not_modified()
+        return Response(status_code=304, headers=headers)
+
+    body = dashboard_cache.get(user_id, version)
+    if body is None:
+        started = time.perf_counter()
+
+        # A user's devices can be on any shard
+        rows = fan_out(lambda conn: conn.execute("""
+            SELECT device_name, status, ip, mac, last_seen, recent_sites, device_key, source
+            FROM devices WHERE user_id=?
+        """, (user_id,)).fetchall())
+        rows = [row for shard_rows in rows for row in shard_rows]
+
+        # SQLite lags the shared tier by the write-behind interval
+        live, degraded = {}, False
+        if shared_state.enabled:
+            try:
+                live = await shared_state.liveness([row[6] for row in rows if row[7] != "manual"])
+            except shared_state.RedisError as e:
+                print("Shared state unavailable, dashboard served from SQLite:", e)
+                degraded = True
+
+        devices = {}
+        for name, status, ip, mac, last_seen, recent_sites, device_key, source in rows:
+            if device_key in live:
+                status = "online" if live[device_key] else "offline"
+                last_seen = live[device_key] or last_seen
+            devices[name] = {
+                "status": status,
+                "ip": ip,
+                "mac": mac,
+                "last_seen": last_seen,
+                "recent_sites": recent_sites
+            }
+
+        summary = fleet_summary(user_id)
+        with span("render"):
+            body = templates.get_template("dashboard.html").render({
+                "request": request,
+                "username": username,
+                "devices": devices,
+                "summary": summary,
+            }).encode("utf-8")
+        # The SQLite-only page is not cached: the version won't change when Redis is back
+        if not degraded:
+            dashboard_cache.put(user_id, version, body, time.perf_counter() - started)
+
+    return HTMLResponse(body, headers=headers)
 
-    cur.execute("SELECT id FROM users WHERE username=?", (username,))
-    user_id = cur.fetchone()[0]
+# --------------------------------------------------
+# FLEET SUMMARY
+# --------------------------------------------------
+@app.get("/fleet/summary")
+async def fleet_summary_view(session: str = Cookie(None)):
+    auth = authenticate(session)
+    if not auth:
+        raise HTTPException(status_code=401)
+    return fleet_summary(auth[1])
 
-    cur.execute("""
-        SELECT device_name, status, ip, mac, last_seen, recent_sites
-        FROM devices WHERE user_id=?
-    """, (user_id,))
-
-    devices = {
-        name: {
-            "status": status,
-            "ip": ip,
-            "mac": mac,
-            "last_seen": last_seen,
-            "recent_sites": recent_sites
-        }
-        for name, status, ip, mac, last_seen, recent_sites in cur.fetchall()
-    }
+# --------------------------------------------------
+# MANUAL DEVICE (no helper, probed by the server)
+# --------------------------------------------------
+@app.post("/add_device")
+async def add_device(device_name: str = Form(...),
+                     ip: str = Form(None),
+                     mac: str = Form(None),
+                     session: str = Cookie(None)):
+    auth = authenticate(session)
+    if not auth:
+        raise HTTPException(status_code=401)
+
+    if not ip and not mac:
+        raise HTTPException(status_code=400, detail="IP or MAC address required")
+    if ip:
+        try:
+            ip = check_probe_target(ip)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    _, user_id = auth
+
+    device_key = f"manual-{uuid.uuid4()}"
+    shard = shard_for_key(device_key)
 
+    conn = get_shard_db(shard)
+    cur = conn.cursor()
+    cur.execute(f"""
+        INSERT INTO devices (id, user_id, device_key, device_name, ip, mac, status, source)
+        VALUES ({new_device_id_sql(shard)}, ?, ?, ?, ?, ?, 'offline', 'manual')
+    """, (user_id, device_key, device_name, ip, mac))
+    conn.commit()
     conn.close()
-    mark_offline_devices()
 
-    return templates.TemplateResponse(
-        "dashboard.html",
-        {"request": request, "username": username, "devices": devices}
-    )
+    dashboard_cache.bump(user_id)
+    return RedirectResponse("/dashboard", status_code=303)
 
 # --------------------------------------------------
 # DELETE DEVICE ✅
 # --------------------------------------------------
 @app.post("/delete_device")
 async def delete_device(device_key: str = Form(...), session: str = Cookie(None)):
-    if not session:
+    auth = authenticate(session)
+    if not auth:
         raise HTTPException(status_code=401)
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute("SELECT username FROM sessions WHERE session_id=?", (session,))
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=401)
-
-    username = row[0]
-
-    cur.execute("SELECT id FROM users WHERE username=?", (username,))
-    user_id = cur.fetchone()[0]
+    _, user_id = auth
 
+    conn = device_db(device_key)
+    cur = conn.cursor()
     cur.execute(
         "DELETE FROM devices WHERE user_id=? AND device_key=?",
         (user_id, device_key)
     )
+    cur.execute("SELECT 1 FROM devices WHERE device_key=? LIMIT 1", (device_key,))
+    key_still_used = cur.fetchone() is not None
 
     conn.commit()
     conn.close()
 
+    if not key_still_used:
+        token_index.discard(device_key)
+    shared_state.forget_owners(device_key)
+    dashboard_cache.bump(user_id)
+
     return RedirectResponse("/dashboard", status_code=303)
 
 # --------------------------------------------------
@@ -257,65 +466,196 @@ async def delete_device(device_key: str = Form(...), session: str = Cookie(None)
 # --------------------------------------------------
 @app.post("/add_device_advanced_token")
 async def add_device_advanced_token(request: Request):
-    data = await request.json()
-
-    token = data.get("token")
-    device_name = data.get("device_name")
+    try:
+        data = await wire.decode(request, wire.DeviceRegistration, "Missing token or device name")
+    except WireError as e:
+        return wire.respond(request, {"error": e.message}, e.status_code)
 
-    if not token or not device_name:
-        return JSONResponse({"error": "Missing token or device name"}, status_code=400)
+    token = data.token
+    shard = shard_for_key(token)
 
-    conn = get_db()
+    conn = get_shard_db(shard)
     cur = conn.cursor()
 
-    cur.execute("""
+    cur.execute(f"""
         INSERT OR REPLACE INTO devices
-        (user_id, device_key, device_name, ip, mac, os, status, last_seen, recent_sites)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        (id, user_id, device_key, device_name, ip, mac, os, status, last_seen, recent_sites)
+        VALUES ({new_device_id_sql(shard)}, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (
         None,
         token,
-        device_name,
-        data.get("ip"),
-        data.get("mac"),
-        data.get("os"),
+        data.device_name,
+        data.ip,
+        data.mac,
+        data.os,
         "online",
         datetime.utcnow().isoformat(),
-        str(data.get("recent_sites", []))
+        str(data.recent_sites)
     ))
 
     conn.commit()
     conn.close()
+    token_index.add(token)
+
+    if shared_state.enabled:
+        shared_state.queue("token", token)
+        shared_state.forget_owners(token)
+        # Registration counts as the first heartbeat
+        try:
+            await shared_state.heartbeat(token)
+        except shared_state.RedisError as e:
+            # SQLite already has the device online
+            print("Shared state unavailable, registration stays in SQLite:", e)
+            shared_state.record_fallback()
 
-    return {"status": "ok"}
+    return wire.respond(request, {"status": "ok"})
 
 # --------------------------------------------------
 # HEARTBEAT
 # --------------------------------------------------
+# Both run on the shard's writer thread (see db.ShardWriter)
+def _record_heartbeat(conn, token, now):
+    owners = conn.execute(
+        "SELECT id, user_id, status FROM devices WHERE device_key=?", (token,)
+    ).fetchall()
+    if owners:
+        conn.execute(
+            "UPDATE devices SET last_seen=?, status='online' WHERE device_key=?",
+            (now, token)
+        )
+    return owners
+
+
+def _store_heartbeats(conn, token, rows):
+    if not conn.execute("SELECT 1 FROM devices WHERE device_key=? LIMIT 1", (token,)).fetchone():
+        return False
+    conn.executemany(
+        "INSERT INTO device_heartbeats (device_key, ip, last_seen) VALUES (?, ?, ?)",
+        rows
+    )
+    return True
+
+
 @app.post("/device_heartbeat")
 async def device_heartbeat(request: Request):
-    data = await request.json()
-    token = data.get("token")
+    try:
+        token = (await wire.decode(request, wire.Heartbeat, "Missing token")).token
+    except WireError as e:
+        return wire.respond(request, {"error": e.message}, e.status_code)
+
+    # Unknown tokens are answered without touching the database (apart
+    # from a rate-limited refresh for keys added on other workers)
+    if not token_index.might_exist(token) and not await asyncio.to_thread(token_index.recheck, token):
+        return wire.respond(request, {"error": "Device not found"}, 404)
+
+    owners = None
+    if shared_state.enabled:
+        # Liveness is kept in the shared tier, SQLite gets it write-behind
+        try:
+            owners = await shared_state.heartbeat(token)
+        except shared_state.RedisError as e:
+            print("Shared state unavailable, heartbeat goes to SQLite:", e)
+            shared_state.record_fallback()
+    if owners is None:
+        with span("db"):
+            owners = await asyncio.wrap_future(
+                shard_write(token, _record_heartbeat, token, datetime.utcnow().isoformat())
+            )
+    if not owners:
+        token_index.record_false_positive()
+        return wire.respond(request, {"error": "Device not found"}, 404)
+
+    # Only a status flip changes the dashboard (online devices show "now")
+    flipped = [(device_id, user_id) for device_id, user_id, status in owners if status == "offline"]
+    if flipped:
+        dashboard_cache.bump(*{user_id for _, user_id in flipped})
+    for device_id, user_id in flipped:
+        alerts.engine.record(device_id, user_id, "online")
+    return wire.respond(request, {"status": "ok"})
 
-    if not token:
-        return JSONResponse({"error": "Missing token"}, status_code=400)
+# --------------------------------------------------
+# HEARTBEAT BATCH (helper offline spool replay)
+# --------------------------------------------------
+MAX_HEARTBEAT_BATCH = 1000
 
-    conn = get_db()
-    cur = conn.cursor()
 
-    cur.execute("SELECT id FROM devices WHERE device_key=?", (token,))
-    if not cur.fetchone():
-        conn.close()
-        return JSONResponse({"error": "Device not found"}, status_code=404)
+@app.post("/device_heartbeat_batch")
+async def device_heartbeat_batch(request: Request):
+    try:
+        data = await wire.decode(request, wire.HeartbeatBatch, "Missing token or invalid heartbeats")
+    except WireError as e:
+        return wire.respond(request, {"error": e.message}, e.status_code)
 
-    cur.execute(
-        "UPDATE devices SET last_seen=?, status='online' WHERE device_key=?",
-        (datetime.utcnow().isoformat(), token)
+    token = data.token
+
+    if len(data.heartbeats) > MAX_HEARTBEAT_BATCH:
+        return wire.respond(request, {"error": "Batch too large"}, 413)
+    if not token_index.might_exist(token) and not await asyncio.to_thread(token_index.recheck, token):
+        return wire.respond(request, {"error": "Device not found"}, 404)
+
+    rows = [(token, hb.ip, hb.ts) for hb in data.heartbeats]
+
+    with span("db"):
+        stored = await asyncio.wrap_future(shard_write(token, _store_heartbeats, token, rows))
+    if not stored:
+        return wire.respond(request, {"error": "Device not found"}, 404)
+
+    return wire.respond(request, {"status": "ok", "stored": len(rows)})
+
+# --------------------------------------------------
+# BULK EXPORT / IMPORT
+# --------------------------------------------------
+@app.get("/devices/export")
+async def export_devices(format: str = "ndjson", session: str = Cookie(None)):
+    auth = authenticate(session)
+    if not auth:
+        raise HTTPException(status_code=401)
+    if format not in bulk_devices.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+
+    return StreamingResponse(
+        bulk_devices.iter_export(auth[1], format),
+        media_type=bulk_devices.FORMATS[format],
+        headers={"Content-Disposition": f"attachment; filename=devices.{format}"}
     )
 
-    conn.commit()
-    conn.close()
-    return {"status": "ok"}
+
+@app.post("/devices/import")
+async def import_devices(request: Request, format: str = "ndjson", session: str = Cookie(None)):
+    auth = authenticate(session)
+    if not auth:
+        raise HTTPException(status_code=401)
+    if format not in bulk_devices.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+
+    user_id = auth[1]
+    parser = bulk_devices.ImportParser(format)
+    batch = []
+    imported = 0
+
+    async def flush():
+        nonlocal batch, imported
+        await asyncio.to_thread(bulk_devices.write_batch, user_id, batch)
+        for row in batch:
+            token_index.add(row[0])
+        imported += len(batch)
+        batch = []
+
+    try:
+        async for chunk in request.stream():
+            batch.extend(parser.feed(chunk))
+            if len(batch) >= bulk_devices.IMPORT_BATCH_ROWS:
+                await flush()
+        batch.extend(parser.close())
+        if batch:
+            await flush()
+    except ValueError as e:
+        return JSONResponse({"error": str(e), "imported": imported}, status_code=413)
+    finally:
+        if imported:
+            dashboard_cache.bump(user_id)
+
+    return {"status": "ok", "imported": imported, "skipped": parser.skipped}
 
 # --------------------------------------------------
 # DOWNLOAD HELPER
@@ -329,12 +669,72 @@ async def download_helper(session: str = Cookie(None)):
         "https://www.dropbox.com/scl/fi/xudwa8j1bp2yet0wfxsbp/tiny_helper.exe?rlkey=fbbnv612f4agp1k3lxr5kljm8&st=i2cau113&dl=1"
     )
 
+# --------------------------------------------------
+# ADMIN STATS
+# --------------------------------------------------
+@app.get("/admin/stats")
+async def admin_stats(request: Request):
+    require_admin(request)
+    return {
+        "dashboard_cache": dashboard_cache.stats(),
+        "token_index": token_index.stats(),
+        "maintenance": maintenance.stats(),
+        "alerts": alerts.engine.snapshot(),
+        "shards": writer_stats(),
+        "shared_state": shared_state.stats(),
+    }
+
+
+@app.post("/admin/maintenance/{job}")
+async def admin_maintenance(job: str, request: Request):
+    require_admin(request)
+    if job not in maintenance.JOBS:
+        raise HTTPException(status_code=404)
+    await asyncio.to_thread(maintenance.run_job, job)
+    return maintenance.stats()["jobs"].get(job)
+
+
+@app.get("/admin/fleet")
+async def admin_fleet(request: Request):
+    require_admin(request)
+    return fleet_summary()
+
+
+@app.post("/admin/fleet/check")
+async def admin_fleet_check(request: Request, repair: bool = False):
+    require_admin(request)
+    mismatches = await asyncio.to_thread(check_fleet_counters)
+    if mismatches and repair:
+        await asyncio.to_thread(rebuild_fleet_counters)
+    return {"consistent": not mismatches, "mismatches": mismatches, "repaired": bool(mismatches and repair)}
+
+# --------------------------------------------------
+# ADMIN PROFILING
+# --------------------------------------------------
+@app.post("/admin/profile")
+async def admin_profile(request: Request, seconds: int = 30, format: str = "speedscope"):
+    require_admin(request)
+    if format not in ("speedscope", "folded"):
+        raise HTTPException(status_code=400, detail="format must be speedscope or folded")
+    if not profiling.start_profile(seconds, format):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return {"started": True, "seconds": min(max(seconds, 1), profiling.PROFILE_MAX_SECONDS),
+            "directory": profiling.PROFILE_DIR}
+
+
+@app.get("/admin/slow-requests")
+async def admin_slow_requests(request: Request):
+    require_admin(request)
+    return {"threshold_ms": profiling.SLOW_REQUEST_MS, "requests": profiling.slow_requests()}
+
 # --------------------------------------------------
 # LOGOUT
 # --------------------------------------------------
 @app.get("/logout")
 async def logout(session: str = Cookie(None)):
-    if session:
+    if session and session_tokens.is_signed(session):
+        session_tokens.revoke(session)
+    elif session:
         conn = get_db()
         cur = conn.cursor()
         cur.execute("DELETE FROM sessions WHERE session_id=?", (session,))
@@ -0,0 +1,315 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from db import DB_PATH, shard_paths
+
+# --------------------------------------------------
+# SQLITE MAINTENANCE
+# --------------------------------------------------
+# Background jobs for the database file. Each one works in short steps so
+# writers (heartbeats) are never held up for long:
+#   checkpoint – PASSIVE WAL checkpoint, TRUNCATE when load is low
+#   backup     – online copy via the backup API, BACKUP_PAGES per step
+#   optimize   – PRAGMA optimize (ANALYZE on first run)
+#   vacuum     – PRAGMA incremental_vacuum in VACUUM_PAGES steps
+#   prune      – deletes device_heartbeats older than HEARTBEAT_RETENTION_DAYS
+#                in PRUNE_ROWS steps (vacuum hands the pages back)
+# Everything except the checkpoint waits for a low-load window.
+BACKUP_DIR = os.getenv("BACKUP_DIR", "/data/backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", 3))
+BACKUP_PAGES = 256
+BACKUP_STEP_PAUSE = 0.01  # seconds between steps, lets writers in
+BACKUP_MAX_RESTARTS = 5
+
+VACUUM_PAGES = 256
+VACUUM_MAX_STEPS = 200
+
+HEARTBEAT_RETENTION_DAYS = int(os.getenv("HEARTBEAT_RETENTION_DAYS", 90))  # 0 keeps everything
+PRUNE_ROWS = 5000
+
+LOW_LOAD_RPM = int(os.getenv("MAINTENANCE_LOW_LOAD_RPM", 120))
+MAINTENANCE_TICK = 30
+
+JOB_INTERVALS = {
+    "checkpoint": 300,
+    "backup": 6 * 3600,
+    "optimize": 3600,
+    "vacuum": 24 * 3600,
+    "prune": 6 * 3600,
+}
+# Jobs that wait for low load are forced after this many intervals anyway
+MAX_DEFERRAL = 2
+
+# --------------------------------------------------
+# LOAD TRACKING
+# --------------------------------------------------
+_request_times = deque(maxlen=100_000)
+
+
+def record_request():
+    _request_times.append(time.monotonic())
+
+
+def requests_per_minute():
+    cutoff = time.monotonic() - 60
+    while _request_times and _request_times[0] < cutoff:
+        _request_times.popleft()
+    return len(_request_times)
+
+# --------------------------------------------------
+# JOB STATS
+# --------------------------------------------------
+_stats_lock = threading.Lock()
+_job_stats = {}
+
+
+class JobTimer:
+    """Tracks total duration and the time spent holding database locks."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock_seconds = 0.0
+        self.max_step = 0.0
+        self.steps = 0
+
+    def step(self, fn, *args):
+        began = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.add_step(time.perf_counter() - began)
+
+    def add_step(self, seconds):
+        self.lock_seconds += seconds
+        self.max_step = max(self.max_step, seconds)
+        self.steps += 1
+
+
+def _record(job, path, timer, error=None, **extra):
+    with _stats_lock:
+        stats = _job_stats.setdefault(job, {"runs": 0, "errors": 0})
+        stats["runs"] += 1
+        if error:
+            stats["errors"] += 1
+        stats["last"] = {
+            "db": path,
+            "finished_at": datetime.utcnow().isoformat(),
+            "duration_ms": round((time.perf_counter() - timer.started) * 1000, 3),
+            "lock_hold_ms": round(timer.lock_seconds * 1000, 3),
+            "max_step_ms": round(timer.max_step * 1000, 3),
+            "steps": timer.steps,
+            "error": error,
+            **extra,
+        }
+
+
+def stats():
+    with _stats_lock:
+        return {
+            "requests_per_minute": requests_per_minute(),
+            "jobs": {job: dict(s) for job, s in _job_stats.items()},
+        }
+
+# --------------------------------------------------
+# JOBS
+# --------------------------------------------------
+def checkpoint(path=DB_PATH, mode="PASSIVE"):
+    timer = JobTimer()
+    conn = sqlite3.connect(path)
+    try:
+        busy, log_frames, checkpointed = timer.step(
+            lambda: conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        )
+        _record("checkpoint", path, timer, mode=mode, busy=bool(busy),
+                wal_frames=log_frames, checkpointed=checkpointed)
+    finally:
+        conn.close()
+
+
+def backup(path=DB_PATH):
+    timer = JobTimer()
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    name = os.path.splitext(os.path.basename(path))[0]
+    target = os.path.join(BACKUP_DIR, f"{name}-{datetime.utcnow():%Y%m%d%H%M%S}.db")
+    tmp = f"{target}.tmp"
+
+    src = sqlite3.connect(path)
+    dst = sqlite3.connect(tmp)
+    restarts = 0
+    last_remaining = None
+    last_mark = time.perf_counter()
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining, last_mark
+        timer.add_step(time.perf_counter() - last_mark)
+        # A write by another connection makes the backup start over
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise _FinishInOnePass()
+        last_remaining = remaining
+        time.sleep(BACKUP_STEP_PAUSE)
+        last_mark = time.perf_counter()
+
+    try:
+        try:
+            src.backup(dst, pages=BACKUP_PAGES, progress=progress)
+        except _FinishInOnePass:
+            # Too busy to finish in steps; in WAL mode a single pass only
+            # holds a read snapshot, which doesn't block writers either
+            last_mark = time.perf_counter()
+            src.backup(dst, pages=-1)
+            timer.add_step(time.perf_counter() - last_mark)
+        dst.close()
+        os.replace(tmp, target)
+        _prune_backups(name)
+        _record("backup", path, timer, target=target, restarts=restarts,
+                size_bytes=os.path.getsize(target))
+    except Exception as e:
+        dst.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        _record("backup", path, timer, error=str(e), restarts=restarts)
+    finally:
+        src.close()
+
+
+class _FinishInOnePass(Exception):
+    pass
+
+
+def _prune_backups(name):
+    backups = sorted(
+        f for f in os.listdir(BACKUP_DIR)
+        if f.startswith(f"{name}-") and f.endswith(".db")
+    )
+    for old in backups[:-BACKUP_KEEP]:
+        os.remove(os.path.join(BACKUP_DIR, old))
+
+
+def optimize(path=DB_PATH):
+    timer = JobTimer()
+    conn = sqlite3.connect(path)
+    try:
+        analyzed = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'"
+        ).fetchone()
+        if not analyzed:
+            timer.step(conn.execute, "ANALYZE")
+        timer.step(conn.execute, "PRAGMA optimize")
+        conn.commit()
+        _record("optimize", path, timer, full_analyze=not analyzed)
+    finally:
+        conn.close()
+
+
+def vacuum(path=DB_PATH, allow_full=False):
+    timer = JobTimer()
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if auto_vacuum != 2:
+            # Databases created before auto_vacuum=INCREMENTAL need one full
+            # VACUUM to switch over, which blocks writers: low load only
+            if not allow_full:
+                _record("vacuum", path, timer, skipped="full VACUUM needs a low-load window")
+                return
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            timer.step(conn.execute, "VACUUM")
+            _record("vacuum", path, timer, converted=True)
+            return
+
+        before = free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        for _ in range(VACUUM_MAX_STEPS):
+            if not free_pages:
+                break
+            # executescript steps the pragma to completion; execute() steps
+            # it once, which frees a single page
+            timer.step(conn.executescript, f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            time.sleep(BACKUP_STEP_PAUSE)
+        _record("vacuum", path, timer, pages_freed=before - free_pages, free_pages=free_pages)
+    finally:
+        conn.close()
+
+
+def prune(path=DB_PATH):
+    timer = JobTimer()
+    if not HEARTBEAT_RETENTION_DAYS:
+        _record("prune", path, timer, skipped="HEARTBEAT_RETENTION_DAYS is 0")
+        return
+
+    cutoff = (datetime.utcnow() - timedelta(days=HEARTBEAT_RETENTION_DAYS)).isoformat()
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name='device_heartbeats'").fetchone():
+            return  # the main database once devices are sharded
+
+        # Old rows sit at the low ids, so each step's scan ends early
+        deleted = 0
+        for _ in range(VACUUM_MAX_STEPS):
+            step = timer.step(lambda: conn.execute("""
+                DELETE FROM device_heartbeats WHERE id IN (
+                    SELECT id FROM device_heartbeats WHERE last_seen < ? ORDER BY id LIMIT ?
+                )
+            """, (cutoff, PRUNE_ROWS)).rowcount)
+            deleted += step
+            if step < PRUNE_ROWS:
+                break
+            time.sleep(BACKUP_STEP_PAUSE)
+        _record("prune", path, timer, deleted=deleted, cutoff=cutoff)
+    finally:
+        conn.close()
+
+
+JOBS = {
+    "checkpoint": checkpoint,
+    "backup": backup,
+    "optimize": optimize,
+    "vacuum": vacuum,
+    "prune": prune,
+}
+
+# --------------------------------------------------
+# SCHEDULER
+# --------------------------------------------------
+def database_paths():
+    return [DB_PATH] + [path for path in shard_paths() if path != DB_PATH]
+
+
+def run_job(job, **kwargs):
+    for path in database_paths():
+        try:
+            JOBS[job](path, **kwargs)
+        except Exception as e:
+            _record(job, path, JobTimer(), error=str(e))
+
+
+async def scheduler_loop():
+    now = time.monotonic()
+    last_run = {job: now for job in JOBS}
+
+    while True:
+        await asyncio.sleep(MAINTENANCE_TICK)
+        now = time.monotonic()
+        low_load = requests_per_minute() < LOW_LOAD_RPM
+
+        for job, interval in JOB_INTERVALS.items():
+            elapsed = now - last_run[job]
+            if elapsed < interval:
+                continue
+            if job != "checkpoint" and not low_load and elapsed < interval * MAX_DEFERRAL:
+                continue
+
+            kwargs = {}
+            if job == "checkpoint" and low_load:
+                kwargs["mode"] = "TRUNCATE"
+            elif job == "vacuum":
+                kwargs["allow_full"] = low_load
+            await asyncio.to_thread(run_job, job, **kwargs)
+            last_run[job] = time.monotonic()
@@ -0,0 +1,143 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip variants are produced without it
+    brotli = None
+
+# --------------------------------------------------
+# CACHE POLICY
+# --------------------------------------------------
+PAGE_CACHE_CONTROL = "public, max-age=60, must-revalidate"
+STATIC_CACHE_CONTROL = "public, max-age=86400"
+
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".html", ".svg", ".json", ".txt"}
+
+# --------------------------------------------------
+# HEADER HELPERS
+# --------------------------------------------------
+def accepted_encodings(accept_encoding: str):
+    encodings = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if name:
+            encodings.add(name.lower())
+    return encodings
+
+
+def etag_matches(if_none_match: str, etag: str):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags
+
+# --------------------------------------------------
+# PRE-RENDERED PAGES
+# --------------------------------------------------
+class PrerenderedPage:
+    """A template rendered once at startup, kept raw, gzip'd and brotli'd."""
+
+    def __init__(self, body: bytes, media_type: str = "text/html; charset=utf-8"):
+        self.media_type = media_type
+        digest = hashlib.sha256(body).hexdigest()[:32]
+
+        self.variants = {None: (body, f'"{digest}"')}
+        self.variants["gzip"] = (gzip.compress(body, 9), f'"{digest}-gz"')
+        if brotli is not None:
+            self.variants["br"] = (brotli.compress(body), f'"{digest}-br"')
+
+    def response(self, request):
+        encodings = accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = next((e for e in ("br", "gzip") if e in encodings and e in self.variants), None)
+        body, etag = self.variants[encoding]
+
+        headers = {
+            "ETag": etag,
+            "Cache-Control": PAGE_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(body, media_type=self.media_type, headers=headers)
+
+
+def prerender(templates, name: str, **context):
+    body = templates.get_template(name).render(context).encode("utf-8")
+    return PrerenderedPage(body)
+
+# --------------------------------------------------
+# PRE-COMPRESSED STATIC ASSETS
+# --------------------------------------------------
+def _write_if_stale(target: str, source_mtime: float, data: bytes):
+    try:
+        if os.path.getmtime(target) >= source_mtime:
+            return
+    except OSError:
+        pass
+    tmp = f"{target}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, target)
+
+
+def precompress_static(directory: str):
+    """Writes .gz (and .br, when brotli is installed) next to text assets."""
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            if os.path.splitext(filename)[1] not in COMPRESSIBLE_SUFFIXES:
+                continue
+            path = os.path.join(root, filename)
+            try:
+                mtime = os.path.getmtime(path)
+                with open(path, "rb") as f:
+                    data = f.read()
+                _write_if_stale(f"{path}.gz", mtime, gzip.compress(data, 9))
+                if brotli is not None:
+                    _write_if_stale(f"{path}.br", mtime, brotli.compress(data))
+            except OSError as e:
+                print("Precompress error:", path, e)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that adds Cache-Control and serves .br/.gz siblings."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        encodings = accepted_encodings(request_headers.get("accept-encoding", ""))
+        media_type = mimetypes.guess_type(str(full_path))[0] or "text/plain"
+
+        path, encoding = full_path, None
+        for candidate, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if candidate not in encodings:
+                continue
+            try:
+                stat_result = os.stat(f"{full_path}{suffix}")
+            except OSError:
+                continue
+            path, encoding = f"{full_path}{suffix}", candidate
+            break
+
+        response = FileResponse(path, status_code=status_code, stat_result=stat_result, media_type=media_type)
+        response.headers["Cache-Control"] = STATIC_CACHE_CONTROL
+        response.headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
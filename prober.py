@@ -0,0 +1,344 @@
+import asyncio
+import errno
+import heapq
+import ipaddress
+import os
+import random
+import socket
+import struct
+import time
+from datetime import datetime
+
+from db import fan_out, get_shard_db, shard_for_id
+import dashboard_cache
+import alerts
+import shared_state
+
+# --------------------------------------------------
+# ACTIVE REACHABILITY PROBER
+# --------------------------------------------------
+# Manually added devices have no helper, so nothing heartbeats for them.
+# The prober checks them with an ICMP echo (when the OS allows unprivileged
+# ICMP sockets) and TCP connects, and writes the result into the same
+# status/last_seen columns the helpers use.
+#
+# Each device has its own interval: it doubles while the status stays the
+# same (up to PROBE_MAX_INTERVAL) and drops back to PROBE_MIN_INTERVAL as
+# soon as it changes.
+PROBE_ENABLED = os.getenv("PROBE_ENABLED", "1") == "1"
+PROBE_PORTS = tuple(int(p) for p in os.getenv("PROBE_PORTS", "80,443,22,445,3389").split(","))
+PROBE_CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", 500))
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", 2))
+PROBE_MIN_INTERVAL = 30
+PROBE_MAX_INTERVAL = 600
+PROBE_RELOAD_INTERVAL = 60
+PROBE_FLUSH_INTERVAL = 5
+PROBE_RETRY_DELAY = 5  # after running out of file descriptors
+# Users pick the addresses, so the server's own interfaces are off limits
+# unless the operator allows them (e.g. a single-host test setup)
+PROBE_ALLOW_LOCAL = os.getenv("PROBE_ALLOW_LOCAL", "0") == "1"
+
+
+def check_target(ip):
+    """Normalized address of a probe target; ValueError if it can't be probed."""
+    try:
+        address = ipaddress.ip_address(ip.strip())
+    except ValueError:
+        raise ValueError("IP must be an IPv4 or IPv6 address")
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    if address.is_multicast or address.is_unspecified:
+        raise ValueError("IP can't be a multicast or unspecified address")
+    if (address.is_loopback or address.is_link_local) and not PROBE_ALLOW_LOCAL:
+        raise ValueError("IP can't be a loopback or link-local address")
+    return str(address)
+
+
+def _default_max_sockets():
+    # Half the fd limit, the rest is left to the app (SQLite, clients)
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, ValueError, OSError):
+        return 256
+    if soft == resource.RLIM_INFINITY:
+        return 1024
+    return max(8, min(1024, soft // 2))
+
+
+# Each target opens one ICMP and several TCP sockets, so open sockets are
+# bounded on their own rather than through PROBE_CONCURRENCY
+PROBE_MAX_SOCKETS = int(os.getenv("PROBE_MAX_SOCKETS") or 0) or _default_max_sockets()
+
+# errnos that mean "this process is out of sockets", not "the host is down"
+_RESOURCE_ERRNOS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS}
+
+
+class ProbeDeferred(Exception):
+    """The probe couldn't run for lack of local resources; try again later."""
+
+
+_socket_slots = None
+
+
+def _sockets():
+    """Semaphore bounding the probe sockets open at once (per event loop)."""
+    global _socket_slots
+    loop = asyncio.get_running_loop()
+    if _socket_slots is None or _socket_slots[0] is not loop:
+        _socket_slots = (loop, asyncio.Semaphore(PROBE_MAX_SOCKETS))
+    return _socket_slots[1]
+
+
+async def tcp_probe(host, port, timeout=PROBE_TIMEOUT):
+    async with _sockets():
+        return await _tcp_probe(host, port, timeout)
+
+
+async def _tcp_probe(host, port, timeout):
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except ConnectionRefusedError:
+        return True  # the host answered with a reset, so it is up
+    except OSError as e:
+        if e.errno in _RESOURCE_ERRNOS:
+            raise ProbeDeferred(e) from e
+        return False
+    except asyncio.TimeoutError:
+        return False
+
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+
+def _icmp_checksum(data):
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+_icmp_available = hasattr(socket, "IPPROTO_ICMP")
+
+
+async def icmp_probe(host, timeout=PROBE_TIMEOUT):
+    """Echo request over an unprivileged ICMP socket; None if unsupported."""
+    if not _icmp_available:
+        return None
+    async with _sockets():
+        return await _icmp_probe(host, timeout)
+
+
+async def _icmp_probe(host, timeout):
+    global _icmp_available
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    except OSError as e:
+        if e.errno in _RESOURCE_ERRNOS:
+            raise ProbeDeferred(e) from e
+        _icmp_available = False
+        return None
+
+    loop = asyncio.get_running_loop()
+    sock.setblocking(False)
+    try:
+        header = struct.pack("!BBHHH", 8, 0, 0, 0, 1)
+        payload = b"tinylittlehelper"
+        packet = struct.pack("!BBHHH", 8, 0, _icmp_checksum(header + payload), 0, 1) + payload
+        await loop.sock_connect(sock, (host, 0))
+        await loop.sock_sendall(sock, packet)
+        reply = await asyncio.wait_for(loop.sock_recv(sock, 1024), timeout)
+        return bool(reply) and reply[0] == 0  # echo reply
+    except OSError as e:
+        if e.errno in _RESOURCE_ERRNOS:
+            raise ProbeDeferred(e) from e
+        return False
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        sock.close()
+
+
+async def probe_host(host):
+    if await icmp_probe(host):
+        return True
+    results = await asyncio.gather(
+        *(tcp_probe(host, port) for port in PROBE_PORTS), return_exceptions=True
+    )
+    if True in results:
+        return True
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return False
+
+
+class Target:
+    __slots__ = ("device_id", "user_id", "ip", "status", "interval", "next_due")
+
+    def __init__(self, device_id, user_id, ip, status):
+        self.device_id = device_id
+        self.user_id = user_id
+        self.ip = ip
+        self.status = status
+        self.interval = PROBE_MIN_INTERVAL
+        # Spread the first round so a restart doesn't probe everything at once
+        self.next_due = time.monotonic() + random.uniform(0, PROBE_MIN_INTERVAL)
+
+
+class Prober:
+    def __init__(self, probe=probe_host):
+        self.probe = probe
+        self.targets = {}
+        self.heap = []
+        self.results = []
+        self.tasks = set()  # in-flight probes; the loop only keeps weak references
+        self.stats = {"probes": 0, "up": 0, "down": 0, "deferred": 0, "transitions": 0}
+
+    def load_targets(self):
+        shards = fan_out(lambda conn: conn.execute("""
+            SELECT id, user_id, ip, status FROM devices
+            WHERE source = 'manual' AND ip IS NOT NULL AND ip != ''
+        """).fetchall())
+        return [row for rows in shards for row in rows if self._allowed(row[2])]
+
+    @staticmethod
+    def _allowed(ip):
+        # Rows written before addresses were checked are skipped, not probed
+        try:
+            check_target(ip)
+            return True
+        except ValueError:
+            return False
+
+    def apply_targets(self, rows):
+        seen = set()
+        for device_id, user_id, ip, status in rows:
+            seen.add(device_id)
+            target = self.targets.get(device_id)
+            if target is None:
+                target = self.targets[device_id] = Target(device_id, user_id, ip, status)
+                heapq.heappush(self.heap, (target.next_due, device_id))
+            else:
+                target.ip = ip
+        for device_id in self.targets.keys() - seen:
+            del self.targets[device_id]
+
+    def write_results(self, results):
+        now = datetime.utcnow().isoformat()
+        by_shard = {}
+        for device_id, up in results:
+            by_shard.setdefault(shard_for_id(device_id), []).append((device_id, up))
+
+        for shard, shard_results in by_shard.items():
+            conn = get_shard_db(shard)
+            conn.executemany(
+                "UPDATE devices SET status='online', last_seen=? WHERE id=?",
+                [(now, device_id) for device_id, up in shard_results if up]
+            )
+            conn.executemany(
+                "UPDATE devices SET status='offline' WHERE id=? AND status != 'offline'",
+                [(device_id,) for device_id, up in shard_results if not up]
+            )
+            conn.commit()
+            conn.close()
+
+    def _schedule(self, target, delay):
+        if target.device_id in self.targets:
+            target.next_due = time.monotonic() + delay
+            heapq.heappush(self.heap, (target.next_due, target.device_id))
+
+    async def _probe_one(self, target, semaphore):
+        try:
+            up = await self.probe(target.ip)
+        except ProbeDeferred:
+            up = None
+        except Exception:
+            up = False
+        finally:
+            semaphore.release()
+
+        if up is None:
+            # Says nothing about the device: keep its status, retry soon
+            self.stats["deferred"] += 1
+            self._schedule(target, PROBE_RETRY_DELAY + random.uniform(0, PROBE_RETRY_DELAY))
+            return
+
+        status = "online" if up else "offline"
+        previous = target.status
+        self.stats["probes"] += 1
+        self.stats["up" if up else "down"] += 1
+        if status == target.status:
+            target.interval = min(target.interval * 2, PROBE_MAX_INTERVAL)
+        else:
+            self.stats["transitions"] += 1
+            target.interval = PROBE_MIN_INTERVAL
+            alerts.engine.record(target.device_id, target.user_id, status)
+        target.status = status
+
+        self.results.append((target.device_id, target.user_id, up, status != previous))
+        self._schedule(target, target.interval)
+
+    async def _flush(self):
+        results, self.results = self.results, []
+        if not results:
+            return
+        await asyncio.to_thread(self.write_results, [(d, up) for d, _, up, _ in results])
+        # last_seen of online devices isn't shown, so only flips invalidate
+        dashboard_cache.bump(*{user_id for _, user_id, _, changed in results if changed})
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+        next_reload = next_flush = 0.0
+
+        while True:
+            # With several app nodes only the leader probes
+            if not shared_state.is_leader():
+                self.targets.clear()
+                self.heap.clear()
+                next_reload = 0.0
+                await asyncio.sleep(PROBE_MIN_INTERVAL)
+                continue
+
+            now = time.monotonic()
+            if now >= next_reload:
+                self.apply_targets(await asyncio.to_thread(self.load_targets))
+                next_reload = now + PROBE_RELOAD_INTERVAL
+            if now >= next_flush:
+                await self._flush()
+                next_flush = now + PROBE_FLUSH_INTERVAL
+
+            while self.heap and self.heap[0][0] <= time.monotonic():
+                due, device_id = heapq.heappop(self.heap)
+                target = self.targets.get(device_id)
+                if target is None or target.next_due != due:
+                    continue  # deleted or rescheduled
+                await semaphore.acquire()
+                task = asyncio.create_task(self._probe_one(target, semaphore))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+            wait = self.heap[0][0] - time.monotonic() if self.heap else 1.0
+            await asyncio.sleep(min(max(wait, 0.05), 1.0))
+
+
+prober = Prober()
+
+
+async def run_prober():
+    if not PROBE_ENABLED:
+        return
+    while True:
+        try:
+            await prober.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("Prober error:", e)
+            await asyncio.sleep(PROBE_MIN_INTERVAL)
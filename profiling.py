@@ -0,0 +1,252 @@
+import contextvars
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# --------------------------------------------------
+# REQUEST SPANS
+# --------------------------------------------------
+# Each request gets a dict of time spent per kind (db, render, email,
+# subprocess). The dict lives in a context variable, so work handed to
+# asyncio.to_thread or the threadpool is attributed to the right request.
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 500))
+SLOW_REQUEST_RING = int(os.getenv("SLOW_REQUEST_RING", 200))
+
+_current_spans = contextvars.ContextVar("request_spans", default=None)
+_slow_requests = deque(maxlen=SLOW_REQUEST_RING)
+
+
+@contextmanager
+def span(kind):
+    spans = _current_spans.get()
+    if spans is None or kind in spans["_open"]:
+        # Outside a request, or nested in a span of the same kind
+        yield
+        return
+
+    spans["_open"].add(kind)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans["_open"].discard(kind)
+        spans[kind] = spans.get(kind, 0.0) + time.perf_counter() - started
+        spans[f"{kind}_calls"] = spans.get(f"{kind}_calls", 0) + 1
+
+
+def start_request():
+    return _current_spans.set({"_open": set()})
+
+
+def finish_request(token, method, path, status_code, seconds):
+    spans = _current_spans.get()
+    _current_spans.reset(token)
+
+    total_ms = seconds * 1000
+    if total_ms < SLOW_REQUEST_MS or spans is None:
+        return
+
+    breakdown = {}
+    accounted = 0.0
+    for key, value in spans.items():
+        if key == "_open":
+            continue
+        if key.endswith("_calls"):
+            breakdown[key] = value
+        else:
+            breakdown[f"{key}_ms"] = round(value * 1000, 3)
+            accounted += value * 1000
+
+    breakdown["other_ms"] = round(max(total_ms - accounted, 0.0), 3)
+    _slow_requests.append({
+        "at": datetime.utcnow().isoformat(),
+        "method": method,
+        "path": path,
+        "status": status_code,
+        "total_ms": round(total_ms, 3),
+        "spans": breakdown,
+    })
+
+
+def slow_requests():
+    return list(_slow_requests)
+
+# --------------------------------------------------
+# TIMED SQLITE CONNECTION
+# --------------------------------------------------
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        with span("db"):
+            return super().execute(*args)
+
+    def executemany(self, *args):
+        with span("db"):
+            return super().executemany(*args)
+
+    def executescript(self, *args):
+        with span("db"):
+            return super().executescript(*args)
+
+    def fetchone(self):
+        with span("db"):
+            return super().fetchone()
+
+    def fetchmany(self, *args):
+        with span("db"):
+            return super().fetchmany(*args)
+
+    def fetchall(self):
+        with span("db"):
+            return super().fetchall()
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection whose statements count towards the 'db' span."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
+
+    def commit(self):
+        with span("db"):
+            return super().commit()
+
+# --------------------------------------------------
+# SAMPLING PROFILER
+# --------------------------------------------------
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/data/profiles")
+PROFILE_INTERVAL = 0.005  # seconds between samples
+PROFILE_MAX_SECONDS = 120
+
+_profile_lock = threading.Lock()
+_profile_running = False
+
+
+def _sample_stacks(seconds, interval):
+    """Samples every thread's stack; returns {thread name: [(stack, weight)]}."""
+    names = {t.ident: t.name for t in threading.enumerate()}
+    me = threading.get_ident()
+    samples = {}
+
+    deadline = time.perf_counter() + seconds
+    last = time.perf_counter()
+    while time.perf_counter() < deadline:
+        time.sleep(interval)
+        now = time.perf_counter()
+        weight, last = now - last, now
+
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            stack.reverse()
+            name = names.get(ident) or str(ident)
+            samples.setdefault(name, []).append((tuple(stack), weight))
+
+    return samples
+
+
+def to_speedscope(samples, seconds):
+    frames, frame_index = [], {}
+    profiles = []
+
+    for thread_name, thread_samples in samples.items():
+        stacks, weights = [], []
+        for stack, weight in thread_samples:
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indexes.append(frame_index[frame])
+            stacks.append(indexes)
+            weights.append(weight)
+        profiles.append({
+            "type": "sampled",
+            "name": thread_name,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": seconds,
+            "samples": stacks,
+            "weights": weights,
+        })
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": profiles,
+        "name": "tinylittlehelper",
+        "exporter": "tinylittlehelper-profiler",
+    }
+
+
+def to_folded(samples):
+    """Collapsed stacks ('a;b;c count'), the input format of flamegraph.pl."""
+    counts = {}
+    for thread_name, thread_samples in samples.items():
+        for stack, _ in thread_samples:
+            key = ";".join([thread_name] + [f"{name} ({os.path.basename(f)}:{line})" for name, f, line in stack])
+            counts[key] = counts.get(key, 0) + 1
+    return "".join(f"{key} {count}\n" for key, count in counts.items())
+
+
+def run_profile(seconds, fmt="speedscope"):
+    """Blocks for `seconds`, writes the profile and returns its path."""
+    global _profile_running
+    with _profile_lock:
+        if _profile_running:
+            return None
+        _profile_running = True
+
+    try:
+        seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+        samples = _sample_stacks(seconds, PROFILE_INTERVAL)
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = f"{datetime.utcnow():%Y%m%d%H%M%S}"
+        if fmt == "folded":
+            path = os.path.join(PROFILE_DIR, f"profile-{stamp}.folded")
+            with open(path, "w") as f:
+                f.write(to_folded(samples))
+        else:
+            path = os.path.join(PROFILE_DIR, f"profile-{stamp}.speedscope.json")
+            with open(path, "w") as f:
+                json.dump(to_speedscope(samples, seconds), f)
+
+        print("Profile written:", path)
+        return path
+    finally:
+        with _profile_lock:
+            _profile_running = False
+
+
+def start_profile(seconds, fmt="speedscope"):
+    """Runs a profile in a background thread; False if one is already running."""
+    if _profile_running:
+        return False
+    threading.Thread(target=run_profile, args=(seconds, fmt), name="profiler", daemon=True).start()
+    return True
+
+
+def install_signal_handler(signum, seconds=30):
+    import signal
+
+    signal.signal(signum, lambda *_: start_profile(seconds))
@@ -0,0 +1,132 @@
+import argparse
+import os
+import sys
+
+from db import (
+    DB_PATH, DB_SHARDS, connect, init_device_files, new_device_id_sql,
+    shard_for_key, shard_paths,
+)
+
+# --------------------------------------------------
+# RESHARDING
+# --------------------------------------------------
+# Copies devices and device_heartbeats from one shard layout into another:
+#
+#   python reshard.py --to 8              # from the current DB_SHARDS
+#   python reshard.py --from 4 --to 1     # back to the single file
+#
+# Stop the app first. Devices get new ids in the target layout (ids encode
+# the shard); fleet_counters are kept by the triggers as rows arrive. The
+# source is left as it was unless --prune is given. Start the app with
+# DB_SHARDS set to the new count afterwards.
+COPY_CHUNK_ROWS = 5000
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})") if row[1] != "id"]
+
+
+def _count(path, table):
+    conn = connect(path)
+    count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    conn.close()
+    return count
+
+
+def _copy_table(src, targets, table, new_ids):
+    columns = _columns(src, table)
+    key_index = columns.index("device_key")
+    placeholders = ", ".join("?" for _ in columns)
+
+    statements = []
+    for shard in range(len(targets)):
+        if new_ids:
+            statements.append(
+                f"INSERT INTO {table} (id, {', '.join(columns)}) "
+                f"VALUES ({new_device_id_sql(shard, len(targets))}, {placeholders})"
+            )
+        else:
+            statements.append(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})")
+
+    copied = 0
+    cur = src.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+    while True:
+        rows = cur.fetchmany(COPY_CHUNK_ROWS)
+        if not rows:
+            return copied
+
+        by_shard = {}
+        for row in rows:
+            by_shard.setdefault(shard_for_key(row[key_index], len(targets)), []).append(row)
+        for shard, shard_rows in by_shard.items():
+            targets[shard].executemany(statements[shard], shard_rows)
+        copied += len(rows)
+
+
+def reshard(source_count, target_count, prune=False):
+    sources = shard_paths(source_count)
+    targets = shard_paths(target_count)
+    if set(sources) & set(targets):
+        raise SystemExit("Source and target layouts share files")
+
+    init_device_files(target_count)
+    for path in targets:
+        if _count(path, "devices") or _count(path, "device_heartbeats"):
+            raise SystemExit(f"Target is not empty: {path}")
+
+    target_conns = [connect(path) for path in targets]
+    copied = {"devices": 0, "device_heartbeats": 0}
+    try:
+        for path in sources:
+            if not os.path.exists(path):
+                continue
+            src = connect(path)
+            copied["devices"] += _copy_table(src, target_conns, "devices", new_ids=True)
+            copied["device_heartbeats"] += _copy_table(src, target_conns, "device_heartbeats", new_ids=False)
+            src.close()
+            print(f"Copied {path}")
+
+        for conn in target_conns:
+            conn.commit()
+    except BaseException:
+        for conn in target_conns:
+            conn.rollback()
+        raise
+    finally:
+        for conn in target_conns:
+            conn.close()
+
+    for table, count in copied.items():
+        in_targets = sum(_count(path, table) for path in targets)
+        if in_targets != count:
+            raise SystemExit(f"{table}: copied {count} rows but targets hold {in_targets}")
+        print(f"{table}: {count} rows")
+
+    if prune:
+        for path in sources:
+            if path == DB_PATH:
+                # users and sessions live here too; only the device data goes
+                conn = connect(path)
+                conn.execute("DELETE FROM device_heartbeats")
+                conn.execute("DELETE FROM devices")
+                conn.commit()
+                conn.close()
+            else:
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+        print("Source pruned")
+
+    print(f"Done. Start the app with DB_SHARDS={target_count}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move device data to a different shard count")
+    parser.add_argument("--from", dest="source", type=int, default=DB_SHARDS)
+    parser.add_argument("--to", dest="target", type=int, required=True)
+    parser.add_argument("--prune", action="store_true", help="remove the data from the source layout")
+    args = parser.parse_args()
+
+    if args.source < 1 or args.target < 1:
+        sys.exit("Shard counts start at 1")
+    reshard(args.source, args.target, args.prune)
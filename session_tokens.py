@@ -0,0 +1,215 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+from db import get_db
+
+# --------------------------------------------------
+# SIGNED SESSION TOKENS
+# --------------------------------------------------
+# Token format: v1.<kid>.<payload>.<signature>, base64url without padding.
+# The payload carries the username, user id, expiry and a random jti, so a
+# request can be authenticated without touching the database.
+#
+# SESSION_KEYS="kid2:secret2,kid1:secret1" – the first key signs new tokens,
+# every listed key is accepted, which allows rotating keys without logging
+# everybody out. Without SESSION_KEYS a key is generated once and stored in
+# the session_keys table, so every worker process signs with the same key.
+#
+# Logouts reach the other workers within REVOCATION_POLL seconds.
+SESSION_TTL = int(os.getenv("SESSION_TTL", 7 * 24 * 3600))
+REAP_INTERVAL = int(os.getenv("SESSION_REAP_INTERVAL", 600))
+REVOCATION_POLL = int(os.getenv("SESSION_REVOCATION_POLL", 5))
+
+ACTIVE_KID = None
+SIGNING_KEYS = {}
+
+
+def load_keys():
+    """Loads the signing keys; called at startup, after init_db."""
+    global ACTIVE_KID, SIGNING_KEYS
+
+    keys = {}
+    active = None
+    for entry in os.getenv("SESSION_KEYS", "").split(","):
+        kid, _, secret = entry.strip().partition(":")
+        if kid and secret:
+            keys[kid] = secret.encode()
+            active = active or kid
+
+    if not keys:
+        # The first worker to get here creates the key, the others read it
+        conn = get_db()
+        conn.execute(
+            "INSERT OR IGNORE INTO session_keys (kid, secret) VALUES ('db', ?)",
+            (secrets.token_hex(32),)
+        )
+        conn.commit()
+        secret = conn.execute("SELECT secret FROM session_keys WHERE kid='db'").fetchone()[0]
+        conn.close()
+        print("SESSION_KEYS not set – using the key stored in the database")
+        active = "db"
+        keys[active] = secret.encode()
+
+    ACTIVE_KID, SIGNING_KEYS = active, keys
+
+# jti -> expiry (unix time); mirrors the revoked_sessions table
+_revoked = {}
+_revoked_lock = threading.Lock()
+_last_rowid = 0  # newest revoked_sessions row already in _revoked
+
+# Set when revocations have to reach other app nodes too (see shared_state)
+on_revoke = None
+
+
+def _b64encode(data: bytes):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(kid: str, signed_part: str):
+    return _b64encode(hmac.new(SIGNING_KEYS[kid], signed_part.encode(), hashlib.sha256).digest())
+
+
+def issue(username: str, user_id: int):
+    payload = {
+        "u": username,
+        "uid": user_id,
+        "exp": int(time.time()) + SESSION_TTL,
+        "jti": secrets.token_hex(8),
+    }
+    signed_part = f"v1.{ACTIVE_KID}.{_b64encode(json.dumps(payload, separators=(',', ':')).encode())}"
+    return f"{signed_part}.{_sign(ACTIVE_KID, signed_part)}"
+
+
+def is_signed(token: str):
+    return token.startswith("v1.")
+
+
+def verify(token: str):
+    """Returns the token payload, or None if it is forged, expired or revoked."""
+    try:
+        version, kid, payload_b64, signature = token.split(".")
+    except ValueError:
+        return None
+    if version != "v1" or kid not in SIGNING_KEYS:
+        return None
+
+    expected = _sign(kid, f"{version}.{kid}.{payload_b64}")
+    # Bytes: compare_digest raises TypeError on non-ASCII str
+    if not hmac.compare_digest(signature.encode(), expected.encode()):
+        return None
+
+    try:
+        payload = json.loads(_b64decode(payload_b64))
+    except ValueError:
+        return None
+
+    if payload.get("exp", 0) < time.time():
+        return None
+    with _revoked_lock:
+        if payload.get("jti") in _revoked:
+            return None
+    return payload
+
+# --------------------------------------------------
+# REVOCATION LIST
+# --------------------------------------------------
+def revoke(token: str):
+    payload = verify(token)
+    if not payload:
+        return
+
+    remember_revocation(payload["jti"], payload["exp"])
+    if on_revoke is not None:
+        on_revoke(payload["jti"], payload["exp"])
+
+    conn = get_db()
+    conn.execute(
+        "INSERT OR REPLACE INTO revoked_sessions (jti, expires_at) VALUES (?, ?)",
+        (payload["jti"], payload["exp"])
+    )
+    conn.commit()
+    conn.close()
+
+
+def remember_revocation(jti, expires_at):
+    with _revoked_lock:
+        _revoked[jti] = expires_at
+
+
+def load_revocations():
+    """Reloads the whole revocation list (drops expired entries)."""
+    global _last_rowid
+
+    conn = get_db()
+    last_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM revoked_sessions").fetchone()[0]
+    rows = conn.execute(
+        "SELECT jti, expires_at FROM revoked_sessions WHERE expires_at >= ? AND rowid <= ?",
+        (int(time.time()), last_rowid)
+    ).fetchall()
+    conn.close()
+
+    with _revoked_lock:
+        _revoked.clear()
+        _revoked.update(rows)
+        _last_rowid = last_rowid
+
+
+def load_new_revocations():
+    """Picks up logouts from other workers since the last (re)load."""
+    global _last_rowid
+
+    conn = get_db()
+    rows = conn.execute(
+        "SELECT rowid, jti, expires_at FROM revoked_sessions WHERE rowid > ? ORDER BY rowid",
+        (_last_rowid,)
+    ).fetchall()
+    conn.close()
+
+    with _revoked_lock:
+        for rowid, jti, expires_at in rows:
+            _revoked[jti] = expires_at
+            _last_rowid = max(_last_rowid, rowid)
+
+# --------------------------------------------------
+# REAPER
+# --------------------------------------------------
+def reap():
+    """Drops expired revocations and legacy DB sessions older than SESSION_TTL."""
+    cutoff = (datetime.utcnow() - timedelta(seconds=SESSION_TTL)).isoformat()
+
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM sessions WHERE created_at < ?", (cutoff,))
+    legacy = cur.rowcount
+    cur.execute("DELETE FROM revoked_sessions WHERE expires_at < ?", (int(time.time()),))
+    conn.commit()
+    conn.close()
+
+    load_revocations()
+    return legacy
+
+
+async def reaper_loop():
+    next_reap = 0.0
+    while True:
+        try:
+            if time.monotonic() >= next_reap:
+                next_reap = time.monotonic() + REAP_INTERVAL
+                await asyncio.to_thread(reap)
+            else:
+                await asyncio.to_thread(load_new_revocations)
+        except Exception as e:
+            print("Session reaper error:", e)
+        await asyncio.sleep(REVOCATION_POLL)
@@ -0,0 +1,364 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from db import fan_out, device_db, shard_for_key, write_shard
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError, ResponseError
+except ImportError:  # optional: without it every node keeps its own state
+    aioredis = None
+    RedisError = ResponseError = Exception
+
+# --------------------------------------------------
+# SHARED STATE TIER (optional)
+# --------------------------------------------------
+# With REDIS_URL set, several app nodes can run behind one load balancer.
+# SQLite stays the durable store; Redis holds what has to be shared:
+#
+#   liveness     – a heartbeat sets live:<device_key> with a LIVENESS_TTL
+#                  expiry (online while it exists) and scores the key in the
+#                  `presence` sorted set. The sweep reads expired scores off
+#                  the set, so it costs O(transitions); the node whose ZREM
+#                  wins writes the offline status to SQLite.
+#   write-behind – heartbeats don't write SQLite; last_seen collects in the
+#                  `last_seen` hash and is flushed every WRITE_BEHIND_INTERVAL.
+#   events       – session revocations, new device tokens and status
+#                  transitions are coalesced and published every
+#                  EVENT_INTERVAL; the other nodes apply them via `handlers`.
+#                  (Dashboard versions need no event: they live in SQLite.)
+#   leader       – one node runs the prober and sends the alert digests.
+#
+# REDIS_URL=fakeredis:// runs an in-process fakeredis server (local testing).
+REDIS_URL = os.getenv("REDIS_URL", "")
+LIVENESS_TTL = int(os.getenv("LIVENESS_TTL", 60))
+EVENT_INTERVAL = 0.1
+WRITE_BEHIND_INTERVAL = 5
+SWEEP_INTERVAL = 5  # cheap: only expired entries are read
+SWEEP_BATCH = 1000
+LEADER_TTL = 15
+OWNER_CACHE_TTL = 30
+OWNER_CACHE_SIZE = 100_000
+CHANNEL = "tlh:events"
+
+NODE_ID = uuid.uuid4().hex[:12]
+
+enabled = bool(REDIS_URL) and aioredis is not None
+if REDIS_URL and not enabled:
+    print("REDIS_URL is set but the redis package is missing – shared state disabled")
+
+# Event type -> fn(item), applied when another node publishes; set up by main
+handlers = {}
+
+_leader = not enabled
+_needs_reseed = False
+_outbox = {}
+_outbox_lock = threading.Lock()
+_owner_cache = {}
+_stats = {
+    "heartbeats": 0,
+    "fallbacks": 0,
+    "events_published": 0,
+    "events_received": 0,
+    "flushed": 0,
+    "swept": 0,
+    "reseeds": 0,
+}
+
+
+def _client():
+    if REDIS_URL.startswith("fakeredis://"):
+        import fakeredis
+        return fakeredis.FakeAsyncRedis(decode_responses=True)
+    return aioredis.from_url(REDIS_URL, decode_responses=True)
+
+
+_redis = _client() if enabled else None
+
+
+def is_leader():
+    return _leader
+
+
+def queue(kind, *items):
+    """Queues events for the other nodes; sent with the next publish."""
+    with _outbox_lock:
+        _outbox.setdefault(kind, []).extend(items)
+
+
+def record_fallback():
+    """A heartbeat went to SQLite only; `presence` is re-seeded once Redis answers."""
+    global _needs_reseed
+    _stats["fallbacks"] += 1
+    _needs_reseed = True
+
+
+def stats():
+    return {"node": NODE_ID, "leader": _leader, **_stats}
+
+# --------------------------------------------------
+# LIVENESS
+# --------------------------------------------------
+def _epoch(iso):
+    return (datetime.fromisoformat(iso) - datetime(1970, 1, 1)).total_seconds()
+
+
+def _read_owners(token):
+    conn = device_db(token)
+    rows = conn.execute("SELECT id, user_id FROM devices WHERE device_key=?", (token,)).fetchall()
+    conn.close()
+    return rows
+
+
+async def _owners(token):
+    cached = _owner_cache.get(token)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    rows = await asyncio.to_thread(_read_owners, token)
+    # Misses aren't cached: the device may be registered on another node
+    if rows:
+        if len(_owner_cache) >= OWNER_CACHE_SIZE:
+            _owner_cache.clear()
+        _owner_cache[token] = (time.monotonic() + OWNER_CACHE_TTL, rows)
+    return rows
+
+
+def forget_owners(token):
+    _owner_cache.pop(token, None)
+
+
+async def heartbeat(token):
+    """Records a heartbeat; returns (id, user_id, previous status) per owner."""
+    owners = await _owners(token)
+    if not owners:
+        return []
+
+    now = datetime.utcnow().isoformat()
+    pipe = _redis.pipeline(transaction=False)
+    pipe.set(f"live:{token}", now, ex=LIVENESS_TTL, get=True)
+    pipe.zadd("presence", {token: time.time()})
+    pipe.hset("last_seen", token, now)
+    previous, _, _ = await pipe.execute()
+
+    _stats["heartbeats"] += 1
+    status = "online" if previous is not None else "offline"
+    return [(device_id, user_id, status) for device_id, user_id in owners]
+
+
+async def liveness(device_keys):
+    """device_key -> last heartbeat (ISO time) for keys that are live, else None."""
+    if not device_keys:
+        return {}
+    values = await _redis.mget([f"live:{key}" for key in device_keys])
+    return dict(zip(device_keys, values))
+
+
+def _mark_offline(conn, keys):
+    stale = []
+    for key in keys:
+        stale += conn.execute("""
+            SELECT id, user_id FROM devices
+            WHERE device_key=? AND status != 'offline' AND source IS NOT 'manual'
+        """, (key,)).fetchall()
+    conn.executemany(
+        "UPDATE devices SET status='offline' WHERE id=?",
+        [(device_id,) for device_id, _ in stale]
+    )
+    return stale
+
+
+async def sweep():
+    """Marks devices whose liveness expired offline; returns [(id, user_id)]."""
+    global _needs_reseed
+    if _needs_reseed:
+        # Heartbeats SQLite took during an outage never reached `presence`;
+        # without this the sweep would take those devices offline
+        _needs_reseed = False
+        try:
+            await _seed_presence()
+        except Exception:
+            _needs_reseed = True
+            raise
+        _stats["reseeds"] += 1
+
+    stale = []
+    while True:
+        cutoff = time.time() - LIVENESS_TTL
+        expired = await _redis.zrangebyscore("presence", "-inf", cutoff, start=0, num=SWEEP_BATCH)
+        if not expired:
+            return stale
+
+        pipe = _redis.pipeline(transaction=False)
+        for key in expired:
+            pipe.zrem("presence", key)
+            pipe.exists(f"live:{key}")
+        results = await pipe.execute()
+
+        claimed, revived = [], {}
+        for key, removed, live in zip(expired, results[::2], results[1::2]):
+            if not removed:
+                continue  # another node got it
+            if live:
+                revived[key] = time.time()  # heartbeat raced the sweep
+            else:
+                claimed.append(key)
+        if revived:
+            await _redis.zadd("presence", revived)
+
+        by_shard = {}
+        for key in claimed:
+            by_shard.setdefault(shard_for_key(key), []).append(key)
+        for shard_stale in await asyncio.gather(*(
+            asyncio.wrap_future(write_shard(shard, _mark_offline, keys))
+            for shard, keys in by_shard.items()
+        )):
+            stale += shard_stale
+        _stats["swept"] += len(claimed)
+
+        if len(expired) < SWEEP_BATCH:
+            return stale
+
+
+async def _seed_presence():
+    """Puts devices that SQLite has online into the presence set (restart, outage)."""
+    rows = await asyncio.to_thread(fan_out, lambda conn: conn.execute("""
+        SELECT device_key, last_seen FROM devices
+        WHERE status != 'offline' AND source IS NOT 'manual' AND last_seen IS NOT NULL
+    """).fetchall())
+
+    now = time.time()
+    pipe = _redis.pipeline(transaction=False)
+    for shard_rows in rows:
+        for key, last_seen in shard_rows:
+            try:
+                seen = _epoch(last_seen)
+            except ValueError:
+                continue
+            # Already stale: scored but not live, so the next sweep takes it.
+            # gt: a newer heartbeat in SQLite moves an old score forward
+            pipe.zadd("presence", {key: seen}, gt=True)
+            if now - seen < LIVENESS_TTL:
+                pipe.set(f"live:{key}", last_seen, ex=int(LIVENESS_TTL - (now - seen)) + 1, nx=True)
+    await pipe.execute()
+
+# --------------------------------------------------
+# WRITE-BEHIND
+# --------------------------------------------------
+def _write_last_seen(conn, rows, cutoff):
+    conn.executemany(
+        """UPDATE devices SET last_seen=?, status=CASE WHEN ? > ? THEN 'online' ELSE status END
+           WHERE device_key=? AND (last_seen IS NULL OR last_seen < ?)""",
+        [(seen, seen, cutoff, key, seen) for key, seen in rows]
+    )
+
+
+async def flush_last_seen():
+    batch_key = f"last_seen:flush:{NODE_ID}"
+    try:
+        await _redis.rename("last_seen", batch_key)
+    except ResponseError:
+        return 0  # nothing pending
+
+    entries = await _redis.hgetall(batch_key)
+    # Entries older than the liveness window only update last_seen, so a
+    # late flush can't undo the sweep
+    cutoff = datetime.utcfromtimestamp(time.time() - LIVENESS_TTL).isoformat()
+
+    by_shard = {}
+    for key, seen in entries.items():
+        by_shard.setdefault(shard_for_key(key), []).append((key, seen))
+    await asyncio.gather(*(
+        asyncio.wrap_future(write_shard(shard, _write_last_seen, rows, cutoff))
+        for shard, rows in by_shard.items()
+    ))
+
+    await _redis.delete(batch_key)
+    _stats["flushed"] += len(entries)
+    return len(entries)
+
+# --------------------------------------------------
+# EVENTS / LEADER
+# --------------------------------------------------
+async def _publish_events():
+    with _outbox_lock:
+        if not _outbox:
+            return
+        events = dict(_outbox)
+        _outbox.clear()
+
+    await _redis.publish(CHANNEL, json.dumps({"node": NODE_ID, **events}))
+    _stats["events_published"] += sum(len(items) for items in events.values())
+
+
+async def _listen():
+    pubsub = _redis.pubsub()
+    await pubsub.subscribe(CHANNEL)
+    try:
+        async for message in pubsub.listen():
+            if message["type"] != "message":
+                continue
+            events = json.loads(message["data"])
+            if events.pop("node", None) == NODE_ID:
+                continue
+            for kind, items in events.items():
+                handler = handlers.get(kind)
+                if handler is None:
+                    continue
+                for item in items:
+                    handler(item)
+                _stats["events_received"] += len(items)
+    finally:
+        await pubsub.aclose()
+
+
+async def _elect():
+    global _leader
+    leader = False
+    try:
+        if await _redis.set("leader", NODE_ID, nx=True, ex=LEADER_TTL):
+            leader = True
+        elif await _redis.get("leader") == NODE_ID:
+            await _redis.expire("leader", LEADER_TTL)
+            leader = True
+    finally:
+        # Unable to renew (Redis unreachable) counts as stepping down: the
+        # lease runs out and another node may take over
+        if leader != _leader:
+            print(f"Node {NODE_ID} is {'now' if leader else 'no longer'} the leader")
+        _leader = leader
+
+
+async def _every(interval, fn, name):
+    while True:
+        try:
+            await fn()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Shared state {name} error:", e)
+        await asyncio.sleep(interval)
+
+
+async def run():
+    """Runs the shared-state loops; returns at once when disabled."""
+    global _needs_reseed
+    if not enabled:
+        return
+
+    print(f"Shared state on {REDIS_URL} as node {NODE_ID}")
+    # Redis may not be reachable yet: every step retries on its own, and the
+    # first sweep that gets through seeds `presence`
+    _needs_reseed = True
+
+    await asyncio.gather(
+        _every(LEADER_TTL / 3, _elect, "election"),
+        _every(1, _listen, "listener"),
+        _every(EVENT_INTERVAL, _publish_events, "publish"),
+        _every(WRITE_BEHIND_INTERVAL, flush_last_seen, "write-behind"),
+    )
@@ -0,0 +1,103 @@
+import importlib.util
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# The app is a set of top-level modules, not a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Server modules read their settings at import time, so the scratch
+# locations are set before any test imports them
+_DATA_DIR = tempfile.mkdtemp(prefix="tlh-tests-")
+os.environ.update({
+    "DB_PATH": os.path.join(_DATA_DIR, "tinylittlehelper.db"),
+    "SHARD_DIR": os.path.join(_DATA_DIR, "shards"),
+    "BACKUP_DIR": os.path.join(_DATA_DIR, "backups"),
+    "PROFILE_DIR": os.path.join(_DATA_DIR, "profiles"),
+    "ADMIN_TOKEN": "test-admin-token",
+})
+
+HELPER_DIR = Path(__file__).resolve().parent.parent / "Helper"
+
+
+@pytest.fixture
+def helper(tmp_path, monkeypatch):
+    """A fresh copy of Helper/tiny_helper.py whose files live in tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    spec = importlib.util.spec_from_file_location("tiny_helper_under_test", HELPER_DIR / "tiny_helper.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    if module._logger is not None:
+        module._logger.close()
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    import main
+    return main
+
+
+@pytest.fixture
+def client(app_module):
+    # Without the context manager the lifespan (background loops) doesn't run
+    from fastapi.testclient import TestClient
+    return TestClient(app_module.app)
+
+
+@pytest.fixture
+def make_user(app_module):
+    """Creates users; each call returns (user_id, cookies) with a signed session."""
+    import uuid
+    from datetime import datetime
+
+    import session_tokens
+    from db import get_db
+
+    def make():
+        username = f"user-{uuid.uuid4().hex[:8]}"
+        conn = get_db()
+        cur = conn.execute(
+            "INSERT INTO users (username, email, password, created_at) VALUES (?, ?, ?, ?)",
+            (username, f"{username}@example.com", "pw", datetime.utcnow().isoformat())
+        )
+        user_id = cur.lastrowid
+        conn.commit()
+        conn.close()
+        return user_id, {"session": session_tokens.issue(username, user_id)}
+
+    return make
+
+
+@pytest.fixture
+def user(make_user):
+    """A new user; returns (user_id, cookies) with a signed session."""
+    return make_user()
+
+
+@pytest.fixture
+def add_device(app_module):
+    """Inserts a helper device for a user, as a registration would."""
+    import uuid
+    from datetime import datetime
+
+    from db import get_shard_db, new_device_id_sql, shard_for_key
+    from token_index import index
+
+    def add(user_id, status="online", last_seen=None, os_name="Linux"):
+        key = str(uuid.uuid4())
+        shard = shard_for_key(key)
+        conn = get_shard_db(shard)
+        conn.execute(f"""
+            INSERT INTO devices (id, user_id, device_key, device_name, os, status, last_seen)
+            VALUES ({new_device_id_sql(shard)}, ?, ?, ?, ?, ?, ?)
+        """, (user_id, key, f"dev-{key[:8]}", os_name, status, last_seen or datetime.utcnow().isoformat()))
+        conn.commit()
+        conn.close()
+        index.add(key)
+        return key
+
+    return add
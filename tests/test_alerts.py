@@ -0,0 +1,176 @@
+import email
+import socketserver
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import alerts
+from db import device_db
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(alerts, "time", SimpleNamespace(monotonic=clock))
+    monkeypatch.setattr(alerts, "ALERTS_ENABLED", True)
+    monkeypatch.setattr(alerts, "ALERT_DEBOUNCE", 120)
+    monkeypatch.setattr(alerts, "ALERT_GROUP_WINDOW", 300)
+    return clock
+
+
+def test_offline_alert_waits_for_debounce(clock):
+    engine = alerts.AlertEngine()
+    engine.record(1, 10, "offline")
+    clock.now += 119
+    assert engine.due() == {}
+
+    clock.now += 1
+    assert engine.due() == {}  # batched, window still open
+    clock.now += 300
+    assert engine.due() == {10: {"opened": 1120.0, "offline": {1}, "online": set()}}
+
+
+def test_flap_within_debounce_is_suppressed(clock):
+    engine = alerts.AlertEngine()
+    for _ in range(5):
+        engine.record(1, 10, "offline")
+        clock.now += 30
+        engine.record(1, 10, "online")
+    clock.now += 1000
+    assert engine.due() == {}
+    assert engine.snapshot()["flaps_suppressed"] == 5
+
+
+def test_recovery_before_digest_cancels_offline_alert(clock):
+    engine = alerts.AlertEngine()
+    engine.record(1, 10, "offline")
+    clock.now += 120
+    engine.due()
+    engine.record(1, 10, "online")
+    clock.now += 300
+    ready = engine.due()
+    assert not any(batch["offline"] or batch["online"] for batch in ready.values())
+    assert engine.snapshot()["flaps_suppressed"] == 1
+
+
+def test_alerts_are_grouped_per_user(clock):
+    engine = alerts.AlertEngine()
+    engine.record(5, 10, "offline")
+    clock.now += 120
+    engine.due()
+    clock.now += 300
+    assert engine.due()[10]["offline"] == {5}
+
+    for device_id in (1, 2, 3):
+        engine.record(device_id, 10, "offline")
+    engine.record(4, 20, "offline")
+    engine.record(5, 10, "online")  # its offline alert went out earlier
+    clock.now += 120
+    engine.due()
+    clock.now += 300
+    ready = engine.due()
+    assert ready[10]["offline"] == {1, 2, 3} and ready[10]["online"] == {5}
+    assert ready[20]["offline"] == {4}
+
+
+def test_requeue_after_failed_send(clock):
+    engine = alerts.AlertEngine()
+    engine.record(1, 10, "offline")
+    clock.now += 420
+    engine.due()
+    clock.now += 300
+    ready = engine.due()
+    assert ready
+
+    engine.requeue(ready)
+    assert engine.due() == {}  # waits for the next window
+    clock.now += 300
+    assert engine.due()[10]["offline"] == {1}
+
+# --------------------------------------------------
+# SMTP STAND-IN
+# --------------------------------------------------
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: no TLS, no auth."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250 localhost")
+            elif command == "DATA":
+                self.reply("354 go ahead")
+                data = b""
+                while not data.endswith(b"\r\n.\r\n"):
+                    data += self.rfile.readline()
+                self.server.messages.append(email.message_from_bytes(data[:-5]))
+                self.reply("250 queued")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:  # MAIL FROM, RCPT TO, RSET, NOOP
+                self.reply("250 ok")
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _SMTPHandler)
+    server.daemon_threads = True
+    server.messages, server.connections = [], 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("SMTP_HOST", "127.0.0.1")
+    monkeypatch.setenv("SMTP_PORT", str(server.server_address[1]))
+    monkeypatch.setenv("SMTP_STARTTLS", "0")
+    monkeypatch.delenv("SMTP_USER", raising=False)
+    monkeypatch.setenv("FROM_EMAIL", "alerts@example.com")
+    monkeypatch.setenv("DOMAIN", "https://tlh.example.com")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _device_id(key):
+    conn = device_db(key)
+    row = conn.execute("SELECT id, device_name FROM devices WHERE device_key=?", (key,)).fetchone()
+    conn.close()
+    return row
+
+
+def test_digests_go_out_over_one_connection(smtp_server, make_user, add_device):
+    (first, _), (second, _) = make_user(), make_user()
+    down = [_device_id(add_device(first, status="offline")) for _ in range(3)]
+    up = _device_id(add_device(first))
+    other = _device_id(add_device(second, status="offline"))
+
+    sent = alerts.send_digests({
+        first: {"opened": 0, "offline": {d for d, _ in down}, "online": {up[0]}},
+        second: {"opened": 0, "offline": {other[0]}, "online": set()},
+        # A deleted device alone produces no mail
+        first + second + 10_000: {"opened": 0, "offline": {999_999}, "online": set()},
+    })
+
+    assert sent == 2
+    assert smtp_server.connections == 1
+    by_user = {msg["Subject"]: msg for msg in smtp_server.messages}
+    first_msg = next(m for s, m in by_user.items() if "3 offline, 1 back online" in s)
+    body = first_msg.get_payload(decode=True).decode()
+    assert all(name in body for _, name in down) and up[1] in body
+    assert "https://tlh.example.com/dashboard" in body
+    assert any("1 offline" in s and "back online" not in s for s in by_user)
@@ -0,0 +1,131 @@
+import json
+import time
+
+import pytest
+
+import bulk_devices
+from bulk_devices import ImportParser
+
+
+def _parse(fmt, body, chunk_size=7):
+    parser = ImportParser(fmt)
+    rows = []
+    for i in range(0, len(body), chunk_size):
+        rows += parser.feed(body[i:i + chunk_size])
+    rows += parser.close()
+    return rows, parser.skipped
+
+
+def test_ndjson_across_chunk_boundaries():
+    body = b"".join(
+        json.dumps({"device_key": f"k{i}", "device_name": f"n{i}"}).encode() + b"\n" for i in range(20)
+    )
+    rows, skipped = _parse("ndjson", body)
+    assert [row[0] for row in rows] == [f"k{i}" for i in range(20)]
+    assert rows[0][5] == "offline"  # default status
+    assert skipped == 0
+
+
+def test_ndjson_skips_bad_records():
+    body = b'{"device_key": "a", "device_name": "x"}\nnot json\n[1]\n{"device_key": "b"}\n\n'
+    rows, skipped = _parse("ndjson", body)
+    assert [row[0] for row in rows] == ["a"]
+    assert skipped == 3
+
+
+def test_csv_quoted_newlines_and_escapes():
+    body = b'device_key,device_name,os\nk1,"multi\nline ""name""",Linux\nk2,plain,\n'
+    rows, skipped = _parse("csv", body, chunk_size=3)
+    assert rows[0][:2] == ("k1", 'multi\nline "name"')
+    assert rows[0][4] == "Linux"
+    assert rows[1][:2] == ("k2", "plain")
+    assert skipped == 0
+
+
+def test_csv_unterminated_quote_at_end_is_skipped():
+    rows, skipped = _parse("csv", b'device_key,device_name\nk1,a\nk2,"open\n')
+    assert [row[0] for row in rows] == ["k1"]
+    assert skipped == 1
+
+
+def test_csv_stray_quote_is_bounded(monkeypatch):
+    monkeypatch.setattr(bulk_devices, "MAX_LINE_BYTES", 64 * 1024)
+    body = b'device_key,device_name\nk0,"stray\n' + b"".join(b"k%d,name\n" % i for i in range(200_000))
+
+    started = time.perf_counter()
+    with pytest.raises(ValueError):
+        _parse("csv", body, chunk_size=64 * 1024)
+    # Used to rescan the whole pending buffer per line (quadratic)
+    assert time.perf_counter() - started < 2
+
+
+def test_overlong_line_is_rejected(monkeypatch):
+    monkeypatch.setattr(bulk_devices, "MAX_LINE_BYTES", 100)
+    with pytest.raises(ValueError):
+        _parse("ndjson", b"x" * 500, chunk_size=50)
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "csv"])
+def test_export_import_round_trip(client, user, fmt):
+    _, cookies = user
+    client.cookies.update(cookies)
+    body = b"".join(
+        json.dumps({"device_key": f"rt-{fmt}-{i}", "device_name": f"n{i}", "os": "Linux"}).encode() + b"\n"
+        for i in range(250)
+    )
+    response = client.post("/devices/import?format=ndjson", content=body)
+    assert response.json() == {"status": "ok", "imported": 250, "skipped": 0}
+
+    exported = client.get(f"/devices/export?format={fmt}").content
+    rows, skipped = _parse(fmt, exported, chunk_size=1000)
+    assert sorted(row[0] for row in rows) == sorted(f"rt-{fmt}-{i}" for i in range(250))
+    assert skipped == 0
+
+
+def test_ndjson_values_are_coerced_or_rejected():
+    body = b"".join(json.dumps(record).encode() + b"\n" for record in [
+        {"device_key": 123, "device_name": "numeric key"},
+        {"device_key": "a", "device_name": {"nested": 1}},
+        {"device_key": "b", "device_name": "x", "ip": ["10.0.0.1"]},
+        {"device_key": "c", "device_name": "x", "os": True},
+        {"device_key": "d", "device_name": "x", "recent_sites": ["example.com"]},
+    ])
+    rows, skipped = _parse("ndjson", body)
+    assert [row[0] for row in rows] == ["123", "d"]
+    assert rows[1][7] == "['example.com']"
+    assert skipped == 3
+
+
+def test_csv_field_above_the_csv_module_default():
+    big = "x" * (200 * 1024)
+    rows, skipped = _parse("csv", f'device_key,device_name,recent_sites\nk1,n1,"{big}"\n'.encode(), 4096)
+    assert rows[0][7] == big and skipped == 0
+
+
+def test_import_rejects_bad_types_without_500(client, user):
+    _, cookies = user
+    client.cookies.update(cookies)
+    body = b'{"device_key": 123, "device_name": "ok"}\n{"device_key": "k", "device_name": {"a": 1}}\n'
+    response = client.post("/devices/import?format=ndjson", content=body)
+    assert response.json() == {"status": "ok", "imported": 1, "skipped": 1}
+
+    big = b"x" * (200 * 1024)
+    response = client.post("/devices/import?format=csv", content=b"device_key,device_name\nbig," + big + b"\n")
+    assert response.json() == {"status": "ok", "imported": 1, "skipped": 0}
+
+
+def test_source_round_trips_and_is_validated(client, user):
+    _, cookies = user
+    client.cookies.update(cookies)
+    records = [
+        {"device_key": "src-manual", "device_name": "nas", "ip": "10.0.0.5", "source": "manual"},
+        {"device_key": "src-helper", "device_name": "laptop"},
+        {"device_key": "src-bad", "device_name": "x", "source": "robot"},
+        {"device_key": "src-local", "device_name": "x", "ip": "127.0.0.1", "source": "manual"},
+    ]
+    body = b"".join(json.dumps(r).encode() + b"\n" for r in records)
+    assert client.post("/devices/import?format=ndjson", content=body).json()["skipped"] == 2
+
+    exported = [json.loads(line) for line in client.get("/devices/export?format=ndjson").text.splitlines()]
+    sources = {d["device_key"]: d["source"] for d in exported}
+    assert sources == {"src-manual": "manual", "src-helper": "helper"}
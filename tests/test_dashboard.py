@@ -0,0 +1,83 @@
+from db import get_db
+
+
+def _dashboard(client, cookies, etag=None):
+    client.cookies.update(cookies)
+    headers = {"If-None-Match": etag} if etag else {}
+    return client.get("/dashboard", headers=headers)
+
+
+def test_repeat_load_is_not_modified(client, user, add_device):
+    user_id, cookies = user
+    add_device(user_id)
+
+    first = _dashboard(client, cookies)
+    assert first.status_code == 200
+    assert _dashboard(client, cookies, first.headers["etag"]).status_code == 304
+
+
+def test_heartbeat_without_status_change_keeps_etag(client, user, add_device):
+    user_id, cookies = user
+    key = add_device(user_id, status="online")
+    etag = _dashboard(client, cookies).headers["etag"]
+
+    assert client.post("/device_heartbeat", json={"token": key}).status_code == 200
+    assert _dashboard(client, cookies, etag).status_code == 304
+
+
+def test_status_flip_changes_etag(client, user, add_device):
+    user_id, cookies = user
+    key = add_device(user_id, status="offline", last_seen="2000-01-01T00:00:00")
+    etag = _dashboard(client, cookies).headers["etag"]
+
+    assert client.post("/device_heartbeat", json={"token": key}).status_code == 200
+    response = _dashboard(client, cookies, etag)
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+def test_version_bumped_by_another_worker_is_seen(client, user, add_device):
+    user_id, cookies = user
+    add_device(user_id)
+    etag = _dashboard(client, cookies).headers["etag"]
+
+    # What a bump in a different process looks like to this one
+    conn = get_db()
+    conn.execute(
+        "INSERT INTO dashboard_versions (user_id, version) VALUES (?, 1) "
+        "ON CONFLICT (user_id) DO UPDATE SET version = version + 1",
+        (user_id,)
+    )
+    conn.commit()
+    conn.close()
+
+    assert _dashboard(client, cookies, etag).status_code == 200
+
+
+def test_admin_token_with_non_ascii_is_rejected(client):
+    assert client.get("/admin/stats", headers={"X-Admin-Token": "é".encode()}).status_code == 403
+    assert client.get("/admin/stats", headers={"X-Admin-Token": "test-admin-token"}).status_code == 200
+
+
+def test_page_views_leave_the_offline_sweep_to_the_loop(client, user, add_device, monkeypatch):
+    import main
+
+    def no_sweep(*args):
+        raise AssertionError("dashboard swept devices")
+
+    monkeypatch.setattr(main, "mark_offline_devices", no_sweep)
+    user_id, cookies = user
+    add_device(user_id, status="online", last_seen="2000-01-01T00:00:00")
+    etag = _dashboard(client, cookies).headers["etag"]
+    assert _dashboard(client, cookies, etag).status_code == 304
+
+
+def test_sweep_flip_changes_etag(client, user, add_device, app_module):
+    user_id, cookies = user
+    add_device(user_id, status="online", last_seen="2000-01-01T00:00:00")
+    etag = _dashboard(client, cookies).headers["etag"]
+
+    app_module.mark_offline_devices()
+    response = _dashboard(client, cookies, etag)
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
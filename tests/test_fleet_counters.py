@@ -0,0 +1,99 @@
+import random
+
+from db import (
+    check_fleet_counters, fleet_summary, get_shard_db, rebuild_fleet_counters, shard_for_key,
+)
+
+
+def test_counters_follow_registration_flip_and_delete(user, add_device):
+    user_id, _ = user
+    keys = [add_device(user_id, status="online", os_name="Linux") for _ in range(3)]
+    add_device(user_id, status="offline", os_name="Windows")
+    assert fleet_summary(user_id) == {
+        "total": 4, "online": 3,
+        "by_status": {"online": 3, "offline": 1},
+        "by_os": {"Linux": 3, "Windows": 1},
+    }
+
+    conn = get_shard_db(shard_for_key(keys[0]))
+    conn.execute("UPDATE devices SET status='offline' WHERE device_key=?", (keys[0],))
+    conn.commit()
+    conn.close()
+    conn = get_shard_db(shard_for_key(keys[1]))
+    conn.execute("DELETE FROM devices WHERE device_key=?", (keys[1],))
+    conn.commit()
+    conn.close()
+
+    summary = fleet_summary(user_id)
+    assert summary["total"] == 3
+    assert summary["online"] == 1
+    assert check_fleet_counters() == {}
+
+
+def test_insert_or_replace_does_not_drift(user, add_device):
+    user_id, _ = user
+    key = add_device(user_id, status="online", os_name="Linux")
+
+    conn = get_shard_db(shard_for_key(key))
+    for _ in range(3):
+        # What a repeated helper registration does
+        conn.execute("""
+            INSERT OR REPLACE INTO devices (user_id, device_key, device_name, os, status)
+            VALUES (?, ?, 'again', 'macOS', 'online')
+        """, (user_id, key))
+    conn.commit()
+    conn.close()
+
+    assert fleet_summary(user_id)["by_os"] == {"macOS": 1}
+    assert check_fleet_counters() == {}
+
+
+def test_random_churn_stays_consistent(user, add_device):
+    user_id, _ = user
+    rng = random.Random(42)
+    keys = [add_device(user_id, status=rng.choice(["online", "offline"])) for _ in range(30)]
+
+    for key in keys:
+        conn = get_shard_db(shard_for_key(key))
+        action = rng.choice(["flip", "os", "delete", "owner"])
+        if action == "flip":
+            conn.execute("UPDATE devices SET status = CASE status WHEN 'online' THEN 'offline' ELSE 'online' END "
+                         "WHERE device_key=?", (key,))
+        elif action == "os":
+            conn.execute("UPDATE devices SET os=? WHERE device_key=?", (rng.choice(["Linux", None, "BSD"]), key))
+        elif action == "delete":
+            conn.execute("DELETE FROM devices WHERE device_key=?", (key,))
+        else:
+            conn.execute("UPDATE devices SET user_id=NULL WHERE device_key=?", (key,))
+        conn.commit()
+        conn.close()
+
+    assert check_fleet_counters() == {}
+
+
+def test_check_finds_and_rebuild_repairs_drift(user, add_device, client):
+    user_id, _ = user
+    add_device(user_id)
+
+    conn = get_shard_db(0)
+    conn.execute("UPDATE fleet_counters SET count = count + 5 WHERE user_id=?", (user_id,))
+    conn.commit()
+    conn.close()
+
+    mismatches = check_fleet_counters()
+    assert mismatches
+    assert all(counts["actual"] == counts["expected"] + 5 for counts in mismatches.values())
+
+    headers = {"X-Admin-Token": "test-admin-token"}
+    response = client.post("/admin/fleet/check?repair=true", headers=headers).json()
+    assert response["repaired"] is True
+    assert check_fleet_counters() == {}
+
+
+def test_rebuild_matches_incremental(user, add_device):
+    user_id, _ = user
+    for status in ("online", "offline", "online"):
+        add_device(user_id, status=status)
+    before = fleet_summary()
+    rebuild_fleet_counters()
+    assert fleet_summary() == before
@@ -0,0 +1,57 @@
+import os
+import sqlite3
+
+QUERY = "SELECT url, title FROM urls ORDER BY last_visit_time DESC LIMIT ?"
+
+
+def _history(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT, title TEXT, last_visit_time INTEGER)")
+    conn.executemany("INSERT INTO urls VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def test_reads_newest_rows(helper, tmp_path):
+    db = tmp_path / "History"
+    _history(db, [(f"https://{i}", f"t{i}", i) for i in range(20)])
+
+    rows = helper.read_sqlite_safely(db, QUERY, limit=3)
+    assert [url for url, _ in rows] == ["https://19", "https://18", "https://17"]
+
+
+def test_unchanged_source_is_not_reopened(helper, tmp_path, monkeypatch):
+    db = tmp_path / "History"
+    _history(db, [("https://a", "a", 1)])
+    helper.read_sqlite_safely(db, QUERY)
+
+    opened = []
+    real_query = helper._query_sqlite
+    monkeypatch.setattr(helper, "_query_sqlite", lambda *a: opened.append(a) or real_query(*a))
+    assert helper.read_sqlite_safely(db, QUERY) == [("https://a", "a")]
+    assert opened == []
+
+    _history(db, [("https://b", "b", 2)])
+    # mtime granularity can be coarse; the size change alone must be enough
+    os.utime(db, ns=(0, 0))
+    assert helper.read_sqlite_safely(db, QUERY)[0] == ("https://b", "b")
+    assert len(opened) == 1
+
+
+def test_sees_rows_still_in_the_wal(helper, tmp_path):
+    db = tmp_path / "History"
+    _history(db, [("https://old", "old", 1)])
+
+    writer = sqlite3.connect(db)
+    writer.execute("PRAGMA journal_mode=WAL")
+    writer.execute("PRAGMA wal_autocheckpoint=0")
+    writer.execute("INSERT INTO urls VALUES ('https://new', 'new', 2)")
+    writer.commit()
+    try:
+        assert helper.read_sqlite_safely(db, QUERY)[0] == ("https://new", "new")
+    finally:
+        writer.close()
+
+
+def test_missing_source(helper, tmp_path):
+    assert helper.read_sqlite_safely(tmp_path / "nope", QUERY) == []
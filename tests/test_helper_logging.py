@@ -0,0 +1,45 @@
+def test_level_filter(helper):
+    helper.LOG_LEVEL = "WARNING"
+    helper.log("quiet", "INFO")
+    helper.log("loud", "WARNING")
+    helper._logger.close()
+
+    text = helper.LOG_FILE.read_text()
+    assert "loud" in text
+    assert "quiet" not in text
+
+
+def test_json_lines(helper):
+    import json
+
+    helper.LOG_FORMAT = "json"
+    helper.log("hello")
+    helper._logger.close()
+
+    record = json.loads(helper.LOG_FILE.read_text().splitlines()[0])
+    assert record["l"] == "INFO"
+    assert record["m"] == "hello"
+
+
+def test_rotation_keeps_disk_usage_bounded(helper):
+    helper.LOG_MAX_BYTES = 2000
+    logger = helper.BackgroundLogger(helper.LOG_FILE)
+    for i in range(50):
+        # One record per write, so every write gets a chance to rotate
+        logger._write([(0.0, "INFO", "x" * 200 + str(i))])
+    logger.close()
+
+    files = sorted(p.name for p in helper.LOG_FILE.parent.glob("helper_debug.log*"))
+    assert files == ["helper_debug.log"] + [f"helper_debug.log.{i}" for i in range(1, helper.LOG_BACKUP_COUNT + 1)]
+    assert all(p.stat().st_size <= helper.LOG_MAX_BYTES + 300 for p in helper.LOG_FILE.parent.glob("helper_debug.log*"))
+
+
+def test_full_queue_drops_instead_of_blocking(helper):
+    logger = helper.BackgroundLogger.__new__(helper.BackgroundLogger)
+    logger.level = 0
+    logger.queue = helper.queue.Queue(maxsize=1)
+    logger.dropped = 0
+
+    logger.log("first")
+    logger.log("second")
+    assert logger.dropped == 1
@@ -0,0 +1,50 @@
+import pytest
+
+
+def _spool(helper, count):
+    for i in range(count):
+        helper.spool_heartbeat({"ts": f"2024-01-01T00:00:{i:02d}", "ip": "10.0.0.1"})
+
+
+def _spooled(helper):
+    conn = helper.spool_connect()
+    n = conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+    conn.close()
+    return n
+
+
+def _replay(helper, monkeypatch, status, headers=None):
+    monkeypatch.setattr(helper, "get_device_token", lambda: "token")
+    monkeypatch.setattr(helper, "http_request", lambda *args, **kwargs: (status, "", headers or {}))
+    helper._next_replay_at = 0
+    helper.replay_spool()
+
+
+def test_delivered_batch_leaves_the_spool(helper, monkeypatch):
+    helper.REPLAY_BATCH_SIZE = 3
+    _spool(helper, 5)
+    _replay(helper, monkeypatch, 200)
+    assert _spooled(helper) == 2
+
+
+@pytest.mark.parametrize("status", [500, 502, 408])
+def test_transient_failure_keeps_the_batch(helper, monkeypatch, status):
+    _spool(helper, 5)
+    _replay(helper, monkeypatch, status)
+    assert _spooled(helper) == 5
+
+
+def test_throttled_replay_backs_off(helper, monkeypatch):
+    _spool(helper, 5)
+    _replay(helper, monkeypatch, 429, {"Retry-After": "120"})
+    assert _spooled(helper) == 5
+    assert helper._next_replay_at > helper.time.monotonic() + 100
+
+
+@pytest.mark.parametrize("status", [400, 404, 413])
+def test_rejected_batch_is_dropped(helper, monkeypatch, status):
+    helper.REPLAY_BATCH_SIZE = 3
+    _spool(helper, 5)
+    _replay(helper, monkeypatch, status)
+    # Only the rejected batch goes; the rest gets its own chance
+    assert _spooled(helper) == 2
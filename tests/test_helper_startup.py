@@ -0,0 +1,21 @@
+import pytest
+
+from benchmarks.bench_helper_startup import (
+    DEFERRED_MODULES, IMPORT_BUDGET_US, RSS_BUDGET_KB, VARIANTS, measure,
+)
+
+
+@pytest.mark.parametrize("variant", VARIANTS)
+def test_import_stays_within_budget(variant):
+    # Best of three, so one slow run on a busy machine doesn't fail the test
+    runs = [measure(variant) for _ in range(3)]
+    total = min(run[0] for run in runs)
+    assert total < IMPORT_BUDGET_US, f"tiny_helper import took {total} us"
+    assert min(run[2] for run in runs) < RSS_BUDGET_KB
+
+
+@pytest.mark.parametrize("variant", VARIANTS)
+def test_heavy_modules_are_deferred(variant):
+    _, imports, _, modules = measure(variant)
+    assert not DEFERRED_MODULES & set(imports)
+    assert "requests" not in modules
@@ -0,0 +1,150 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import maintenance
+
+
+def _make_db(path, auto_vacuum="INCREMENTAL", rows=2000):
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA auto_vacuum = {auto_vacuum}")
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, blob TEXT)")
+    conn.executemany("INSERT INTO t (blob) VALUES (?)", (("x" * 500,) for _ in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def _pragma(path, name):
+    conn = sqlite3.connect(path)
+    value = conn.execute(f"PRAGMA {name}").fetchone()[0]
+    conn.close()
+    return value
+
+
+def _last(job):
+    return maintenance.stats()["jobs"][job]["last"]
+
+
+@pytest.fixture
+def backup_dir(tmp_path, monkeypatch):
+    path = tmp_path / "backups"
+    monkeypatch.setattr(maintenance, "BACKUP_DIR", str(path))
+    return path
+
+
+def test_backup_produces_an_openable_copy(tmp_path, backup_dir, monkeypatch):
+    monkeypatch.setattr(maintenance, "BACKUP_PAGES", 16)  # several steps
+    monkeypatch.setattr(maintenance, "BACKUP_STEP_PAUSE", 0)
+    src = str(tmp_path / "app.db")
+    _make_db(src)
+
+    maintenance.backup(src)
+
+    last = _last("backup")
+    assert last["error"] is None and last["steps"] > 1
+    assert os.path.dirname(last["target"]) == str(backup_dir)
+    assert last["size_bytes"] == os.path.getsize(last["target"])
+    assert not [f for f in os.listdir(backup_dir) if f.endswith(".tmp")]
+
+    conn = sqlite3.connect(last["target"])
+    assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 2000
+    conn.close()
+
+
+def test_vacuum_empties_the_freelist(tmp_path, monkeypatch):
+    monkeypatch.setattr(maintenance, "BACKUP_STEP_PAUSE", 0)
+    monkeypatch.setattr(maintenance, "VACUUM_PAGES", 64)  # more than one step
+    path = str(tmp_path / "app.db")
+    _make_db(path)
+    conn = sqlite3.connect(path)
+    conn.execute("DELETE FROM t")
+    conn.commit()
+    conn.close()
+    free_before = _pragma(path, "freelist_count")
+    size_before = os.path.getsize(path)
+    assert free_before > 64
+
+    maintenance.vacuum(path)
+
+    last = _last("vacuum")
+    assert _pragma(path, "freelist_count") == 0
+    assert last["pages_freed"] == free_before and last["free_pages"] == 0
+    assert last["steps"] >= 2
+    assert os.path.getsize(path) < size_before
+
+
+def test_vacuum_converts_old_databases_only_when_allowed(tmp_path):
+    path = str(tmp_path / "old.db")
+    _make_db(path, auto_vacuum="NONE", rows=10)
+
+    maintenance.vacuum(path)
+    assert "skipped" in _last("vacuum")
+    assert _pragma(path, "auto_vacuum") == 0
+
+    maintenance.vacuum(path, allow_full=True)
+    assert _last("vacuum")["converted"]
+    assert _pragma(path, "auto_vacuum") == 2
+
+
+def test_checkpoint_and_optimize_are_recorded(tmp_path, app_module):
+    path = str(tmp_path / "wal.db")
+    _make_db(path, rows=10)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+
+    maintenance.checkpoint(path, mode="TRUNCATE")
+    last = _last("checkpoint")
+    assert last["mode"] == "TRUNCATE" and not last["busy"] and last["error"] is None
+
+    maintenance.run_job("optimize")  # every app database
+    last = _last("optimize")
+    assert last["error"] is None and last["db"] in maintenance.database_paths()
+
+
+def _heartbeats_db(path, days_old):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE device_heartbeats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, device_key TEXT NOT NULL, ip TEXT, last_seen TEXT NOT NULL
+        )
+    """)
+    now = datetime.utcnow()
+    conn.executemany(
+        "INSERT INTO device_heartbeats (device_key, last_seen) VALUES ('k', ?)",
+        (((now - timedelta(days=d)).isoformat(),) for d in days_old)
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_prune_keeps_only_the_retention_window(tmp_path, monkeypatch):
+    monkeypatch.setattr(maintenance, "HEARTBEAT_RETENTION_DAYS", 30)
+    monkeypatch.setattr(maintenance, "PRUNE_ROWS", 100)  # several steps
+    monkeypatch.setattr(maintenance, "BACKUP_STEP_PAUSE", 0)
+    path = str(tmp_path / "hb.db")
+    # A replayed spool batch lands old timestamps at high ids too
+    _heartbeats_db(path, [40] * 250 + [1] * 50 + [45] * 10)
+
+    maintenance.prune(path)
+
+    last = _last("prune")
+    assert last["deleted"] == 260 and last["steps"] >= 3
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM device_heartbeats").fetchone()[0] == 50
+    conn.close()
+
+
+def test_prune_can_be_disabled(tmp_path, monkeypatch):
+    monkeypatch.setattr(maintenance, "HEARTBEAT_RETENTION_DAYS", 0)
+    path = str(tmp_path / "hb.db")
+    _heartbeats_db(path, [400])
+
+    maintenance.prune(path)
+    assert "skipped" in _last("prune")
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM device_heartbeats").fetchone()[0] == 1
+    conn.close()
@@ -0,0 +1,49 @@
+import pytest
+
+from pages import accepted_encodings, etag_matches
+
+
+def test_accepted_encodings_skips_q0():
+    assert accepted_encodings("gzip, br;q=0, deflate;q=0.5") == {"gzip", "deflate"}
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"x", "abc"', True),
+    ("*", True),
+    ('"abcd"', False),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, '"abc"') is expected
+
+
+@pytest.mark.parametrize("path", ["/", "/signup", "/login"])
+def test_static_page_revalidates(client, path):
+    first = client.get(path, headers={"Accept-Encoding": "identity"})
+    assert first.status_code == 200
+    assert "must-revalidate" in first.headers["cache-control"]
+
+    again = client.get(path, headers={"If-None-Match": first.headers["etag"], "Accept-Encoding": "identity"})
+    assert again.status_code == 304
+    assert again.content == b""
+
+
+def test_static_page_gzip_variant(client):
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"].endswith('-gz"')
+    assert response.headers["vary"] == "Accept-Encoding"
+
+
+def test_static_asset_served_precompressed(client):
+    response = client.get("/static/style.css", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["cache-control"] == "public, max-age=86400"
+
+    again = client.get("/static/style.css", headers={
+        "Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"],
+    })
+    assert again.status_code == 304
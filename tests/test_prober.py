@@ -0,0 +1,161 @@
+import asyncio
+import errno
+import os
+import socket
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+import prober
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def listener():
+    """A loopback port that accepts connections."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(1024)
+    yield sock.getsockname()[1]
+    sock.close()
+
+
+@pytest.fixture
+def closed_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_tcp_probe_open_and_refused_ports_are_up(listener, closed_port):
+    assert asyncio.run(prober.tcp_probe("127.0.0.1", listener))
+    # A reset still means something answered
+    assert asyncio.run(prober.tcp_probe("127.0.0.1", closed_port))
+
+
+def test_fd_exhaustion_defers_instead_of_reporting_down(monkeypatch):
+    async def no_fds(host, port):
+        raise OSError(errno.EMFILE, "Too many open files")
+
+    monkeypatch.setattr(asyncio, "open_connection", no_fds)
+    with pytest.raises(prober.ProbeDeferred):
+        asyncio.run(prober.tcp_probe("127.0.0.1", 80))
+
+
+def test_open_sockets_are_bounded(monkeypatch):
+    monkeypatch.setattr(prober, "PROBE_MAX_SOCKETS", 4)
+    monkeypatch.setattr(prober, "_socket_slots", None)
+    monkeypatch.setattr(prober, "_icmp_available", False)
+    open_now = peak = 0
+
+    async def fake_connect(host, port):
+        nonlocal open_now, peak
+        open_now += 1
+        peak = max(peak, open_now)
+        await asyncio.sleep(0.01)
+        open_now -= 1
+        raise ConnectionRefusedError()
+
+    async def main():
+        return await asyncio.gather(*(prober.probe_host(f"10.0.0.{i}") for i in range(20)))
+
+    monkeypatch.setattr(asyncio, "open_connection", fake_connect)
+    assert all(asyncio.run(main()))
+    assert peak == 4
+
+
+def test_deferred_probe_keeps_status_and_retries_soon(monkeypatch):
+    async def deferred(ip):
+        raise prober.ProbeDeferred()
+
+    recorded = []
+    monkeypatch.setattr(prober.alerts.engine, "record", lambda *args: recorded.append(args))
+    p = prober.Prober(probe=deferred)
+    p.apply_targets([(1, 7, "127.0.0.1", "online")])
+    target = p.targets[1]
+
+    async def main():
+        semaphore = asyncio.Semaphore(1)
+        await semaphore.acquire()
+        await p._probe_one(target, semaphore)
+
+    asyncio.run(main())
+    assert target.status == "online"
+    assert p.results == [] and recorded == []
+    assert p.stats["deferred"] == 1 and p.stats["down"] == 0
+    assert target.next_due - prober.time.monotonic() <= 2 * prober.PROBE_RETRY_DELAY
+
+
+def test_many_loopback_targets_under_low_fd_limit(closed_port):
+    # More targets x ports than file descriptors: none may come back "down"
+    script = textwrap.dedent(f"""
+        import asyncio, resource, sys
+        resource.setrlimit(resource.RLIMIT_NOFILE, (256, resource.getrlimit(resource.RLIMIT_NOFILE)[1]))
+        sys.path.insert(0, {str(ROOT)!r})
+        import prober
+        prober.PROBE_PORTS = ({closed_port},) * 5
+
+        async def main():
+            p = prober.Prober()
+            p.apply_targets([(i, 1, "127.0.0.1", "offline") for i in range(600)])
+            semaphore = asyncio.Semaphore(prober.PROBE_CONCURRENCY)
+            for target in list(p.targets.values()):
+                await semaphore.acquire()
+                task = asyncio.create_task(p._probe_one(target, semaphore))
+                p.tasks.add(task)
+                task.add_done_callback(p.tasks.discard)
+            while p.tasks:
+                await asyncio.sleep(0.05)
+            print(p.stats["up"], p.stats["down"], p.stats["deferred"])
+
+        asyncio.run(main())
+    """)
+    # conftest pointed the data paths at a scratch dir; the child inherits them
+    env = {**os.environ, "ALERTS_ENABLED": "0", "PROBE_MAX_SOCKETS": ""}
+    out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                         timeout=120, env=env, check=True).stdout
+    up, down, deferred = map(int, out.splitlines()[-1].split())
+    assert (up, down, deferred) == (600, 0, 0)
+
+
+@pytest.mark.parametrize("ip, expected", [
+    ("192.168.1.10", "192.168.1.10"),
+    (" 2001:db8::1 ", "2001:db8::1"),
+    ("printer.local", None),
+    ("127.0.0.1", None),
+    ("::1", None),
+    ("::ffff:127.0.0.1", None),
+    ("169.254.169.254", None),
+    ("fe80::1", None),
+    ("0.0.0.0", None),
+    ("224.0.0.1", None),
+])
+def test_check_target(ip, expected):
+    if expected is None:
+        with pytest.raises(ValueError):
+            prober.check_target(ip)
+    else:
+        assert prober.check_target(ip) == expected
+
+
+def test_local_targets_need_the_operator_setting(monkeypatch):
+    monkeypatch.setattr(prober, "PROBE_ALLOW_LOCAL", True)
+    assert prober.check_target("127.0.0.1") == "127.0.0.1"
+    with pytest.raises(ValueError):
+        prober.check_target("localhost")
+
+
+def test_add_device_rejects_unprobeable_ips(client, user):
+    _, cookies = user
+    client.cookies.update(cookies)
+    for ip in ("127.0.0.1", "169.254.169.254", "intranet.example"):
+        r = client.post("/add_device", data={"device_name": "nas", "ip": ip}, follow_redirects=False)
+        assert r.status_code == 400, ip
+    r = client.post("/add_device", data={"device_name": "nas", "ip": "10.1.2.3"}, follow_redirects=False)
+    assert r.status_code == 303
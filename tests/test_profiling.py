@@ -0,0 +1,147 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+import pytest
+
+import profiling
+from profiling import span
+
+ADMIN = {"x-admin-token": "test-admin-token"}
+
+
+@pytest.fixture
+def ring(monkeypatch):
+    ring = deque(maxlen=profiling.SLOW_REQUEST_RING)
+    monkeypatch.setattr(profiling, "_slow_requests", ring)
+    return ring
+
+
+def _blocking_query(seconds):
+    with span("db"):
+        time.sleep(seconds)
+
+
+async def _request(path, seconds):
+    token = profiling.start_request()
+    started = time.perf_counter()
+    await asyncio.to_thread(_blocking_query, seconds)
+    with span("render"):
+        with span("render"):  # nested spans of one kind count once
+            pass
+    profiling.finish_request(token, "GET", path, 200, time.perf_counter() - started)
+
+
+def test_spans_follow_the_request_into_threads(ring, monkeypatch):
+    monkeypatch.setattr(profiling, "SLOW_REQUEST_MS", 0)
+
+    async def main():
+        await asyncio.gather(_request("/a", 0.05), _request("/b", 0.01))
+    asyncio.run(main())
+
+    by_path = {r["path"]: r for r in profiling.slow_requests()}
+    assert set(by_path) == {"/a", "/b"}
+    # Each request only sees its own thread work, not the other's
+    assert by_path["/a"]["spans"]["db_ms"] >= 50
+    assert 10 <= by_path["/b"]["spans"]["db_ms"] < 50
+    for r in by_path.values():
+        assert r["spans"]["db_calls"] == 1 and r["spans"]["render_calls"] == 1
+        assert r["spans"]["other_ms"] >= 0
+
+
+def test_spans_outside_a_request_are_ignored(ring, monkeypatch):
+    monkeypatch.setattr(profiling, "SLOW_REQUEST_MS", 0)
+    _blocking_query(0)
+    assert not ring
+
+
+def test_only_slow_requests_are_kept(ring):
+    fast = profiling.SLOW_REQUEST_MS / 1000 / 2
+    slow = profiling.SLOW_REQUEST_MS / 1000 * 2
+    profiling.finish_request(profiling.start_request(), "GET", "/fast", 200, fast)
+    profiling.finish_request(profiling.start_request(), "GET", "/slow", 200, slow)
+
+    assert [r["path"] for r in profiling.slow_requests()] == ["/slow"]
+    assert profiling.slow_requests()[0]["total_ms"] == pytest.approx(slow * 1000)
+
+
+def test_slow_request_ring_is_bounded(monkeypatch):
+    assert profiling._slow_requests.maxlen == profiling.SLOW_REQUEST_RING
+    monkeypatch.setattr(profiling, "_slow_requests", deque(maxlen=3))
+    for i in range(5):
+        profiling.finish_request(profiling.start_request(), "GET", f"/{i}", 200, 10)
+    assert [r["path"] for r in profiling.slow_requests()] == ["/2", "/3", "/4"]
+
+
+def _busy_worker(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@pytest.fixture
+def worker():
+    stop = threading.Event()
+    thread = threading.Thread(target=_busy_worker, args=(stop,), name="busy-worker")
+    thread.start()
+    yield
+    stop.set()
+    thread.join()
+
+
+def test_speedscope_profile_is_valid(worker, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    path = profiling.run_profile(0)  # clamped to one second
+
+    with open(path) as f:
+        data = json.load(f)
+    assert data["$schema"] == "https://www.speedscope.app/file-format-schema.json"
+    frames = data["shared"]["frames"]
+    profile = next(p for p in data["profiles"] if p["name"] == "busy-worker")
+    assert profile["type"] == "sampled" and profile["endValue"] == 1
+    assert len(profile["samples"]) == len(profile["weights"]) > 0
+    assert all(0 <= i < len(frames) for stack in profile["samples"] for i in stack)
+    assert any(frames[i]["name"] == "_busy_worker" for stack in profile["samples"] for i in stack)
+
+
+def test_folded_profile_is_valid(worker, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    path = profiling.run_profile(1, "folded")
+
+    assert path.endswith(".folded")
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0 and stack
+    assert any(line.startswith("busy-worker;") and "_busy_worker (test_profiling.py:" in line for line in lines)
+
+
+def test_profile_endpoint_needs_the_admin_token(client):
+    assert client.post("/admin/profile").status_code == 403
+    assert client.post("/admin/profile", headers={"x-admin-token": "wrong"}).status_code == 403
+    assert client.get("/admin/slow-requests").status_code == 403
+
+
+def test_profile_endpoint_rejects_unknown_formats(client):
+    r = client.post("/admin/profile?format=pprof", headers=ADMIN)
+    assert r.status_code == 400
+
+
+def test_profile_endpoint_refuses_a_second_profile(client, monkeypatch):
+    monkeypatch.setattr(profiling, "_profile_running", True)
+    r = client.post("/admin/profile?seconds=1", headers=ADMIN)
+    assert r.status_code == 409
+    # run_profile itself refuses too, for the signal handler path
+    assert profiling.run_profile(1) is None
+
+
+def test_slow_requests_endpoint(client, ring, monkeypatch):
+    monkeypatch.setattr(profiling, "SLOW_REQUEST_MS", 0)
+    client.get("/admin/slow-requests", headers=ADMIN)
+    r = client.get("/admin/slow-requests", headers=ADMIN)
+    assert r.status_code == 200
+    assert r.json()["threshold_ms"] == 0
+    assert any(req["path"] == "/admin/slow-requests" for req in r.json()["requests"])
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+import session_tokens
+from db import get_db
+
+
+@pytest.fixture(autouse=True)
+def keys(app_module, monkeypatch):
+    monkeypatch.setattr(session_tokens, "ACTIVE_KID", "k2")
+    monkeypatch.setattr(session_tokens, "SIGNING_KEYS", {"k2": b"secret-2", "k1": b"secret-1"})
+
+
+def test_round_trip():
+    payload = session_tokens.verify(session_tokens.issue("alice", 7))
+    assert payload["u"] == "alice"
+    assert payload["uid"] == 7
+
+
+def test_old_key_still_verifies_after_rotation(monkeypatch):
+    monkeypatch.setattr(session_tokens, "ACTIVE_KID", "k1")
+    token = session_tokens.issue("alice", 7)
+    monkeypatch.setattr(session_tokens, "ACTIVE_KID", "k2")
+    assert session_tokens.verify(token) is not None
+
+    monkeypatch.setattr(session_tokens, "SIGNING_KEYS", {"k2": b"secret-2"})
+    assert session_tokens.verify(token) is None
+
+
+@pytest.mark.parametrize("mangle", [
+    lambda t: t[:-2] + ("AA" if not t.endswith("AA") else "BB"),   # signature
+    lambda t: t.replace(".k2.", ".k9."),                            # unknown key
+    lambda t: t + ".extra",
+    lambda t: t[:-1] + "é",                                         # non-ASCII
+    lambda t: "v1.k2.é.é",
+])
+def test_tampered_tokens_are_rejected(mangle):
+    assert session_tokens.verify(mangle(session_tokens.issue("alice", 7))) is None
+
+
+def test_expired_token(monkeypatch):
+    monkeypatch.setattr(session_tokens, "SESSION_TTL", -1)
+    assert session_tokens.verify(session_tokens.issue("alice", 7)) is None
+
+
+def test_revocation_reaches_other_workers():
+    token = session_tokens.issue("alice", 7)
+    payload = session_tokens.verify(token)
+
+    # Another worker logs the session out: only the table changes here
+    conn = get_db()
+    conn.execute(
+        "INSERT INTO revoked_sessions (jti, expires_at) VALUES (?, ?)",
+        (payload["jti"], payload["exp"])
+    )
+    conn.commit()
+    conn.close()
+
+    assert session_tokens.verify(token) is not None
+    session_tokens.load_new_revocations()
+    assert session_tokens.verify(token) is None
+
+
+def test_reap_drops_expired_revocations():
+    conn = get_db()
+    conn.execute("INSERT INTO revoked_sessions (jti, expires_at) VALUES ('gone', ?)", (int(time.time()) - 10,))
+    conn.commit()
+    conn.close()
+
+    session_tokens.reap()
+    assert "gone" not in session_tokens._revoked
+
+
+def test_generated_key_is_shared_between_workers(monkeypatch):
+    monkeypatch.delenv("SESSION_KEYS", raising=False)
+    session_tokens.load_keys()
+    first = dict(session_tokens.SIGNING_KEYS)
+    # A second worker process runs the same startup
+    session_tokens.load_keys()
+    assert session_tokens.SIGNING_KEYS == first
+
+
+def test_non_ascii_cookie_is_not_a_server_error(client):
+    response = client.get("/dashboard", headers={"Cookie": "session=v1.dev.abc.é".encode()},
+                          follow_redirects=False)
+    assert response.status_code == 303
@@ -0,0 +1,133 @@
+import threading
+import uuid
+import zlib
+from datetime import datetime
+
+import pytest
+
+import db
+import reshard
+from db import (
+    ShardWriter, connect, get_shard_db, init_device_files, new_device_id_sql, shard_for_key, shard_paths,
+)
+
+
+def test_routing_is_stable_crc32():
+    key = "3f1c2a9e-0000-4000-8000-000000000000"
+    for count in (1, 2, 4, 8):
+        assert shard_for_key(key, count) == zlib.crc32(key.encode()) % count
+    # Keys spread over all shards
+    assert {shard_for_key(str(uuid.uuid4()), 4) for _ in range(200)} == {0, 1, 2, 3}
+
+
+def _insert(conn, shard, count, key):
+    conn.execute(f"""
+        INSERT INTO devices (id, user_id, device_key, device_name, status, last_seen)
+        VALUES ({new_device_id_sql(shard, count)}, 1, ?, 'dev', 'offline', ?)
+    """, (key, datetime.utcnow().isoformat()))
+    return conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+
+
+def test_new_ids_stay_in_the_shard_residue_class():
+    count = 3
+    init_device_files(count)
+    for shard, path in enumerate(shard_paths(count)):
+        conn = connect(path)
+        ids = [_insert(conn, shard, count, str(uuid.uuid4())) for _ in range(5)]
+        # A deleted top id is never handed out again (AUTOINCREMENT)
+        conn.execute("DELETE FROM devices WHERE id=?", (ids[-1],))
+        ids.append(_insert(conn, shard, count, str(uuid.uuid4())))
+        conn.commit()
+        conn.close()
+
+        assert all(i % count == shard for i in ids)
+        assert ids == sorted(set(ids))
+
+
+def _device_count(key):
+    conn = get_shard_db(0)
+    n = conn.execute("SELECT COUNT(*) FROM devices WHERE device_key=?", (key,)).fetchone()[0]
+    conn.close()
+    return n
+
+
+def _add_row(conn, key):
+    conn.execute(
+        "INSERT INTO devices (user_id, device_key, device_name, status) VALUES (1, ?, 'dev', 'offline')", (key,)
+    )
+
+
+def _fail_after_write(conn, key):
+    _add_row(conn, key)
+    raise RuntimeError("job failed")
+
+
+def _slow(conn, started, release):
+    started.set()
+    release.wait(5)
+
+
+def test_failing_job_does_not_undo_the_rest_of_its_group(app_module):
+    writer = ShardWriter(0)
+    started, release = threading.Event(), threading.Event()
+    first = writer.submit(_slow, started, release)
+    started.wait(5)
+
+    # Queued behind the slow job, so all three share one transaction
+    good, bad, also_good = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+    futures = [writer.submit(_add_row, good), writer.submit(_fail_after_write, bad), writer.submit(_add_row, also_good)]
+    release.set()
+
+    first.result(5)
+    futures[0].result(5)
+    with pytest.raises(RuntimeError):
+        futures[1].result(5)
+    futures[2].result(5)
+    assert (_device_count(good), _device_count(bad), _device_count(also_good)) == (1, 0, 1)
+
+
+def test_cancelled_job_does_not_kill_the_writer(app_module):
+    writer = ShardWriter(0)
+    started, release = threading.Event(), threading.Event()
+    writer.submit(_slow, started, release)
+    started.wait(5)
+
+    cancelled_key = str(uuid.uuid4())
+    cancelled = writer.submit(_add_row, cancelled_key)
+    assert cancelled.cancel()  # e.g. the client disconnected
+    release.set()
+
+    key = str(uuid.uuid4())
+    writer.submit(_add_row, key).result(5)
+    assert _device_count(key) == 1
+    assert _device_count(cancelled_key) == 0
+    assert writer.thread.is_alive()
+
+
+def test_reshard_moves_devices_into_the_new_layout(app_module, user, add_device):
+    user_id, _ = user
+    for _ in range(20):
+        add_device(user_id)
+    conn = connect(db.DB_PATH)
+    source = sorted(conn.execute("SELECT device_key, device_name, status FROM devices").fetchall())
+    heartbeats = conn.execute("SELECT COUNT(*) FROM device_heartbeats").fetchone()[0]
+    conn.close()
+
+    count = 4
+    reshard.reshard(1, count)
+
+    moved, moved_heartbeats = [], 0
+    for shard, path in enumerate(shard_paths(count)):
+        conn = connect(path)
+        rows = conn.execute("SELECT id, device_key, device_name, status FROM devices").fetchall()
+        moved_heartbeats += conn.execute("SELECT COUNT(*) FROM device_heartbeats").fetchone()[0]
+        conn.close()
+        for device_id, key, name, status in rows:
+            assert shard_for_key(key, count) == shard and device_id % count == shard
+            moved.append((key, name, status))
+    assert sorted(moved) == source
+    assert moved_heartbeats == heartbeats
+
+    # A second run refuses to write into a non-empty layout
+    with pytest.raises(SystemExit):
+        reshard.reshard(1, count)
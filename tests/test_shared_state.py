@@ -0,0 +1,148 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import fakeredis
+import pytest
+
+import shared_state
+from db import device_db
+
+
+@pytest.fixture
+def redis_server(monkeypatch, app_module):
+    """Turns the shared tier on against an in-process fakeredis server."""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(shared_state, "enabled", True)
+    monkeypatch.setattr(shared_state, "_redis", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(shared_state, "_needs_reseed", False)
+    monkeypatch.setattr(shared_state, "_owner_cache", {})
+    return server
+
+
+def _device(key):
+    conn = device_db(key)
+    row = conn.execute("SELECT status, last_seen FROM devices WHERE device_key=?", (key,)).fetchone()
+    conn.close()
+    return row
+
+
+def test_registration_falls_back_to_sqlite(client, redis_server):
+    redis_server.connected = False
+    fallbacks = shared_state.stats()["fallbacks"]
+    token = str(uuid.uuid4())
+
+    r = client.post("/add_device_advanced_token", json={"token": token, "device_name": "laptop"})
+    assert r.status_code == 200
+    assert _device(token)[0] == "online"
+    assert shared_state.stats()["fallbacks"] == fallbacks + 1
+    assert shared_state._needs_reseed
+
+
+def test_heartbeat_falls_back_to_sqlite(client, redis_server, user, add_device):
+    user_id, _ = user
+    key = add_device(user_id, status="offline")
+    redis_server.connected = False
+
+    r = client.post("/device_heartbeat", json={"token": key})
+    assert r.status_code == 200
+    assert _device(key)[0] == "online"
+    assert shared_state._needs_reseed
+
+
+def test_dashboard_falls_back_to_sqlite(client, redis_server, user, add_device):
+    import dashboard_cache
+
+    user_id, cookies = user
+    key = add_device(user_id, status="online")
+    redis_server.connected = False
+    client.cookies.update(cookies)
+
+    r = client.get("/dashboard")
+    assert r.status_code == 200
+    assert f"dev-{key[:8]}" in r.text
+    # Not cached, so the live view comes back with Redis
+    assert dashboard_cache.get(user_id, dashboard_cache.version(user_id)) is None
+
+
+def test_sweep_reseeds_presence_after_outage(redis_server, user, add_device):
+    user_id, _ = user
+    key = add_device(user_id, status="online")  # heartbeat SQLite took during the outage
+    old = time.time() - 10 * shared_state.LIVENESS_TTL
+
+    async def scenario():
+        # Scored before the outage, liveness long expired
+        await shared_state._redis.zadd("presence", {key: old})
+        shared_state.record_fallback()
+        stale = await shared_state.sweep()
+        return stale, await shared_state._redis.zscore("presence", key), await shared_state._redis.exists(f"live:{key}")
+
+    stale, score, live = asyncio.run(scenario())
+    assert stale == []
+    assert score > old and live
+    assert _device(key)[0] == "online"
+    assert not shared_state._needs_reseed
+
+
+def test_reseed_is_retried_while_redis_is_down(redis_server):
+    redis_server.connected = False
+    shared_state.record_fallback()
+    with pytest.raises(shared_state.RedisError):
+        asyncio.run(shared_state.sweep())
+    assert shared_state._needs_reseed
+
+
+def test_sweep_takes_expired_devices_offline(redis_server, user, add_device):
+    user_id, _ = user
+    seen = (datetime.utcnow() - timedelta(seconds=10 * shared_state.LIVENESS_TTL)).isoformat()
+    key = add_device(user_id, status="online", last_seen=seen)
+
+    async def scenario():
+        await shared_state._seed_presence()
+        return await shared_state.sweep()
+
+    stale = asyncio.run(scenario())
+    assert user_id in {u for _, u in stale}
+    assert _device(key)[0] == "offline"
+
+
+def test_run_survives_redis_down_at_boot(redis_server, monkeypatch):
+    monkeypatch.setattr(shared_state, "LEADER_TTL", 3)  # elects every second
+    monkeypatch.setattr(shared_state, "_leader", False)
+    redis_server.connected = False
+
+    async def scenario():
+        task = asyncio.create_task(shared_state.run())
+        await asyncio.sleep(0.3)
+        alive_while_down = not task.done() and not shared_state.is_leader()
+        redis_server.connected = True
+        for _ in range(30):
+            if shared_state.is_leader():
+                break
+            await asyncio.sleep(0.1)
+        task.cancel()
+        return alive_while_down
+
+    assert asyncio.run(scenario())
+    assert shared_state.is_leader()
+    assert shared_state._needs_reseed  # the first sweep seeds presence
+
+
+def test_offline_sweep_falls_back_to_sqlite(app_module, redis_server, monkeypatch, user, add_device):
+    user_id, _ = user
+    seen = (datetime.utcnow() - timedelta(minutes=10)).isoformat()
+    key = add_device(user_id, status="online", last_seen=seen)
+    monkeypatch.setattr(shared_state, "SWEEP_INTERVAL", 0.01)
+    redis_server.connected = False
+
+    async def scenario():
+        task = asyncio.create_task(app_module.offline_sweep_loop())
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if _device(key)[0] == "offline":
+                break
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert _device(key)[0] == "offline"
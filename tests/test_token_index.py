@@ -0,0 +1,101 @@
+import token_index
+from token_index import BloomFilter, TokenIndex
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    keys = [f"key-{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom = BloomFilter(10_000, 0.01)
+    for i in range(10_000):
+        bloom.add(f"in-{i}")
+    false_positives = sum(f"out-{i}" in bloom for i in range(10_000))
+    assert false_positives < 10_000 * 0.02
+
+
+def test_index_tracks_registrations_and_deletions(app_module, add_device):
+    index = TokenIndex()
+    key = add_device(None)
+    index.load()
+    assert index.might_exist(key)
+    assert not index.might_exist("never-registered")
+
+    index.discard(key)
+    assert not index.might_exist(key)
+    assert index.stats()["rejects"] == 2
+
+
+def test_refresh_picks_up_rows_from_other_workers(app_module, add_device):
+    index = TokenIndex()
+    index.load()
+    key = add_device(None)  # written by "someone else"
+    assert not index.might_exist(key)
+    index.refresh()
+    assert index.might_exist(key)
+
+
+def test_switches_to_bloom_filter_past_the_limit(app_module, add_device, monkeypatch):
+    for _ in range(3):
+        add_device(None)
+    monkeypatch.setattr(token_index, "TOKEN_INDEX_SET_LIMIT", 1)
+    index = TokenIndex()
+    index.load()
+    assert index.stats()["mode"] == "bloom"
+
+
+def test_unknown_token_is_rejected_without_the_database(client, monkeypatch):
+    import main
+
+    def no_db(*args):
+        raise AssertionError("database touched")
+
+    monkeypatch.setattr(main, "shard_write", no_db)
+    response = client.post("/device_heartbeat", json={"token": "garbage-token"})
+    assert response.status_code == 404
+
+
+def test_miss_refreshes_at_most_once_per_interval(app_module, add_device, monkeypatch):
+    monkeypatch.setattr(token_index, "TOKEN_INDEX_MISS_REFRESH", 60)
+    index = TokenIndex()
+    index.load()
+    key = add_device(None)  # registered on another worker
+    assert not index.might_exist(key)
+    assert index.recheck(key)
+
+    late = add_device(None)
+    assert not index.recheck(late)  # within the interval: rejected
+    assert index.stats()["miss_refreshes"] == 1 and index.stats()["late_hits"] == 1
+
+
+def _register_elsewhere(user_id):
+    """A device row this worker's index hasn't seen."""
+    import uuid
+
+    from db import get_shard_db, new_device_id_sql, shard_for_key
+
+    key = str(uuid.uuid4())
+    shard = shard_for_key(key)
+    conn = get_shard_db(shard)
+    conn.execute(f"""
+        INSERT INTO devices (id, user_id, device_key, device_name, status)
+        VALUES ({new_device_id_sql(shard)}, ?, ?, 'elsewhere', 'offline')
+    """, (user_id, key))
+    conn.commit()
+    conn.close()
+    return key
+
+
+def test_first_heartbeat_after_registering_on_another_worker(client, user, monkeypatch):
+    monkeypatch.setattr(token_index, "TOKEN_INDEX_MISS_REFRESH", 0)
+    key = _register_elsewhere(user[0])
+    assert not token_index.index.might_exist(key)
+
+    assert client.post("/device_heartbeat", json={"token": key}).status_code == 200
+    batch = {"token": _register_elsewhere(user[0]), "heartbeats": [{"ip": "10.0.0.1", "ts": "2024-01-01T00:00:00"}]}
+    assert client.post("/device_heartbeat_batch", json=batch).status_code == 200
+    assert client.post("/device_heartbeat", json={"token": "garbage-token"}).status_code == 404
@@ -0,0 +1,93 @@
+import gzip
+import json
+import uuid
+
+import msgpack
+import pytest
+
+import wire
+from db import device_db
+
+
+def _registration(**extra):
+    return {"token": str(uuid.uuid4()), "device_name": "laptop", **extra}
+
+
+def _stored_sites(token):
+    conn = device_db(token)
+    row = conn.execute("SELECT recent_sites FROM devices WHERE device_key=?", (token,)).fetchone()
+    conn.close()
+    return row[0]
+
+
+def test_registration_accepts_null_recent_sites(client):
+    payload = _registration(recent_sites=None)
+    r = client.post("/add_device_advanced_token", json=payload)
+    assert r.status_code == 200
+    assert _stored_sites(payload["token"]) == "None"
+
+
+@pytest.mark.parametrize("media_type, encode", [
+    ("application/json", lambda p: json.dumps(p).encode()),
+    ("application/msgpack", msgpack.packb),
+])
+def test_registration_in_each_format(client, media_type, encode):
+    payload = _registration(recent_sites=["example.com"])
+    r = client.post("/add_device_advanced_token", content=encode(payload),
+                    headers={"Content-Type": media_type})
+    assert r.status_code == 200
+    assert _stored_sites(payload["token"]) == "['example.com']"
+
+
+def test_unknown_content_type_is_415(client):
+    r = client.post("/add_device_advanced_token", content=b"x", headers={"Content-Type": "text/plain"})
+    assert r.status_code == 415
+
+
+def test_oversized_body_is_413_with_and_without_length(client):
+    body = json.dumps(_registration(recent_sites=["x" * wire.MAX_BODY_BYTES])).encode()
+    r = client.post("/add_device_advanced_token", content=body,
+                    headers={"Content-Type": "application/json"})
+    assert r.status_code == 413
+
+    def chunked():
+        # No Content-Length: the limit has to hold while streaming
+        for i in range(0, len(body), 64 * 1024):
+            yield body[i:i + 64 * 1024]
+
+    r = client.post("/add_device_advanced_token", content=chunked(),
+                    headers={"Content-Type": "application/json"})
+    assert r.status_code == 413
+
+
+def test_gzip_bomb_is_413(client):
+    bomb = gzip.compress(b" " * (wire.MAX_BODY_BYTES * 4))
+    assert len(bomb) < wire.MAX_BODY_BYTES
+    r = client.post("/add_device_advanced_token", content=bomb,
+                    headers={"Content-Type": "application/json", "Content-Encoding": "gzip"})
+    assert r.status_code == 413
+
+
+def test_gzip_body_is_inflated(client):
+    payload = _registration()
+    r = client.post("/add_device_advanced_token", content=gzip.compress(json.dumps(payload).encode()),
+                    headers={"Content-Type": "application/json", "Content-Encoding": "gzip"})
+    assert r.status_code == 200
+
+
+def test_helper_defaults_to_json(helper):
+    assert helper.encode_payload({"a": 1}) == (b'{"a": 1}', "application/json")
+
+
+def test_helper_falls_back_to_json_on_415(helper, monkeypatch):
+    monkeypatch.setattr(helper, "WIRE_FORMAT", "msgpack")
+    sent = []
+
+    def fake_request(method, url, body=None, headers=None, timeout=10):
+        sent.append(headers["Content-Type"])
+        return (415 if headers["Content-Type"] != "application/json" else 200), "", {}
+
+    monkeypatch.setattr(helper, "http_request", fake_request)
+    assert helper.post_payload("http://backend/x", {"token": "t"})[0] == 200
+    assert helper.post_payload("http://backend/x", {"token": "t"})[0] == 200
+    assert sent == ["application/msgpack", "application/json", "application/json"]
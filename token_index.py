@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import math
+import os
+import threading
+import time
+
+from db import DB_SHARDS, get_shard_db
+
+# --------------------------------------------------
+# DEVICE TOKEN INDEX
+# --------------------------------------------------
+# Lets device_heartbeat reject unknown tokens without a database query.
+# Positives are always confirmed by the database, so the index only has to
+# be a superset of the valid keys: an exact set for normal fleets, a Bloom
+# filter once the fleet grows past TOKEN_INDEX_SET_LIMIT.
+# With several workers, keys registered or imported on another one arrive
+# with the next periodic refresh. Until then a miss triggers a refresh of
+# its own (only rows past the last seen id, at most once every
+# TOKEN_INDEX_MISS_REFRESH seconds) before the token is rejected.
+TOKEN_INDEX_SET_LIMIT = int(os.getenv("TOKEN_INDEX_SET_LIMIT", 1_000_000))
+TOKEN_INDEX_FP_RATE = float(os.getenv("TOKEN_INDEX_FP_RATE", 0.01))
+TOKEN_INDEX_REFRESH = int(os.getenv("TOKEN_INDEX_REFRESH", 30))
+TOKEN_INDEX_MISS_REFRESH = float(os.getenv("TOKEN_INDEX_MISS_REFRESH", 1))
+
+
+class BloomFilter:
+    def __init__(self, capacity, fp_rate):
+        capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class TokenIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # the loop and misses both refresh
+        self._last_miss_refresh = 0.0
+        self._keys = set()
+        self._bloom = None
+        self._max_ids = [0] * DB_SHARDS  # highest device id seen, per shard
+        self._stale = 0
+        self._stats = {"hits": 0, "rejects": 0, "false_positives": 0, "miss_refreshes": 0, "late_hits": 0}
+
+    def load(self):
+        """(Re)builds the index from the devices table of every shard."""
+        # A key lives on exactly one shard, so per-shard counts add up
+        count, max_ids = 0, []
+        for shard in range(DB_SHARDS):
+            conn = get_shard_db(shard)
+            shard_count, max_id = conn.execute(
+                "SELECT COUNT(DISTINCT device_key), COALESCE(MAX(id), 0) FROM devices"
+            ).fetchone()
+            conn.close()
+            count += shard_count
+            max_ids.append(max_id)
+
+        if count > TOKEN_INDEX_SET_LIMIT:
+            keys, bloom = None, BloomFilter(count * 2, TOKEN_INDEX_FP_RATE)
+        else:
+            keys, bloom = set(), None
+
+        for shard in range(DB_SHARDS):
+            conn = get_shard_db(shard)
+            cur = conn.cursor()
+            cur.execute("SELECT DISTINCT device_key FROM devices")
+            while True:
+                rows = cur.fetchmany(10000)
+                if not rows:
+                    break
+                for (key,) in rows:
+                    if bloom is not None:
+                        bloom.add(key)
+                    else:
+                        keys.add(key)
+            conn.close()
+
+        with self._lock:
+            self._keys, self._bloom = keys, bloom
+            self._max_ids = max_ids
+            self._stale = 0
+
+    def refresh(self):
+        """Picks up rows written by other workers since the last load/refresh."""
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self):
+        if self._bloom is not None and self._stale > TOKEN_INDEX_SET_LIMIT // 10:
+            self.load()
+            return
+
+        for shard in range(DB_SHARDS):
+            conn = get_shard_db(shard)
+            rows = conn.execute(
+                "SELECT id, device_key FROM devices WHERE id > ? ORDER BY id",
+                (self._max_ids[shard],)
+            ).fetchall()
+            conn.close()
+
+            for row_id, key in rows:
+                self.add(key)
+                self._max_ids[shard] = max(self._max_ids[shard], row_id)
+
+    def add(self, key):
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(key)
+            else:
+                self._keys.add(key)
+
+    def discard(self, key):
+        with self._lock:
+            if self._bloom is not None:
+                # Bloom filters can't forget; rebuild once enough keys went stale
+                self._stale += 1
+            else:
+                self._keys.discard(key)
+
+    def _contains(self, key):
+        return key in (self._bloom if self._bloom is not None else self._keys)
+
+    def might_exist(self, key):
+        with self._lock:
+            found = self._contains(key)
+            self._stats["hits" if found else "rejects"] += 1
+            return found
+
+    def recheck(self, key):
+        """After a miss: refreshes (rate-limited) and looks again."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_miss_refresh < TOKEN_INDEX_MISS_REFRESH:
+                return False
+            self._last_miss_refresh = now
+            self._stats["miss_refreshes"] += 1
+
+        self.refresh()
+        with self._lock:
+            found = self._contains(key)
+            if found:
+                self._stats["late_hits"] += 1
+            return found
+
+    def record_false_positive(self):
+        with self._lock:
+            self._stats["false_positives"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": "bloom" if self._bloom is not None else "set",
+                "size": len(self._keys) if self._bloom is None else None,
+                "bloom_bytes": len(self._bloom.bits) if self._bloom is not None else None,
+                **self._stats,
+            }
+
+
+index = TokenIndex()
+
+
+async def refresh_loop():
+    while True:
+        await asyncio.sleep(TOKEN_INDEX_REFRESH)
+        try:
+            await asyncio.to_thread(index.refresh)
+        except Exception as e:
+            print("Token index refresh error:", e)
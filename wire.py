@@ -0,0 +1,150 @@
+import json
+import zlib
+from typing import Any, List, Optional
+
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib json module
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# --------------------------------------------------
+# HELPER PAYLOADS
+# --------------------------------------------------
+# Pydantic builds the validators once, when the classes are defined.
+class HelperPayload(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    token: str = Field(min_length=1)
+
+
+class DeviceRegistration(HelperPayload):
+    device_name: str = Field(min_length=1)
+    ip: Optional[str] = None
+    mac: Optional[str] = None
+    os: Optional[str] = None
+    recent_sites: Optional[List[Any]] = []
+
+
+class Heartbeat(HelperPayload):
+    ip: Optional[str] = None
+
+
+class SpooledHeartbeat(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    ts: str = Field(min_length=1)
+    ip: Optional[str] = None
+
+
+class HeartbeatBatch(HelperPayload):
+    heartbeats: List[SpooledHeartbeat] = []
+
+# --------------------------------------------------
+# ENCODINGS
+# --------------------------------------------------
+MAX_BODY_BYTES = 1024 * 1024
+
+
+def json_loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def json_dumps(obj) -> bytes:
+    if orjson:
+        # The stdlib encoder turns int keys into strings; orjson needs telling
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+DECODERS = {"application/json": json_loads}
+ENCODERS = {"application/json": json_dumps}
+
+if msgpack is not None:
+    for media_type in ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack"):
+        DECODERS[media_type] = lambda data: msgpack.unpackb(data, raw=False)
+    ENCODERS["application/msgpack"] = msgpack.packb
+
+if cbor2 is not None:
+    DECODERS["application/cbor"] = cbor2.loads
+    ENCODERS["application/cbor"] = cbor2.dumps
+
+
+class WireError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+async def read_body(request, limit=MAX_BODY_BYTES):
+    """Reads the body, giving up as soon as it (or what it inflates to) passes limit."""
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > limit:
+        raise WireError(413, "Body too large")
+
+    gzipped = request.headers.get("content-encoding") == "gzip"
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    chunks, received, size = [], 0, 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if inflater is not None:
+            try:
+                chunk = inflater.decompress(chunk, limit + 1 - size)
+            except zlib.error:
+                raise WireError(400, "Invalid gzip body")
+            if inflater.unconsumed_tail:
+                raise WireError(413, "Body too large")
+        size += len(chunk)
+        if size > limit or received > limit:
+            raise WireError(413, "Body too large")
+        chunks.append(chunk)
+
+    return b"".join(chunks)
+
+
+async def decode(request, model, missing_message="Invalid payload"):
+    """Reads, decodes (by Content-Type) and validates a helper request body."""
+    media_type = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    decoder = DECODERS.get(media_type)
+    if decoder is None:
+        raise WireError(415, f"Unsupported content type: {media_type}")
+
+    body = await read_body(request)
+    try:
+        data = decoder(body)
+    except Exception:
+        raise WireError(400, "Malformed body")
+
+    try:
+        return model.model_validate(data)
+    except ValidationError:
+        raise WireError(400, missing_message)
+
+
+def respond(request, data, status_code=200):
+    """Encodes a response in the first format the client Accepts."""
+    accept = request.headers.get("accept", "")
+    for media_type, encoder in ENCODERS.items():
+        if media_type != "application/json" and media_type in accept:
+            return Response(encoder(data), status_code=status_code, media_type=media_type)
+    return FastJSONResponse(data, status_code=status_code)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed."""
+
+    def render(self, content) -> bytes:
+        return json_dumps(content)